@@ -6,7 +6,7 @@ import time
 from flask import Flask
 from routes import blueprint
 
-from faces import init_milvus, close_milvus, _default_user, _default_password
+from faces import init_milvus, close_milvus, init_metadata_cache, _default_user, _default_password
 from users import _get_client as init_redis
 from auth import _get_firebase_client
 from minio_uploader import _client_with_initialized_bucket
@@ -88,6 +88,19 @@ def create_app():
     app.config['METRICS_USER'] = os.environ.get('METRICS_USER','metrics')
     app.config['METRICS_PASSWORD'] = os.environ.get('METRICS_PASSWORD')
     app.config['WRONGFULLY_DISABLED_USERS_WORKERS'] = int(os.environ.get('WRONGFULLY_DISABLED_USERS_WORKERS',1))
+    # batch: all similarity pictures are detected and embedded in one pass, parallel: pictures are evaluated speculatively on SIMILARITY_WORKERS threads and stopped at the first match
+    app.config['SIMILARITY_EVALUATION'] = os.environ.get('SIMILARITY_EVALUATION', 'batch')
+    app.config['SIMILARITY_WORKERS'] = int(os.environ.get('SIMILARITY_WORKERS', 3))
+    # embeddings of stored photos are cached in redis for that many seconds (0 = disabled), and the last EMBEDDING_CACHE_SIZE of them in every worker
+    app.config['EMBEDDING_CACHE_TTL'] = int(os.environ.get('EMBEDDING_CACHE_TTL', 7 * 24 * 3600))
+    app.config['EMBEDDING_CACHE_SIZE'] = int(os.environ.get('EMBEDDING_CACHE_SIZE', 1024))
+    # primary / secondary face metadata read from milvus are cached in every worker for that many seconds (0 = disabled), up to METADATA_CACHE_SIZE pictures
+    app.config['METADATA_CACHE_TTL'] = int(os.environ.get('METADATA_CACHE_TTL', 3600))
+    app.config['METADATA_CACHE_SIZE'] = int(os.environ.get('METADATA_CACHE_SIZE', 20000))
+    # similarity pictures are decoded at 1/2, 1/4 or 1/8 of the jpeg size while their longest side stays at least that big, 0 = full size
+    app.config['REDUCED_DECODE_SIZE'] = int(os.environ.get('REDUCED_DECODE_SIZE', 0))
+    # (width, height) of the pictures expected from clients, face detectors are warmed up for them at startup
+    app.config['DETECTOR_WARMUP_SIZES'] = [tuple(int(d) for d in size.split("x")) for size in os.environ.get('DETECTOR_WARMUP_SIZES', '640x480,480x640').split(",") if size]
     with app.app_context():
         when_ready(app)
 
@@ -100,6 +113,7 @@ def when_ready(app):
     init_milvus()
     logging.warning(f"initing redis PID:{os.getpid()}")
     init_redis()
+    init_metadata_cache(app.config['METADATA_CACHE_TTL'], app.config['METADATA_CACHE_SIZE'])
     logging.warning(f"initing firebase PID:{os.getpid()}")
     _get_firebase_client()
     if app.config['MINIO_URI']:
@@ -0,0 +1,68 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import numpy as np
+import cv2
+
+_executor = None
+_reduced_flags = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+def _get_executor():
+    global _executor
+    if not _executor:
+        # cv2.imdecode releases the GIL, so pictures of a request are decoded on several cores
+        _executor = ThreadPoolExecutor(max_workers=int(os.environ.get("DECODE_WORKERS", min(8, os.cpu_count() or 1))), thread_name_prefix="decode")
+
+    return _executor
+
+def decode(data: bytes, flags = cv2.IMREAD_COLOR):
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+def _reduction(data: bytes, min_side: int):
+    # jpeg is decoded at 1/2, 1/4 or 1/8 of the size in the DCT domain, other formats would be decoded at full size anyway
+    try:
+        with Image.open(io.BytesIO(data)) as header:
+            if header.format != "JPEG":
+                return 1, cv2.IMREAD_COLOR
+            side = max(header.size)
+    except Exception:
+        return 1, cv2.IMREAD_COLOR
+    for factor, flags in _reduced_flags:
+        if side // factor >= min_side:
+            return factor, flags
+
+    return 1, cv2.IMREAD_COLOR
+
+class Picture:
+    """Uploaded picture. It is decoded at a reduced size, as long as the longest side stays at least min_side
+    pixels (input of the face detector), full resolution is decoded only when it is requested."""
+    def __init__(self, data: bytes, min_side = 0):
+        self._data = data
+        self._full = None
+        self.factor = 1
+        flags = cv2.IMREAD_COLOR
+        if min_side:
+            self.factor, flags = _reduction(data, min_side)
+        self.image = decode(data, flags)
+        if self.factor == 1:
+            self._full = self.image
+
+    @property
+    def reduced(self):
+        return self.factor != 1
+
+    @property
+    def full(self):
+        if self._full is None:
+            self._full = decode(self._data)
+
+        return self._full
+
+def load_pictures(streams: list, min_side = 0):
+    datas = [s.read() for s in streams]
+    return list(_get_executor().map(lambda data: Picture(data, min_side), datas))
+
+def load_images(streams: list):
+    datas = [s.read() for s in streams]
+    return list(_get_executor().map(decode, datas))
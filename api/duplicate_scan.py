@@ -0,0 +1,185 @@
+import logging
+import os
+import time
+
+import numpy as np
+from deepface.commons import distance as dst, matrix_file
+
+import faces
+import metrics
+from users import (
+    _get_client,
+    get_user                                  as _get_user,
+    mark_user_for_duplicate_scan_review       as _mark_user_for_duplicate_scan_review,
+    are_duplicate_scan_pairs_dismissed        as _are_duplicate_scan_pairs_dismissed
+)
+
+# duplicates are searched for a single user when the primary photo is uploaded, this job searches all of the
+# primary photos at once: with batched milvus searches, or exact over a memory mapped export of the vectors.
+# Pairs within the threshold (squared L2, as milvus returns it) are ranked in a redis sorted set as
+# "newer_user_id,older_user_id" -> distance, the newer user of every pair is queued for duplicate review.
+# Progress is checkpointed after every batch, an interrupted scan with the same params continues from there.
+
+_pairs_key = "duplicateScan:pairs"
+_checkpoint_key = "duplicateScan:checkpoint"
+# rows of the exported matrix compared with a batch of queries at once
+_exact_chunk_rows = 65536
+
+def stream_primaries(collection, batch_size: int, after: str = None, output_fields: list = None):
+    """Yields batches of primary rows in the order of user_picture_id, starting after the passed one."""
+    exprs = [f"user_picture_id > \"{after}\""] if after else ["user_picture_id != \"\""]
+    has_partitions, legacy_rows = faces.get_partitioning(collection)
+    partitions = None
+    if has_partitions and not legacy_rows:
+        partitions = [faces._partitions[faces._picture_primary]]
+    else:
+        exprs.append(f"picture_id == {faces._picture_primary}")
+    iterator = collection.query_iterator(
+        batch_size = batch_size,
+        expr = " and ".join(exprs),
+        partition_names = partitions,
+        output_fields = output_fields or ["user_picture_id", "user_id", "face_metadata", "uploaded_at"]
+    )
+    try:
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            yield rows
+    finally:
+        iterator.close()
+
+def export_primaries(path: str, model: str = None, batch_size: int = 1000, dtype: str = "float32"):
+    """Writes primary vectors to a matrix file, identities of its rows are user_id:uploaded_at."""
+    collection = faces.get_faces_collection(model or faces._models[0])
+    for stale_path in (path, matrix_file.ids_path(path)):
+        if os.path.isfile(stale_path):
+            os.remove(stale_path)
+    count = 0
+    with matrix_file.Appender(path, dtype) as appender:
+        for rows in stream_primaries(collection, batch_size):
+            appender.write(
+                np.asarray([row["face_metadata"] for row in rows], dtype=np.float32),
+                [f"{row['user_id']}:{row['uploaded_at']}" for row in rows]
+            )
+            count += len(rows)
+    return count
+
+def _milvus_batches(collection, cursor, batch_size, limit, threshold, search_params):
+    for rows in stream_primaries(collection, batch_size, after=cursor):
+        tic = time.perf_counter()
+        results = faces.search_primary(
+            collection,
+            [row["face_metadata"] for row in rows],
+            limit = limit + 1, # the user itself is found as well
+            search_params = search_params,
+            output_fields = ["user_id", "uploaded_at"]
+        )
+        pairs = []
+        for row, hits in zip(rows, results):
+            for hit in hits:
+                similar_user_id = hit.entity.get("user_id")
+                if similar_user_id != row["user_id"] and hit.distance <= threshold:
+                    pairs.append((row["user_id"], row["uploaded_at"], similar_user_id, hit.entity.get("uploaded_at"), hit.distance))
+        yield rows[-1]["user_picture_id"], len(rows), pairs, time.perf_counter() - tic
+
+def _exact_batches(snapshot, cursor, batch_size, limit, threshold):
+    identities, matrix = matrix_file.load(snapshot)
+    users = [identity.rsplit(":", 1) for identity in identities]
+    for start in range(int(cursor or 0), len(matrix), batch_size):
+        tic = time.perf_counter()
+        stop = min(start + batch_size, len(matrix))
+        queries = np.asarray(matrix[start:stop], dtype=np.float32)
+        candidates = [[] for _ in range(stop - start)]
+        for chunk_start in range(0, len(matrix), _exact_chunk_rows):
+            chunk = np.asarray(matrix[chunk_start : chunk_start + _exact_chunk_rows], dtype=np.float32)
+            distances = dst.pairwise_distances(queries, chunk) ** 2
+            for i, j in zip(*np.nonzero(distances <= threshold)):
+                if users[start + i][0] != users[chunk_start + j][0]:
+                    candidates[i].append((float(distances[i, j]), chunk_start + j))
+        pairs = []
+        for i, found in enumerate(candidates):
+            user_id, uploaded_at = users[start + i]
+            for distance, j in sorted(found)[:limit]:
+                pairs.append((user_id, int(uploaded_at), users[j][0], int(users[j][1]), distance))
+        yield str(stop), stop - start, pairs, time.perf_counter() - tic
+
+def _pair_member(user_id, uploaded_at, similar_user_id, similar_uploaded_at, distance):
+    # the user who uploaded later should have been caught at upload
+    if (uploaded_at, user_id) < (similar_uploaded_at, similar_user_id):
+        user_id, similar_user_id = similar_user_id, user_id
+    return f"{user_id},{similar_user_id}"
+
+def scan(threshold: float, batch_size: int = 256, limit: int = faces._faces_count_to_search_for,
+         search_params: dict = None, snapshot: str = None, model: str = None, restart: bool = False):
+    """Searches duplicates of all primary photos, returns count of the candidate pairs.
+
+    Args:
+        threshold (float): max squared L2 distance of duplicates.
+        batch_size (int): count of primary photos searched at once (nq).
+        limit (int): max count of duplicates of a single user.
+        search_params (dict): search params of the index overridden for the scan, ie {"ef": 64}.
+        snapshot (str): matrix file written by export_primaries, searched exactly instead of milvus.
+        restart (bool): do not continue an interrupted scan.
+    """
+    r = _get_client()
+    mode = "exact" if snapshot else "milvus"
+    params = {"mode": mode, "snapshot": snapshot or "", "threshold": str(threshold), "limit": str(limit), "model": model or faces._models[0]}
+    checkpoint = {k.decode(): v.decode() for k, v in r.hgetall(_checkpoint_key).items()}
+    if restart or not checkpoint or any(checkpoint.get(k) != v for k, v in params.items()):
+        r.delete(_pairs_key, _checkpoint_key)
+        checkpoint = {}
+    elif checkpoint.get("done"):
+        logging.info("[duplicate scan] already finished, pass restart to scan again")
+        return r.zcard(_pairs_key)
+    else:
+        logging.info(f"[duplicate scan] continues after {checkpoint.get('cursor')}")
+
+    if snapshot:
+        batches = _exact_batches(snapshot, checkpoint.get("cursor"), batch_size, limit, threshold)
+    else:
+        collection = faces.get_faces_collection(params["model"])
+        batches = _milvus_batches(collection, checkpoint.get("cursor"), batch_size, limit, threshold, search_params)
+    scanned = 0
+    started = time.perf_counter()
+    for cursor, count, pairs, seconds in batches:
+        with r.pipeline(transaction=True) as p:
+            if pairs:
+                p.zadd(_pairs_key, {_pair_member(*pair): float(pair[4]) for pair in pairs})
+            p.hset(_checkpoint_key, mapping = {**params, "cursor": cursor})
+            p.execute()
+        metrics.register_duplicate_scan_batch(mode, count, len(pairs), seconds)
+        scanned += count
+        logging.info(f"[duplicate scan] {scanned} faces scanned, {round(scanned / (time.perf_counter() - started), 1)} faces/s")
+    r.hset(_checkpoint_key, mapping = {**params, "done": 1})
+    return r.zcard(_pairs_key)
+
+def ranked_pairs(count: int = -1):
+    """Candidate pairs (user_id, similar user_id, distance) of the last scan, the closest first."""
+    return [(*str(member, encoding = "utf-8").split(","), distance)
+            for member, distance in _get_client().zrange(_pairs_key, 0, count - 1 if count > 0 else -1, withscores = True)]
+
+def queue_for_review(limit: int = faces._faces_count_to_search_for):
+    """Queues users of the found pairs for duplicate review, pairs already decided by admins are skipped."""
+    pairs = ranked_pairs()
+    dismissed = _are_duplicate_scan_pairs_dismissed([(user_id, similar_user_id) for user_id, similar_user_id, _ in pairs])
+    similar_users = {}
+    for (user_id, similar_user_id, _), is_dismissed in zip(pairs, dismissed):
+        if not is_dismissed:
+            similar_users.setdefault(user_id, []).append(similar_user_id)
+    disabled = {}
+    def is_disabled(user_id):
+        if user_id not in disabled:
+            user = _get_user(user_id)
+            disabled[user_id] = user is not None and user.get("disabled_at", 0) > 0
+        return disabled[user_id]
+
+    queued = 0
+    for user_id, similar in similar_users.items():
+        if is_disabled(user_id):
+            continue
+        similar = [u for u in similar if not is_disabled(u)][:limit]
+        if similar and _mark_user_for_duplicate_scan_review(user_id, similar):
+            queued += 1
+    metrics.register_duplicate_scan_queued(queued)
+    return queued
@@ -0,0 +1,152 @@
+import hashlib, os, threading, logging
+from collections import OrderedDict
+import numpy as np, cv2, redis
+from flask import current_app
+from deepface import DeepFace
+from users import _get_client
+import metrics
+
+# embeddings of photos addressed by the sha256 of the photo content and by the parameters of
+# represent. Entries live in redis (shared by all workers) with a small LRU in front of it.
+# Stored photos are additionally addressed by their object name: minio uploads remember the
+# digest of the content, so a cached embedding of a stored photo is found without downloading it.
+
+_local = OrderedDict()
+_local_lock = threading.Lock()
+
+def _photoKey(photo_name: str):
+    return "photoDigest:"+photo_name
+def _embeddingKey(digest: str, model_name: str, detector_backend: str, align: bool, normalization: str, target_size):
+    size = "x".join(str(s) for s in target_size) if target_size else "default"
+    return f"embedding:{digest}:{model_name}{_model_variant(model_name)}:{detector_backend}:{int(align)}:{normalization}:{size}"
+
+def _model_variant(model_name: str):
+    # embeddings differ between backends / precisions of the same model
+    if model_name == "ArcFace":
+        return "-" + os.environ.get("ARCFACE_BACKEND", "keras")
+    if model_name == "SFace" and os.environ.get("SFACE_PRECISION") == "int8":
+        return "-int8"
+    return ""
+
+def digest(photo: bytes):
+    return hashlib.sha256(photo).hexdigest()
+
+def remember_photo(photo_name: str, photo: bytes):
+    """Remember the digest of a photo stored under the name, returns the digest."""
+    photo_digest = digest(photo)
+    ttl = current_app.config['EMBEDDING_CACHE_TTL']
+    if ttl > 0:
+        try:
+            _get_client().set(_photoKey(photo_name), photo_digest, ex=ttl)
+        except redis.RedisError as e:
+            logging.warning(f"[embedding cache] failed to remember digest of {photo_name}: {e}")
+    return photo_digest
+
+def forget_photos(photo_names: list):
+    if current_app.config['EMBEDDING_CACHE_TTL'] > 0 and photo_names:
+        try:
+            _get_client().delete(*[_photoKey(name) for name in photo_names])
+        except redis.RedisError as e:
+            logging.warning(f"[embedding cache] failed to forget digests of {photo_names}: {e}")
+
+def represent(photo: bytes, model_name: str, detector_backend: str, align: bool = True,
+              normalization: str = "base", target_size = None, enforce_detection: bool = True):
+    """Embedding of the first face of the photo, as DeepFace.represent returns it.
+
+    Raises ValueError of DeepFace.represent if there is no face, such results are not cached.
+    """
+    key = _embeddingKey(digest(photo), model_name, detector_backend, align, normalization, target_size)
+    embedding = _lookup(key, model_name)
+    if embedding is None:
+        embedding = _represent(photo, model_name, detector_backend, align, normalization, target_size, enforce_detection)
+        _store(key, embedding)
+    return embedding
+
+def represent_stored(photo_name: str, download, model_name: str, detector_backend: str, align: bool = True,
+                     normalization: str = "base", target_size = None, enforce_detection: bool = True):
+    """Same as represent for a stored photo, which is downloaded only if its embedding is not cached.
+
+    Args:
+        photo_name (str): object name the photo is stored under.
+        download (callable): returns content of the photo or None if it does not exist.
+
+    Returns:
+        numpy array with the embedding or None if the photo does not exist.
+    """
+    photo_digest = None
+    if current_app.config['EMBEDDING_CACHE_TTL'] > 0:
+        try:
+            photo_digest = _get_client().get(_photoKey(photo_name))
+        except redis.RedisError as e:
+            logging.warning(f"[embedding cache] failed to get digest of {photo_name}: {e}")
+    if photo_digest:
+        key = _embeddingKey(photo_digest.decode(), model_name, detector_backend, align, normalization, target_size)
+        embedding = _lookup(key, model_name)
+        if embedding is not None:
+            return embedding
+
+    photo = download()
+    if photo is None:
+        return None
+    # photos stored before the digest was remembered
+    if not photo_digest:
+        remember_photo(photo_name, photo)
+    return represent(photo, model_name, detector_backend, align, normalization, target_size, enforce_detection)
+
+def _represent(photo: bytes, model_name, detector_backend, align, normalization, target_size, enforce_detection):
+    img = cv2.imdecode(np.frombuffer(photo, dtype=np.uint8), cv2.IMREAD_COLOR)
+    kwargs = {"target_size": target_size} if target_size else {}
+    embedding = DeepFace.represent(
+        img_path=img,
+        model_name=model_name,
+        detector_backend=detector_backend,
+        enforce_detection=enforce_detection,
+        align=align,
+        normalization=normalization,
+        **kwargs,
+    )[0]["embedding"]
+    return np.asarray(embedding, dtype=np.float64)
+
+def _lookup(key: str, model_name: str):
+    with _local_lock:
+        embedding = _local.get(key)
+        if embedding is not None:
+            _local.move_to_end(key)
+    if embedding is not None:
+        metrics.register_embedding_cache_hit(model_name, "local")
+        return embedding
+
+    if current_app.config['EMBEDDING_CACHE_TTL'] > 0:
+        try:
+            value = _get_client().get(key)
+        except redis.RedisError as e:
+            logging.warning(f"[embedding cache] failed to get {key}: {e}")
+            value = None
+        if value:
+            embedding = np.frombuffer(value, dtype=np.float64)
+            _put_local(key, embedding)
+            metrics.register_embedding_cache_hit(model_name, "redis")
+            return embedding
+
+    metrics.register_embedding_cache_miss(model_name)
+    return None
+
+def _store(key: str, embedding):
+    _put_local(key, embedding)
+    ttl = current_app.config['EMBEDDING_CACHE_TTL']
+    if ttl > 0:
+        try:
+            _get_client().set(key, embedding.tobytes(), ex=ttl)
+        except redis.RedisError as e:
+            logging.warning(f"[embedding cache] failed to set {key}: {e}")
+
+def _put_local(key: str, embedding):
+    size = current_app.config['EMBEDDING_CACHE_SIZE']
+    if size <= 0:
+        return
+    embedding.flags.writeable = False
+    with _local_lock:
+        _local[key] = embedding
+        _local.move_to_end(key)
+        while len(_local) > size:
+            _local.popitem(last=False)
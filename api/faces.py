@@ -1,7 +1,11 @@
-import time
+import time, threading, logging, json
 
 from flask import g
 import os
+import redis
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pymilvus import CollectionSchema, FieldSchema, DataType, utility, connections, Collection, Milvus, MilvusException
 from pymilvus.client.types import LoadState
 from pymilvus.exceptions import IndexNotExistException
@@ -9,6 +13,8 @@ import numpy as np
 from flask import current_app
 
 from deepface.commons.distance import modelVectorLength
+from users import _get_client
+import metrics
 
 _conn_prefix = "snowface-"+str(os.getpid())
 _faces_collections = {}
@@ -24,6 +30,50 @@ _models = ["arcface", "sface"] # first is used for primary photos duplicates det
 
 _faces_count_to_search_for = 5
 
+# vector index of the faces collections: (build params, search params, search param trading recall for latency).
+# Picked with MILVUS_INDEX_TYPE, defaults are overridden by the json of MILVUS_INDEX_PARAMS / MILVUS_SEARCH_PARAMS.
+# Existing collections keep their index until rebuild_index, searches use the params of the index they have.
+_index_profiles = {
+    "HNSW": ({"efConstruction": 512, "M": 16}, {"ef": 20}, "ef"),
+    "IVF_FLAT": ({"nlist": 1024}, {"nprobe": 16}, "nprobe"),
+    "IVF_SQ8": ({"nlist": 1024}, {"nprobe": 16}, "nprobe"),
+    "DISKANN": ({}, {"search_list": 20}, "search_list"),
+}
+_search_params = {} # collection name -> search params of its index
+
+# rows are kept in a partition per picture type, so the duplicate search scans primaries only, without a scalar
+# filter, and secondary upserts do not churn its segments. Collections created before keep their rows in the
+# default partition until scripts/partition_faces.py moves them, they are searched with the filter meanwhile.
+# Every worker re-checks the partitions each _partitioning_ttl seconds, workers which have not seen them yet
+# still write to the default partition until then, so it is treated as migrated only once it stayed empty
+# over a whole re-check period.
+_partitioning_ttl = int(os.environ.get("MILVUS_PARTITIONING_TTL", 60))
+_partitions = {
+    _picture_primary: "primary",
+    _picture_secondary: "secondary",
+    _picture_secondary_pending: "secondary_pending",
+}
+_default_partition = "_default"
+_partitioning = {} # collection name -> (checked_at, has the partitions, default partition empty since)
+_partitioning_lock = threading.Lock()
+
+_metadata_fields = ["user_id","picture_id","face_metadata","uploaded_at", "url"]
+_metadata_executor = None
+
+# primary and secondary metadata rarely change after upload, every worker keeps the recently read rows
+# (vectors as read only float32 arrays, missing pictures as None), rows are handed out with the vector as a list
+# like milvus returns it. Writes go through this module and evict
+# the user here and, via redis pub/sub, in the other workers.
+_cached_pictures = (_picture_primary, _picture_secondary)
+_metadata_cache = OrderedDict() # (user_id, model, picture_id) -> (expires_at, row)
+_metadata_cache_lock = threading.Lock()
+_metadata_cache_ttl = 0
+_metadata_cache_size = 0 # disabled until init_metadata_cache
+_invalidation_channel = "facesMetadataInvalidated"
+# bounded consistency reads might return replaced rows for a while after a write, nothing read during it is cached
+_invalidation_grace = 10
+_invalidated = object()
+
 def connect_milvus():
     uri = os.environ.get('MILVUS_URI')
     usr = os.environ.get('MILVUS_USER', _default_user)
@@ -81,9 +131,32 @@ def init_schema():
         _faces_collections[m] = init_faces_collection(m)
 
 
-def create_faces_collection(name, model_name):
+def index_profile(index_type: str = None):
+    """Returns (index type, build params, search params) configured for the faces collections."""
+    index_type = (index_type or os.environ.get("MILVUS_INDEX_TYPE", "HNSW")).upper()
+    if index_type not in _index_profiles:
+        raise ValueError(f"unsupported MILVUS_INDEX_TYPE {index_type}, expected one of {list(_index_profiles)}")
+    build_params, search_params, _ = _index_profiles[index_type]
+    build_params = {**build_params, **json.loads(os.environ.get("MILVUS_INDEX_PARAMS", "{}"))}
+    search_params = {**search_params, **json.loads(os.environ.get("MILVUS_SEARCH_PARAMS", "{}"))}
+    return index_type, build_params, search_params
+
+def tunable_search_param(index_type: str):
+    return _index_profiles[index_type.upper()][2]
+
+def _create_vector_index(faces, index_type = None, build_params = None):
+    index_type, default_build_params, _ = index_profile(index_type)
+    faces.create_index(
+        field_name="face_metadata",
+        index_params= {
+            "metric_type":"L2",
+            "index_type":index_type,
+            "params":default_build_params if build_params is None else build_params
+        })
+
+def create_faces_collection(name, model_name, index_type = None, build_params = None):
     faces = Collection(
-        name=f'faces_{model_name}',
+        name=name,
         schema=CollectionSchema(
             fields=[FieldSchema(
                 name="user_picture_id", #user_id~picture_id
@@ -116,18 +189,51 @@ def create_faces_collection(name, model_name):
         using=_conn_prefix,
         # partitions??? Shards???
     )
-    faces.create_index(
-        field_name="face_metadata",
-        index_params= {
-            "metric_type":"L2",
-            "index_type":"HNSW",
-            "params":{"efConstruction":512, "M":16}
-        })
+    _create_vector_index(faces, index_type, build_params)
     faces.create_index(
         field_name="picture_id",
         index_name="picture_id_idx")
+    create_partitions(faces)
     return faces
 
+def create_partitions(faces):
+    for partition in _partitions.values():
+        if not faces.has_partition(partition):
+            faces.create_partition(partition)
+
+def get_partitioning(faces):
+    """Returns (has partitions per picture type, default partition might still have rows), re-checked every _partitioning_ttl seconds."""
+    now = time.monotonic()
+    with _partitioning_lock:
+        state = _partitioning.get(faces.name)
+    if state is None or now - state[0] >= _partitioning_ttl:
+        has_partitions = all(faces.has_partition(partition) for partition in _partitions.values())
+        empty = has_partitions and len(faces.query(
+            expr = "user_picture_id != \"\"",
+            partition_names = [_default_partition],
+            limit = 1,
+            output_fields = ["user_id"]
+        )) == 0
+        empty_since = None
+        if empty:
+            empty_since = state[2] if state is not None and state[2] is not None else now
+        state = (now, has_partitions, empty_since)
+        with _partitioning_lock:
+            _partitioning[faces.name] = state
+
+    checked_at, has_partitions, empty_since = state
+    return has_partitions, empty_since is None or checked_at - empty_since < _partitioning_ttl
+
+def _partition_name(faces, picture_id):
+    has_partitions, _ = get_partitioning(faces)
+    return _partitions[picture_id] if has_partitions else None
+
+def _delete_legacy_row(faces, pk):
+    # upsert into a partition does not replace the row not migrated yet from the default one
+    has_partitions, legacy_rows = get_partitioning(faces)
+    if has_partitions and legacy_rows:
+        faces.delete(f"user_picture_id in {[pk]}", partition_name=_default_partition)
+
 def get_faces_collection(model):
     model = model.lower()
     global _faces_collections
@@ -138,7 +244,126 @@ def get_faces_collection(model):
 
     return _faces_collections[model]
 
+def init_metadata_cache(ttl: int, size: int):
+    """Enables the metadata cache of the worker and starts listening for evictions from the other workers."""
+    global _metadata_cache_ttl, _metadata_cache_size
+    if ttl <= 0 or size <= 0:
+        return
+    _metadata_cache_ttl, _metadata_cache_size = ttl, size
+    threading.Thread(target=_listen_invalidations, name="metadata-invalidations", daemon=True).start()
+
+def _listen_invalidations():
+    while True:
+        try:
+            pubsub = _get_client().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(_invalidation_channel)
+            # evictions published while we were not subscribed are lost
+            _clear_metadata_cache()
+            for message in pubsub.listen():
+                _forget_metadata(message["data"].decode())
+        except redis.RedisError as e:
+            logging.warning(f"[metadata cache] invalidations listener failed: {e}")
+            time.sleep(1)
+
+def _clear_metadata_cache():
+    with _metadata_cache_lock:
+        _metadata_cache.clear()
+
+def _put_metadata_cache(key, expires_at, row):
+    _metadata_cache[key] = (expires_at, row)
+    _metadata_cache.move_to_end(key)
+    while len(_metadata_cache) > _metadata_cache_size:
+        _metadata_cache.popitem(last=False)
+
+def _forget_metadata(user_id: str):
+    if _metadata_cache_size <= 0:
+        return
+    expires_at = time.monotonic() + _invalidation_grace
+    with _metadata_cache_lock:
+        for m in _models:
+            for picture_id in _cached_pictures:
+                _put_metadata_cache((user_id, m, picture_id), expires_at, _invalidated)
+
+def invalidate_metadata(user_id: str):
+    """Evicts cached metadata of the user in all workers, called after every write of its pictures."""
+    _forget_metadata(user_id)
+    if _metadata_cache_size <= 0:
+        return
+    try:
+        _get_client().publish(_invalidation_channel, user_id)
+    except redis.RedisError as e:
+        logging.warning(f"[metadata cache] failed to publish eviction of {user_id}: {e}")
+
+def _cached_metadata(user_id: str, model: str, picture_id: int):
+    """Returns (True, row or None if the picture does not exist) if cached, (False, None) otherwise."""
+    model = model.lower()
+    entry = None
+    if _metadata_cache_size > 0 and picture_id in _cached_pictures:
+        key = (user_id, model, picture_id)
+        with _metadata_cache_lock:
+            entry = _metadata_cache.get(key)
+            if entry is not None and (entry[1] is _invalidated or entry[0] <= time.monotonic()):
+                entry = None
+            if entry is not None:
+                _metadata_cache.move_to_end(key)
+    if entry is None:
+        metrics.register_metadata_cache_miss(model)
+        return False, None
+    metrics.register_metadata_cache_hit(model)
+    return True, _uncached_row(entry[1])
+
+def _uncached_row(row):
+    if row is None:
+        return None
+    return {**row, "face_metadata": row["face_metadata"].tolist()}
+
+def _cache_metadata(user_id: str, model: str, picture_id: int, row):
+    """Caches the row read from milvus (None if there is none), returns it unchanged."""
+    if _metadata_cache_size > 0 and picture_id in _cached_pictures:
+        cached = None
+        if row is not None:
+            cached = dict(row)
+            vector = np.asarray(row["face_metadata"], dtype=np.float32)
+            vector.flags.writeable = False
+            cached["face_metadata"] = vector
+        key = (user_id, model.lower(), picture_id)
+        now = time.monotonic()
+        with _metadata_cache_lock:
+            entry = _metadata_cache.get(key)
+            if entry is None or entry[1] is not _invalidated or entry[0] <= now:
+                _put_metadata_cache(key, now + _metadata_cache_ttl, cached)
+    return row
+
+def get_search_params(faces):
+    """Search params for the index the collection actually has, the configured ones if it is of the configured type."""
+    params = _search_params.get(faces.name)
+    if params is None:
+        index = [idx for idx in faces.indexes if idx.field_name == "face_metadata"]
+        index_type = index[0].params.get("index_type", "HNSW").upper() if index else "HNSW"
+        configured_type, _, params = index_profile()
+        if index_type != configured_type:
+            logging.warning(f"{faces.name} has {index_type} index while {configured_type} is configured, run rebuild_index to change it")
+            params = dict(_index_profiles[index_type][1]) if index_type in _index_profiles else {}
+        _search_params[faces.name] = params
+
+    return params
+
+def rebuild_index(model: str, index_type: str = None, build_params: dict = None):
+    """Replaces the vector index of a faces collection by the configured (or passed) one, the collection is unavailable meanwhile."""
+    faces = get_faces_collection(model)
+    faces.release()
+    for idx in faces.indexes:
+        if idx.field_name == "face_metadata":
+            idx.drop()
+    _create_vector_index(faces, index_type, build_params)
+    _search_params.pop(faces.name, None)
+    faces.load()
+    return faces
+
 def get_primary_metadata(user_id, model, search_growing = True):
+    cached, row = _cached_metadata(user_id, model, _picture_primary)
+    if cached:
+        return row
     faces = get_faces_collection(model)
     res = faces.query(
         expr = f"user_picture_id == \"{user_id}~{_picture_primary}\"",
@@ -148,11 +373,12 @@ def get_primary_metadata(user_id, model, search_growing = True):
         ignore_growing = False,
         consistency_level = "Strong" if search_growing else "Bounded"
     )
-    if len(res) == 0:
-        return None
-    return res[0]
+    return _cache_metadata(user_id, model, _picture_primary, res[0] if len(res) > 0 else None)
 
 def get_secondary_metadata(user_id, model):
+    cached, row = _cached_metadata(user_id, model, _picture_secondary)
+    if cached:
+        return row
     faces = get_faces_collection(model)
     res = faces.query(
         expr = f"user_picture_id == \"{user_id}~{_picture_secondary}\"",
@@ -162,25 +388,112 @@ def get_secondary_metadata(user_id, model):
         consistency_level = "Bounded",
         output_fields = ["user_id","picture_id","face_metadata","uploaded_at", "url"],
     )
-    if len(res) == 0:
-        return None
-    return res[0]
+    return _cache_metadata(user_id, model, _picture_secondary, res[0] if len(res) > 0 else None)
 
-def find_similar_users(user_id: str,metadata: list, threshold: float):
-    faces = get_faces_collection(_models[0])
-    results = faces.search(
-        data=[metadata],
+@dataclass
+class UserMetadata:
+    """Pictures of a user in the faces collections, rows as get_primary_metadata returns them."""
+    user_id: str
+    pictures: dict = field(default_factory=dict) # model -> {picture_id: row}
+
+    def picture(self, model: str, picture_id: int):
+        return self.pictures.get(model.lower(), {}).get(picture_id)
+
+    def primary(self, model: str):
+        return self.picture(model, _picture_primary)
+
+    def secondary(self, model: str):
+        return self.picture(model, _picture_secondary)
+
+    def secondary_pending(self, model: str):
+        return self.picture(model, _picture_secondary_pending)
+
+def _get_metadata_executor():
+    global _metadata_executor
+    if not _metadata_executor:
+        # one query per collection, they are waited for together
+        _metadata_executor = ThreadPoolExecutor(max_workers=len(_models), thread_name_prefix="metadata")
+
+    return _metadata_executor
+
+def get_metadatas(user_ids: list, models = None, picture_ids = _cached_pictures, search_growing = True):
+    """Pictures of many users in many faces collections, with a single batched query per collection, run concurrently.
+
+    Served from the metadata cache when all of the requested pictures are cached.
+    """
+    models = [m.lower() for m in (models or _models)]
+    metadatas = {user_id: UserMetadata(user_id, {m: {} for m in models}) for user_id in user_ids}
+    all_cached = True
+    for user_id in user_ids:
+        for m in models:
+            for picture_id in picture_ids:
+                cached, row = _cached_metadata(user_id, m, picture_id)
+                all_cached = all_cached and cached
+                if row is not None:
+                    metadatas[user_id].pictures[m][picture_id] = row
+    if all_cached:
+        return metadatas
+
+    keys = [f"{user_id}~{picture_id}" for user_id in user_ids for picture_id in picture_ids]
+    collections = {m: get_faces_collection(m) for m in models}
+    futures = {
+        m: _get_metadata_executor().submit(
+            faces.query,
+            expr = f"user_picture_id in {keys}",
+            offset = 0,
+            limit = len(keys),
+            output_fields = _metadata_fields,
+            ignore_growing = False,
+            consistency_level = "Strong" if search_growing else "Bounded"
+        )
+        for m, faces in collections.items()
+    }
+    metadatas = {user_id: UserMetadata(user_id, {m: {} for m in models}) for user_id in user_ids}
+    for m, future in futures.items():
+        rows = {(row["user_id"], int(row["picture_id"])): row for row in future.result()}
+        for user_id in user_ids:
+            for picture_id in picture_ids:
+                row = _cache_metadata(user_id, m, picture_id, rows.get((user_id, picture_id)))
+                if row is not None:
+                    metadatas[user_id].pictures[m][picture_id] = row
+
+    return metadatas
+
+def get_user_metadata(user_id: str, models = None, search_growing = True):
+    return get_metadatas([user_id], models = models, search_growing = search_growing)[user_id]
+
+def search_primary(faces, metadatas: list, limit: int = _faces_count_to_search_for, search_params: dict = None, output_fields: list = None):
+    """Nearest primary pictures of every metadata, by squared L2 distance.
+
+    search_params override the ones of the index for this call, ie {"ef": 64}.
+    """
+    params = {**get_search_params(faces), **(search_params or {})}
+    if "ef" in params:
+        # hnsw does not return more results than ef
+        params["ef"] = max(params["ef"], limit)
+    has_partitions, legacy_rows = get_partitioning(faces)
+    if has_partitions and not legacy_rows:
+        partitions, expr = [_partitions[_picture_primary]], None
+    else:
+        partitions, expr = None, f"picture_id == {_picture_primary}"
+    return faces.search(
+        data=metadatas,
         anns_field="face_metadata",
         param={
             "metric_type": "L2",
             "offset": 0,
             "ignore_growing": False,
-            "params": {"ef": 20}
+            "params": params
         },
-        limit=_faces_count_to_search_for,
-        expr = f"picture_id == {_picture_primary}",
-        output_fields=['user_id']
+        limit=limit,
+        expr = expr,
+        partition_names = partitions,
+        output_fields=output_fields or ['user_id']
     )
+
+def find_similar_users(user_id: str,metadata: list, threshold: float, search_params: dict = None):
+    faces = get_faces_collection(_models[0])
+    results = search_primary(faces, [metadata], search_params=search_params)
     if len(results) == 0:
         return [user_id],[]
     if len(results[0].ids) == 0:
@@ -201,7 +514,10 @@ def find_similar_users(user_id: str,metadata: list, threshold: float):
 def update_secondary_metadata(now: int, user_id:str, metadata: list, url: str, model: str):
     faces = get_faces_collection(model)
     pk = f"{user_id}~{_picture_secondary}"
-    rowsCount = faces.upsert([[pk],[user_id],[np.int32(_picture_secondary)],[metadata],[url],[now]]).upsert_count
+    rowsCount = faces.upsert([[pk],[user_id],[np.int32(_picture_secondary)],[metadata],[url],[now]],
+                             partition_name=_partition_name(faces, _picture_secondary)).upsert_count
+    _delete_legacy_row(faces, pk)
+    invalidate_metadata(user_id)
     return {
         "user_picture_id": pk,
         "user_id": user_id,
@@ -214,7 +530,9 @@ def update_secondary_metadata(now: int, user_id:str, metadata: list, url: str, m
 def update_secondary_metadata_pending(now: int, user_id:str, metadata: list, url: str, model: str):
     faces = get_faces_collection(model)
     pk = f"{user_id}~{_picture_secondary_pending}"
-    rowsCount = faces.upsert([[pk],[user_id],[np.int32(_picture_secondary_pending)],[metadata],[url],[now]]).upsert_count
+    rowsCount = faces.upsert([[pk],[user_id],[np.int32(_picture_secondary_pending)],[metadata],[url],[now]],
+                             partition_name=_partition_name(faces, _picture_secondary_pending)).upsert_count
+    _delete_legacy_row(faces, pk)
     return {
         "user_picture_id": pk,
         "user_id": user_id,
@@ -246,7 +564,9 @@ def apply_secondary_pending(user_id:str, model:str, emotion_session_id: str):
 def set_primary_metadata(now: int, user_id:str, metadata: list, url: str, model: str):
     faces = get_faces_collection(model)
     pk = f"{user_id}~{_picture_primary}"
-    insertedRows = faces.insert([[pk],[user_id],[np.int32(_picture_primary)],[metadata],[url],[now]]).insert_count
+    insertedRows = faces.insert([[pk],[user_id],[np.int32(_picture_primary)],[metadata],[url],[now]],
+                                partition_name=_partition_name(faces, _picture_primary)).insert_count
+    invalidate_metadata(user_id)
     return {
         "user_picture_id": pk,
         "user_id": user_id,
@@ -258,10 +578,11 @@ def set_primary_metadata(now: int, user_id:str, metadata: list, url: str, model:
 
 def delete_metadatas(user_id: str, pk: list):
     d = 0
-    primary = get_primary_metadata(user_id, model=_models[0], search_growing=False)
-    secondary = get_secondary_metadata(user_id,model=_models[0])
+    md = get_user_metadata(user_id, models=[_models[0]], search_growing=False)
+    primary, secondary = md.primary(_models[0]), md.secondary(_models[0])
     for f in _faces_collections:
         d += _faces_collections[f].delete(f"user_picture_id in {pk}").delete_count
+    invalidate_metadata(user_id)
     return primary, secondary, d
 
 def ping(timeout = 30):
@@ -11,4 +11,20 @@ def worker_exit(server, worker):
     stop_wrongfully_disabled_users_worker()
 
 def on_starting(server):
-    clean_wrongfully_disabled_users_workers()
\ No newline at end of file
+    clean_wrongfully_disabled_users_workers()
+
+def pre_fork(server, worker):
+    # every worker gets its own slot, workers respawned after a crash take the free one
+    used = [getattr(w, "core_slot", -1) for w in server.WORKERS.values()]
+    worker.core_slot = min(s for s in range(len(used) + 1) if s not in used)
+
+def post_fork(server, worker):
+    # pin every worker to its own share of cores, so onnx runtime / tensorflow threads of N workers do not oversubscribe the cpu
+    if os.environ.get("PIN_WORKERS_TO_CORES", "false").lower() not in ("true", "1") or not hasattr(os, "sched_setaffinity"):
+        return
+    cores = sorted(os.sched_getaffinity(0))
+    workers = int(os.environ.get("WORKERS", server.cfg.workers))
+    per_worker = max(len(cores) // workers, 1)
+    start = (worker.core_slot * per_worker) % len(cores)
+    os.sched_setaffinity(0, cores[start:start + per_worker])
+    logging.warning(f"worker PID:{os.getpid()} pinned to cores {cores[start:start + per_worker]}")
@@ -1,6 +1,8 @@
-from prometheus_client import make_asgi_app, multiprocess, CollectorRegistry, generate_latest, Counter, Histogram, REGISTRY, Summary,GC_COLLECTOR,PLATFORM_COLLECTOR,PROCESS_COLLECTOR, metrics
+from prometheus_client import make_asgi_app, multiprocess, CollectorRegistry, generate_latest, Counter, Gauge, Histogram, REGISTRY, Summary,GC_COLLECTOR,PLATFORM_COLLECTOR,PROCESS_COLLECTOR, metrics
 from deepface.extendedmodels.hsefer import HSEmotionRecognizer
 from deepface.DeepFace import set_represent_metric as _set_represent
+from deepface.commons import registry as _models_registry
+from deepface.detectors.FaceDetector import set_cache_metrics as _set_detector_cache
 import threading
 from flask import current_app
 import time, os
@@ -37,6 +39,18 @@ _disabled_user_similarity_arcface = Histogram("disabled_user_similarity_arcface"
 _primary_photo_passed = Counter("primary_photo_passed","Counter of successfully passed primary photo uploads (not disabled)")
 _primary_photo_passed_retries = Histogram("primary_photo_passed_retries", "Histogram with retries count to pass selfie step", buckets=[i for i in range(20)])
 _photos_to_review = Counter("primary_photo_to_review","Counter of users for admin review")
+_detector_cache_hits = Counter("detector_cache_hits", "Counter of face detectors reused from the cache", labelnames=["backend"])
+_detector_cache_misses = Counter("detector_cache_misses", "Counter of face detectors built because they were not in the cache", labelnames=["backend"])
+_set_detector_cache(_detector_cache_hits, _detector_cache_misses)
+_embedding_cache_hits = Counter("embedding_cache_hits", "Counter of photo embeddings found in the cache", labelnames=["model", "level"])
+_embedding_cache_misses = Counter("embedding_cache_misses", "Counter of photo embeddings computed because they were not in the cache", labelnames=["model"])
+_metadata_cache_hits = Counter("metadata_cache_hits", "Counter of face metadata reads served by the worker cache", labelnames=["model"])
+_metadata_cache_misses = Counter("metadata_cache_misses", "Counter of face metadata reads sent to milvus", labelnames=["model"])
+_duplicate_scan_faces = Counter("duplicate_scan_faces", "Counter of primary photos searched for duplicates by the duplicate scan", labelnames=["mode"])
+_duplicate_scan_pairs = Counter("duplicate_scan_pairs", "Counter of candidate duplicate pairs found by the duplicate scan", labelnames=["mode"])
+_duplicate_scan_batch_time = Histogram("duplicate_scan_batch_time", "Time per batch of primary photos searched for duplicates", labelnames=["mode"], buckets=(.05, .1, .25, .5, .75, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, metrics.INF))
+_duplicate_scan_queued = Counter("duplicate_scan_users_queued", "Counter of users sent to duplicate review by the duplicate scan")
+_models_memory = Gauge("models_resident_memory_bytes", "Approximate resident memory taken by loaded models (per worker process)", labelnames=["model"], multiprocess_mode="liveall")
 
 def register_emotion_success(model: HSEmotionRecognizer, emotion: str, scores_by_frame: list, averages: dict):
     _emotions_success.labels(expected_emotion=emotion).inc()
@@ -85,6 +99,30 @@ def register_primary_photo_uploaded(attempt):
 def primary_photo_to_review():
     _photos_to_review.inc()
 
+def register_embedding_cache_hit(model: str, level: str):
+    _embedding_cache_hits.labels(model=model, level=level).inc()
+
+def register_embedding_cache_miss(model: str):
+    _embedding_cache_misses.labels(model=model).inc()
+
+def register_metadata_cache_hit(model: str):
+    _metadata_cache_hits.labels(model=model).inc()
+
+def register_metadata_cache_miss(model: str):
+    _metadata_cache_misses.labels(model=model).inc()
+
+def register_duplicate_scan_batch(mode: str, faces_count: int, pairs_count: int, seconds: float):
+    _duplicate_scan_faces.labels(mode=mode).inc(faces_count)
+    _duplicate_scan_pairs.labels(mode=mode).inc(pairs_count)
+    _duplicate_scan_batch_time.labels(mode=mode).observe(seconds)
+
+def register_duplicate_scan_queued(count: int):
+    _duplicate_scan_queued.inc(count)
+
+def register_models_memory():
+    for model, size in _models_registry.memory_usage().items():
+        _models_memory.labels(model=model).set(size)
+
 def request_queue_time(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -7,6 +7,7 @@ from minio.error import S3Error
 from minio.deleteobjects import DeleteObject
 import io, datetime
 from flask import current_app
+import embedding_cache
 
 _minio_client = None
 
@@ -51,6 +52,11 @@ def _client_with_initialized_bucket():
 def put_primary_photo(user_id: str, photo_content):
     return put_proto(user_id, _picture_primary, photo_content)
 
+def primary_photo_name(user_id: str):
+    return f"{user_id}/{_picture_primary}"
+def secondary_photo_name(user_id: str):
+    return f"{user_id}/{_picture_secondary}"
+
 def get_primary_photo(user_id: str):
     return get_photo(user_id, _picture_primary)
 def get_secondary_photo(user_id: str):
@@ -77,7 +83,11 @@ def get_review_photo(user_id: str):
 
 def put_proto(user_id: str, photo_id: int, photo_content):
     obj_name = f"{user_id}/{photo_id}"
-    return _upload(_bucket_name,obj_name,photo_content)
+    url = _upload(_bucket_name,obj_name,photo_content)
+    photo_content.seek(0, os.SEEK_SET)
+    embedding_cache.remember_photo(obj_name, photo_content.read())
+    photo_content.seek(0, os.SEEK_SET)
+    return url
 
 
 def _upload(bucket, obj_name: str, photo_content):
@@ -126,6 +136,7 @@ def delete_photos(user_id):
                                             + [DeleteObject(folder_obj_name)]
                                  )
     list(client.remove_objects(_disabled_users_bucket_name,[DeleteObject(f"{user_id}")]))
+    embedding_cache.forget_photos([primary_photo_name(user_id), secondary_photo_name(user_id)])
     return main_photo, secondary, list(errs)
 
 def ping(timeout = 30):
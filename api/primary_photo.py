@@ -27,7 +27,6 @@ import metrics
 import exceptions
 
 from deepface import DeepFace
-from deepface.commons import distance
 import numpy as np, cv2
 
 
@@ -95,28 +94,28 @@ def extract_metadatas(user_id, photo_stream, calc_arcface = True):
             detector_backend=_detector_high_quality,
             align=True,
             target_size=(112, 112),
-            landmarks_verification=True)
+            landmarks_verification=True,
+            keep_uint8=True)
     except ValueError:
         raise exceptions.NoFaces(f"No faces detected, userId: {user_id}")
     img_to_represent = resp_objs[0]['face']
     md = None
+    # same scale as the face was represented with before as float: divided by 255 twice
     if calc_arcface:
-        md = distance.l2_normalize(DeepFace.represent(
-            img_path=img_to_represent,
+        md = DeepFace.represent_batch(
+            [img_to_represent],
             model_name=_model_fallback,
-            detector_backend="skip",
             normalization="base",
             target_size=(112, 112),
-            enforce_detection= False,
-        )[0]["embedding"])
-    sface_md = distance.l2_normalize(DeepFace.represent(
-        img_path=img_to_represent,
+            double_scaled=True,
+        )[0]
+    sface_md = DeepFace.represent_batch(
+        [img_to_represent],
         model_name=_model,
-        detector_backend="skip",
         normalization="base",
-        enforce_detection= False,
         target_size=(112, 112),
-    )[0]["embedding"])
+        double_scaled=True,
+    )[0]
     return img_to_represent, md, sface_md
 
 
@@ -10,7 +10,8 @@ from users import (
     rollback_manual_review as _rollback_manual_review,
     pop_possible_duplicate_with as _pop_possible_duplicate_with,
     add_possible_duplicate_with as _add_possible_duplicate_with,
-    get_face_metadata_pending_review as _get_face_metadata_pending_review
+    get_face_metadata_pending_review as _get_face_metadata_pending_review,
+    dismiss_duplicate_scan_pairs as _dismiss_duplicate_scan_pairs
 )
 from minio_uploader import (
     put_review_photo as _put_review_photo,
@@ -64,7 +65,7 @@ def make_decision(now: int, admin_current_user: Token, user_id:str, decision: st
         raise exceptions.UserNotFound("user have no state")
     if not user.get("possible_duplicate_with",[]):
         # possible_duplicate_with might be gone when most similar users are blocked
-        if user.get("duplicate_review_count", None) is None or (not user.get("ip","")):
+        if (user.get("duplicate_review_count", None) is None or (not user.get("ip",""))) and not user.get("found_by_duplicate_scan"):
             raise exceptions.NoDataException(f"user {user_id} is not on review")
     if most_similar_user_to_duplicate:
         if most_similar_user_to_duplicate in user.get("possible_duplicate_with",[]):
@@ -85,6 +86,9 @@ def make_decision(now: int, admin_current_user: Token, user_id:str, decision: st
         else:
             raise exceptions.NoDataException(f"user {most_similar_user_to_duplicate} is not on review")
     photo = _get_review_photo(user_id)
+    if not photo and user.get("found_by_duplicate_scan"):
+        # users found by the duplicate scan are reviewed with their registered primary photo
+        photo = _get_primary_photo(user_id)
     if not photo:
         raise exceptions.UserNotFound("user have no photo sent to review")
     logging.warning(f"admin decision - user_id {user_id} = {decision} processing by admin {admin_current_user.user_id}")
@@ -101,6 +105,10 @@ def make_decision(now: int, admin_current_user: Token, user_id:str, decision: st
     elif decision == "retry":
         _user_reviewed(admin_id=admin_current_user.user_id,user_id=user_id,retry=True)
         primary_photo.delete_user_photos_and_metadata(current_user=admin_current_user,to_delete_user_id=user_id, keep_retries=True)
+    elif decision == "not_duplicate" and user.get("found_by_duplicate_scan"):
+        # primary photo is registered already, the next scans do not queue these pairs again
+        _user_reviewed(admin_id=admin_current_user.user_id,user_id=user_id,retry=False)
+        _dismiss_duplicate_scan_pairs(user_id, user.get("possible_duplicate_with",[]))
     elif decision == "not_duplicate":
         try:
             sface_md = None
@@ -116,6 +124,8 @@ def make_decision(now: int, admin_current_user: Token, user_id:str, decision: st
         except Exception as e:
             _rollback_reviewed(admin_id=admin_current_user.user_id,user_id=user_id,user=user,retry=False)
             raise e
+        # the next scans do not queue these pairs again
+        _dismiss_duplicate_scan_pairs(user_id, user.get("possible_duplicate_with",[]))
     else:
         raise Exception(f"invalid decision:{decision}")
     logging.warning(f"admin decision - user_id {user_id} = {decision} processed by admin {admin_current_user.user_id}")
@@ -129,6 +139,8 @@ def next_user_for_review(admin_id):
         selfie = _get_review_photo(user_id)
         if not user:
             user = {"user_id": user_id}
+        if not selfie and user.get("found_by_duplicate_scan"):
+            selfie = _get_primary_photo(user_id)
         if not selfie:
             primary = _get_primary_photo(user_id)
             if primary:
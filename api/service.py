@@ -15,6 +15,7 @@ import jwt
 from faces import (
     get_primary_metadata                   as _get_primary_metadata,
     get_secondary_metadata                 as _get_secondary_metadata,
+    get_user_metadata                      as _get_user_metadata,
     update_secondary_metadata              as _update_secondary_metadata,
     find_similar_users                     as _find_similar_users,
     set_primary_metadata                   as _set_primary_metadata,
@@ -43,7 +44,7 @@ from users import (
     get_pending_face                           as _get_pending_face,
     add_possible_duplicate_with                as _add_possible_duplicate_with
 )
-import review, primary_photo
+import review, primary_photo, decoder, embedding_cache
 
 from PIL import Image
 import cv2
@@ -52,7 +53,9 @@ import numpy as np, io, requests
 from deepface.commons import distance
 from concurrent.futures import ThreadPoolExecutor, wait
 from deepface import DeepFace
+from deepface.detectors import FaceDetector
 from minio_uploader import (put_secondary_photo, put_primary_photo, get_primary_photo, get_secondary_photo,
+                            primary_photo_name, secondary_photo_name,
                             delete_photos as _delete_photos,
                             put_disabled_photo as _put_disable_photo,
                             get_disabled_photo as _get_disabled_photo,
@@ -73,6 +76,7 @@ _detector_low_quality = "yunet" # TODO: test with skip, if we gonna get proper p
 _similarity_metric = "euclidean_l2"
 _picture_extension = '.jpg'
 _max_executor_workers = 2
+_similarity_executor = None
 _images_count_per_call = 15
 _min_images_with_emotions_to_proceed = 1
 _time_format = '%Y-%m-%dT%H:%M:%S.%fZ%Z'
@@ -136,6 +140,9 @@ def analyze(img_path, actions, detector_backend, enforce_detection, align):
 def init_models():
     if current_app.config["MINIO_URI"]:
         DeepFace.build_model(_model_fallback)
+    logging.warning(f"initing face extractor {_detector_high_quality} PID:{os.getpid()}")
+    FaceDetector.warmup(_detector_high_quality, current_app.config["DETECTOR_WARMUP_SIZES"])
+    logging.warning(f"face extractor initialized {_detector_high_quality} PID:{os.getpid()}")
     logging.warning(f"building emotion model PID:{os.getpid()}")
     emotion = DeepFace.build_model("Emotion")
     logging.warning(f"emotion model built PID:{os.getpid()}")
@@ -149,24 +156,24 @@ def init_models():
                 if current_app.config["MINIO_URI"]:
                     DeepFace.represent(img_path=img, detector_backend=_detector_high_quality, model_name=_model_fallback, enforce_detection=False)
                 else:
-                    logging.warning(f"initing face extractor {_detector_high_quality} PID:{os.getpid()}")
                     DeepFace.extract_faces(img_path=img,detector_backend=_detector_high_quality, enforce_detection=False)
-                    logging.warning(f"face extractor initialized {_detector_high_quality} PID:{os.getpid()}")
                 logging.warning(f"initializing emotion extractor PID:{os.getpid()}")
                 emotion.predict_multi_emotions(face_img_list=[img])
                 logging.warning(f"initialized emotion extractor PID:{os.getpid()}")
     except requests.RequestException as e:
         logging.error(e, exc_info=e)
+    metrics.register_models_memory()
 
 def set_primary_photo_internal(now: int,user_id: str, photo_stream, attempt):
     img_to_represent, md, sface_md = primary_photo.extract_metadatas(user_id,photo_stream)
     threshold = current_app.config['PRIMARY_PHOTO_ARCFACE_DISTANCE']
     similar_users, distances = _find_similar_users(user_id, md, threshold)
     if similar_users[0] != user_id:
-        similar_user_md = _get_primary_metadata(similar_users[0], model=_model_fallback, search_growing=False)["face_metadata"]
+        similar_user = _get_user_metadata(similar_users[0], search_growing=False)
+        similar_user_md = similar_user.primary(_model_fallback)["face_metadata"]
         # make sure it is not a false positive, let's check other picture as well
-        secondary_md = _get_secondary_metadata(similar_users[0], model=_model)
-        existing_arcface_secondary_md = _get_secondary_metadata(similar_users[0], model=_model_fallback)
+        secondary_md = similar_user.secondary(_model)
+        existing_arcface_secondary_md = similar_user.secondary(_model_fallback)
         if existing_arcface_secondary_md:
             existing_arcface_secondary_md=existing_arcface_secondary_md["face_metadata"]
         if secondary_md:
@@ -182,15 +189,16 @@ def set_primary_photo_internal(now: int,user_id: str, photo_stream, attempt):
                 )
             else:
                 if not existing_arcface_secondary_md:
-                    most_similar_user_photo = get_secondary_photo(similar_users[0])
-                    if most_similar_user_photo:
-                        existing_arcface_secondary_md = distance.l2_normalize(DeepFace.represent(
-                            img_path=loadImageFromStream(io.BytesIO(most_similar_user_photo)),
-                            model_name=_model_fallback,
-                            detector_backend="yunet",
-                            normalization="base",
-                            target_size=(112, 112),
-                        )[0]["embedding"])
+                    most_similar_user_md = embedding_cache.represent_stored(
+                        secondary_photo_name(similar_users[0]),
+                        lambda: get_secondary_photo(similar_users[0]),
+                        model_name=_model_fallback,
+                        detector_backend="yunet",
+                        normalization="base",
+                        target_size=(112, 112),
+                    )
+                    if most_similar_user_md is not None:
+                        existing_arcface_secondary_md = distance.l2_normalize(most_similar_user_md)
                         _update_secondary_metadata(now,user_id=similar_users[0],metadata=existing_arcface_secondary_md,url="/photos/"+similar_users[0]+"/1",model=_model_fallback)
                 if existing_arcface_secondary_md is not None:
                     bestIndex, euclidian, bestNotFittingIndex = compare_metadatas([md,existing_arcface_secondary_md], current_app.config["PRIMARY_PHOTO_ARCFACE_DISTANCE"])
@@ -282,7 +290,7 @@ def check_similarity_and_update_secondary_photo(current_user, user_id: str, raw_
         raise exceptions.MetadataNotFound(f"User {user_id} have no registered primary metadata yet")
 
     md_vector = user_reference_metadata["face_metadata"]
-    pics = [loadImageFromStream(p) for p in raw_pics]
+    pics = decoder.load_pictures(raw_pics, current_app.config["REDUCED_DECODE_SIZE"])
     best_md, bestIndex, euclidian,threshold, bestNotFittingIndex = extract_and_compare_metadatas(md_vector, pics, _model)
     if bestIndex == -1:
         euclidian_sface = euclidian
@@ -327,9 +335,10 @@ def recheck_similarity_using_sface(primary_md, user_id: str, pics: list, sface_m
     if not secondary_md:
         return sface_metadatas[0], -1, -1, threshold, bestNotFittingIndex
 
+    # not the embedding of extract_and_compare_metadatas: the recheck thresholds were tuned on single scaled embeddings of the whole picture
     try:
         new_pic_md = distance.l2_normalize(DeepFace.represent(
-            img_path=pics[bestNotFittingIndex],
+            img_path=pics[bestNotFittingIndex].full,
             model_name=_model,
             detector_backend=_detector_low_quality,
             align=True,
@@ -346,20 +355,21 @@ def recheck_similarity_using_sface(primary_md, user_id: str, pics: list, sface_m
 
 def recheck_similarity_using_arcface(primary_md, user_id: str, pics: list,sface_metadatas: list, bestNotFittingIndex: int):
     # user is not the same as on primary photo - let's try with more complex but slower model as well to reduce false-negatives
-    primary_photo = get_primary_photo(user_id)
-    t = time.time()
-    md_vector = distance.l2_normalize(DeepFace.represent(
-        img_path=loadImageFromStream(io.BytesIO(primary_photo)),
+    primary_md_vector = embedding_cache.represent_stored(
+        primary_photo_name(user_id),
+        lambda: get_primary_photo(user_id),
         model_name=_model_fallback,
-        enforce_detection=True,
         detector_backend=_detector_high_quality,
         align=True,
         normalization="base",
-    )[0]["embedding"])
+    )
+    if primary_md_vector is None:
+        raise exceptions.MetadataNotFound(f"User {user_id} have no primary photo")
+    md_vector = distance.l2_normalize(primary_md_vector)
 
     threshold = _similarity_threshold(_model_fallback)
     bestIndex, euclidian, bestNotFittingIndex = compare_metadatas([md_vector,distance.l2_normalize(DeepFace.represent(
-        img_path=pics[bestNotFittingIndex],
+        img_path=pics[bestNotFittingIndex].full,
         model_name=_model_fallback,
         enforce_detection=True,
         detector_backend=_detector_high_quality,
@@ -369,52 +379,89 @@ def recheck_similarity_using_arcface(primary_md, user_id: str, pics: list,sface_
 
     return bestIndex, euclidian, threshold, bestNotFittingIndex
 
-def extract_and_compare_metadatas(user_reference_metadata: list, pics, model):
-    m = DeepFace.build_model(model)
-    def predict_pic(p):
+def _extract_face(picture: decoder.Picture):
+    _,f = DeepFace.extract_faces_custom(img_path=picture.image, target_size=(112, 112), detector_backend=_detector_low_quality, align=True, keep_uint8=True)
+    if picture.reduced and min(f[0]['facial_area']['w'], f[0]['facial_area']['h']) < 112:
+        # face is too small on the reduced picture, crop it from the full resolution one
+        _,f = DeepFace.extract_faces_custom(img_path=picture.full, target_size=(112, 112), detector_backend=_detector_low_quality, align=True, keep_uint8=True)
+    return f[0]['face']
+
+def _extract_and_represent(picture: decoder.Picture, model):
+    try:
+        face = _extract_face(picture)
+    except ValueError as e:
+        return None
+    return DeepFace.represent_batch(
+        [face],
+        model_name=model,
+        normalization="base",
+        target_size=(112, 112),
+        double_scaled=True, # same scale as stored metadata
+    )[0]
+
+def _extract_and_represent_all(pics, model):
+    faces = []
+    for p in pics:
         try:
-            _,f = DeepFace.extract_faces_custom(img_path=p, target_size=(112, 112), detector_backend=_detector_low_quality, align=True)
-            repr = f[0]['face']
+            faces.append(_extract_face(p))
         except ValueError as e:
-            raise exceptions.NoFaces("No faces detected on metadata comparison")
-        with metrics.represent_time.labels(model = model).time():
-            return distance.l2_normalize(DeepFace.represent(
-                img_path=repr,
-                model_name=_model,
-                detector_backend="skip",
-                normalization="base",
-                target_size=(112, 112),
-                align=True,
-                enforce_detection = False,
-            )[0]["embedding"])
-        # try:
-        #     _,f = DeepFace.extract_faces_custom(img_path=p, target_size=(112, 112), detector_backend=_detector_low_quality, align=True)
-        #     p = f[0]['face']
-        # except ValueError as e:
-        #     raise exceptions.NoFaces("No faces detected on metadata comparison")
-        # with metrics.represent_time.labels(model = model).time():
-        #     return distance.l2_normalize(m.predict(np.expand_dims(p, axis=0))[0].tolist())
+            faces.append(None)
+    # all detected faces are embedded with a single forward pass of the model
+    detected = [f for f in faces if f is not None]
+    mds = iter(DeepFace.represent_batch(
+        detected,
+        model_name=model,
+        normalization="base",
+        target_size=(112, 112),
+        double_scaled=True, # same scale as stored metadata
+    ) if len(detected) > 0 else [])
+    return [next(mds) if f is not None else None for f in faces]
+
+def _get_similarity_executor():
+    global _similarity_executor
+    if not _similarity_executor:
+        _similarity_executor = ThreadPoolExecutor(max_workers=current_app.config["SIMILARITY_WORKERS"], thread_name_prefix="similarity")
+    return _similarity_executor
+
+def extract_and_compare_metadatas(user_reference_metadata: list, pics, model):
+    """Compares pictures with the reference metadata in their order until one of them is close enough.
+    In "batch" mode all faces are detected, then embedded with a single forward pass,
+    in "parallel" mode pictures are evaluated speculatively on a thread pool and the ones not started yet are cancelled after the match.
+    Returns metadata of the last evaluated picture, index of the matching one (-1 if none), its distance, threshold and best not fitting index."""
+    futures = []
+    if current_app.config["SIMILARITY_EVALUATION"] == "parallel":
+        executor = _get_similarity_executor()
+        futures = [executor.submit(_extract_and_represent, p, model) for p in pics]
+        mds = [None] * len(pics)
+        get_md = lambda i: futures[i].result()
+    else:
+        mds = _extract_and_represent_all(pics, model)
+        get_md = lambda i: mds[i]
     threshold = _similarity_threshold(model)
     d = threshold + 1
     idx = 0
     best_idx = idx
     best_distance = d
     md = []
-    while d > threshold and idx < len(pics):
-        try:
-            md = predict_pic(pics[idx])
-        except exceptions.NoFaces as e:
-            if idx >= len(pics) - 1:
-                raise e # last pic, we have to fail anyway
-            else:
-                idx += 1
-                continue
-        current_distance = distance.findEuclideanDistance(user_reference_metadata, md)
-        if min(best_distance, current_distance) < best_distance:
-            best_idx = idx
-            best_distance = d
-        d = current_distance
-        idx += 1
+    try:
+        while d > threshold and idx < len(pics):
+            mds[idx] = get_md(idx)
+            if mds[idx] is None:
+                if idx >= len(pics) - 1:
+                    raise exceptions.NoFaces("No faces detected on metadata comparison") # last pic, we have to fail anyway
+                else:
+                    idx += 1
+                    continue
+            md = mds[idx]
+            current_distance = distance.findEuclideanDistance(user_reference_metadata, md)
+            if min(best_distance, current_distance) < best_distance:
+                best_idx = idx
+                best_distance = d
+            d = current_distance
+            idx += 1
+    finally:
+        for f in futures:
+            f.cancel()
     if d > threshold:
         return md, -1, d,threshold, best_idx
     return md, best_idx,d,threshold, best_idx
@@ -424,15 +471,12 @@ def _similarity_threshold(model: str):
 
 def compare_metadatas(metadatas: list, threshold: float):
     normalizedRefMetadata = metadatas.pop(0)
-    distances = [distance.findEuclideanDistance(normalizedRefMetadata, md) for md in metadatas]
-    m = distances[0]
-    indexes = [(distances.index(d), m := min(d,m)) for d in distances if d <= threshold]
-    indexes.sort(key=lambda x: x[1])
-
-    if len(indexes) != len(metadatas) and len(indexes) < _min_images_with_emotions_to_proceed:
-        return -1, min([i for i in distances if i > threshold]), int(np.argmin(distances))
-    else:
-        return indexes[0][0], m, indexes[0][0]
+    distances = distance.find_distances(normalizedRefMetadata, metadatas)
+    best = int(np.argmin(distances))
+    within = distances <= threshold
+    if not within.all() and np.count_nonzero(within) < _min_images_with_emotions_to_proceed:
+        return -1, distances[~within].min(), best
+    return best, distances[best], best
 
 def loadImageFromStream(p):
     chunk_arr = np.frombuffer(p.read(), dtype=np.uint8)
@@ -441,8 +485,8 @@ def loadImageFromStream(p):
     return img
 
 def get_status(user_id: str):
-    primary = _get_primary_metadata(user_id, model=_model_fallback)
-    secondary = _get_secondary_metadata(user_id, model=_model)
+    user_md = _get_user_metadata(user_id)
+    primary, secondary = user_md.primary(_model_fallback), user_md.secondary(_model)
     primaryUploaded = primary is not None
     if primaryUploaded and secondary is not None:
         lastVerified = max(primary["uploaded_at"], secondary["uploaded_at"])
@@ -593,13 +637,10 @@ def _generate_best_scores(usr, current_emotions_list,scores, model, images_count
 
 def _predict(usr, model, images, now, awaited_emotion):
     t = time.time()
-    face_img_list = []
-    for img in images:
-        loaded_image = loadImageFromStream(img)
-        if loaded_image.shape[0] != model.img_size or loaded_image.shape[1] != model.img_size:
+    face_img_list = decoder.load_images(images)
+    for loaded_image in face_img_list:
+        if loaded_image is None or loaded_image.shape[0] != model.img_size or loaded_image.shape[1] != model.img_size:
             raise exceptions.WrongImageSizeException(f"wrong image size for user:{usr['user_id']}, session:{usr['session_id']}")
-
-        face_img_list.append(loaded_image)
     try:
         DeepFace.extract_faces(face_img_list[1+int(len(face_img_list)/2)], target_size=(112, 112), detector_backend=_detector_low_quality, enforce_detection=True, landmarks_verification=False)
     except ValueError as e:
@@ -940,8 +981,8 @@ def emotions_cleanup():
         except OSError as e:
             logging.warning(str(e))
 def reenable_user(current_user, user_id: str, duplicated_face: str):
-    primary = _get_primary_metadata(user_id, model = _model_fallback, search_growing = False)
-    secondary = _get_secondary_metadata(user_id, model=_model)
+    user_md = _get_user_metadata(user_id, search_growing = False)
+    primary, secondary = user_md.primary(_model_fallback), user_md.secondary(_model)
 
     _enable_user(user_id)
 
@@ -998,13 +1039,13 @@ def _reprocess_wrongfully_disabled_users():
                 md, md_sface,similar_users = set_primary_photo_internal(now,user_id=user_id, photo_stream=io.BytesIO(photo), attempt=-1)
             except exceptions.FailedTryToDisable as e:
                 md = e.arcface_metadata
-                md_sface = distance.l2_normalize(DeepFace.represent(
-                    img_path=loadImageFromStream(io.BytesIO(photo)),
+                md_sface = distance.l2_normalize(embedding_cache.represent(
+                    photo,
                     model_name=_model,
                     detector_backend="skip",
                     normalization="base",
                     target_size=(112, 112),
-                )[0]["embedding"])
+                ))
             except Exception as e:
                 _put_disabled_user_for_selfie_reprocessing(user_id)
                 logging.error(f"[reprocess_wrongfully_disabled_users] User {user_id}: "+str(e), exc_info=e)
@@ -18,6 +18,9 @@ def _pendingFace(userId: str):
     return "pendingFace:"+userId
 def _reviewMetadata(userId: str):
     return "reviewMetadata:"+userId
+def _duplicateScanPair(userId: str, otherUserId: str):
+    return ",".join(sorted([userId, otherUserId]))
+_duplicateScanDismissed = "duplicateScan:dismissed"
 
 def _expirationKey(session_started_at: int, duration: int):
     session_idx = int(session_started_at / duration)
@@ -111,7 +114,8 @@ def get_user(user_id: str, search_growing = True):
               "available_retries",
               "possible_duplicate_with",
               "duplicate_review_count",
-              "ip"
+              "ip",
+              "found_by_duplicate_scan"
             ]
     mappers = {
         "session_id": lambda x: str(x, encoding = "utf-8") if x else "",
@@ -124,7 +128,8 @@ def get_user(user_id: str, search_growing = True):
         "available_retries": int,
         "duplicate_review_count": lambda x: int(x) if x else 0,
         "possible_duplicate_with": lambda x: str(x, encoding = "utf-8").split(",") if x else [],
-        "ip":lambda x: str(x, encoding = "utf-8") if x else ""
+        "ip":lambda x: str(x, encoding = "utf-8") if x else "",
+        "found_by_duplicate_scan": lambda x: bool(x)
     }
     res = r.hmget(_userKey(user_id),hkeys)
     if res.count(None) == len(hkeys):
@@ -237,6 +242,32 @@ def mark_user_for_manual_review(user_id: str, ip: str, similar_users: List[str],
         p.execute()
     return False
 
+def mark_user_for_duplicate_scan_review(user_id: str, similar_users: List[str]):
+    """Queues a registered user for duplicate review, unless the user is on review already."""
+    r = _get_client()
+    if r.hexists(_userKey(user_id), "possible_duplicate_with"):
+        return False
+    with r.pipeline(transaction=True) as p:
+        p.hset(_userKey(user_id), mapping = {
+            "possible_duplicate_with": ",".join(similar_users),
+            "found_by_duplicate_scan": 1
+        })
+        p.sadd("users_pending_duplicate_review", user_id)
+        p.execute()
+    return True
+
+def dismiss_duplicate_scan_pairs(user_id: str, similar_users: List[str]):
+    if similar_users:
+        _get_client().sadd(_duplicateScanDismissed, *[_duplicateScanPair(user_id, u) for u in similar_users])
+
+def are_duplicate_scan_pairs_dismissed(pairs: list):
+    """Returns a flag for every (user_id, similar user_id) pair, set if admins decided they are not duplicates."""
+    r = _get_client()
+    with r.pipeline(transaction=False) as p:
+        for user_id, similar_user_id in pairs:
+            p.sismember(_duplicateScanDismissed, _duplicateScanPair(user_id, similar_user_id))
+        return [bool(d) for d in p.execute()]
+
 def get_face_metadata_pending_review(user_id: str):
     r = _get_client()
     return r.lrange(_reviewMetadata(user_id), 0, -1)
@@ -266,7 +297,7 @@ def user_reviewed(admin_id: str, user_id: str, retry = False):
             p.hincrby(_userKey(user_id),"duplicate_review_count")
         else:
             p.hdel(_userKey(user_id),"duplicate_review_count")
-        p.hdel(_userKey(user_id),"possible_duplicate_with","ip")
+        p.hdel(_userKey(user_id),"possible_duplicate_with","ip","found_by_duplicate_scan")
         p.delete(f"user_pending_duplicate_review_{admin_id}")
         p.delete(_reviewMetadata(user_id))
         p.execute()
@@ -299,6 +330,8 @@ def rollback_reviewed(admin_id: str, user_id: str, user: dict, retry = False,):
         else:
             p.hset(_userKey(user_id),mapping = {"duplicate_review_count":user.get("duplicate_review_count", 0)})
         p.hset(_userKey(user_id), mapping = {"possible_duplicate_with":",".join(user.get("possible_duplicate_with",[]))})
+        if user.get("found_by_duplicate_scan"):
+            p.hset(_userKey(user_id), mapping = {"found_by_duplicate_scan": 1})
         p.set(f"user_pending_duplicate_review_{admin_id}", user_id)
         p.execute()
 
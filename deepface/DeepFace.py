@@ -1,9 +1,9 @@
 # common dependencies
 import os
+import hashlib
 from os import path
 import warnings
 import time
-import pickle
 import logging
 
 # 3rd party dependencies
@@ -13,7 +13,6 @@ from tqdm import tqdm
 import cv2
 import tensorflow as tf
 from deprecated import deprecated
-import threading
 # package dependencies
 from deepface.basemodels import (
     VGGFace,
@@ -24,10 +23,20 @@ from deepface.basemodels import (
     DeepID,
     DlibWrapper,
     ArcFace,
+    ArcFaceOnnx,
     SFace,
 )
 from deepface.extendedmodels import Age, Gender, Race, Emotion, hsefer
-from deepface.commons import functions, realtime, distance as dst
+from deepface.commons import (
+    functions,
+    realtime,
+    pipeline,
+    registry,
+    search,
+    store,
+    indexer,
+    distance as dst,
+)
 
 # -----------------------------------
 # configurations for dependencies
@@ -40,6 +49,8 @@ if tf_version == 2:
 # -----------------------------------
 
 represent_metric = None
+# (mtime, identities, index) of representations files find was called with
+_find_indexes = {}
 
 def set_represent_metric(m):
     global represent_metric
@@ -53,13 +64,19 @@ def build_model(model_name):
                     VGG-Face, Facenet, OpenFace, DeepFace, DeepID for face recognition
                     Age, Gender, Emotion, Race for facial attributes
 
+                    Emotion is the onnx model of HSEmotion, Emotion-FER the keras one on
+                    48x48 grayscale faces.
+
+                    ArcFace is served by onnx runtime instead of tensorflow if
+                    ARCFACE_BACKEND environment variable is set to onnx.
+
+                    SFace and Emotion use their INT8 variants if SFACE_PRECISION or
+                    EMOTION_PRECISION environment variables are set to int8.
+
     Returns:
             built deepface model
     """
 
-    # singleton design pattern
-    global model_obj
-
     models = {
         "VGG-Face": VGGFace.loadModel,
         "OpenFace": OpenFace.loadModel,
@@ -68,25 +85,22 @@ def build_model(model_name):
         "DeepFace": FbDeepFace.loadModel,
         "DeepID": DeepID.loadModel,
         "Dlib": DlibWrapper.loadModel,
-        "ArcFace": ArcFace.loadModel,
-        "SFace": SFace.load_model,
-        "Emotion": hsefer.loadModel,
+        "ArcFace": ArcFaceOnnx.loadModel
+        if os.environ.get("ARCFACE_BACKEND", "keras") == "onnx"
+        else ArcFace.loadModel,
+        "SFace": lambda: SFace.load_model(quantized=os.environ.get("SFACE_PRECISION") == "int8"),
+        "Emotion": lambda: hsefer.loadModel(quantized=os.environ.get("EMOTION_PRECISION") == "int8"),
+        "Emotion-FER": Emotion.loadModel,
         "Age": Age.loadModel,
         "Gender": Gender.loadModel,
         "Race": Race.loadModel,
     }
-    if not "model_obj" in globals():
-        model_obj = {}
-    thrName = threading.currentThread().getName()
-    if not model_name+thrName in model_obj:
-        model = models.get(model_name)
-        if model:
-            model = model()
-            model_obj[model_name+thrName] = model
-        else:
-            raise ValueError(f"Invalid model_name passed - {model_name}")
+    model = models.get(model_name)
+    if not model:
+        raise ValueError(f"Invalid model_name passed - {model_name}")
 
-    return model_obj[model_name+thrName]
+    # singleton design pattern, models are shared between all threads of the process
+    return registry.get_model(model_name, model)
 
 
 def verify(
@@ -174,50 +188,42 @@ def verify(
         align=align,
     )
     # --------------------------------
-    distances = []
-    regions = []
-    # now we will find the face pair with minimum distance
-    for img1_content, img1_region, _ in img1_objs:
-        for img2_content, img2_region, _ in img2_objs:
-            img1_embedding_obj = represent(
-                img_path=img1_content,
-                model_name=model_name,
-                enforce_detection=enforce_detection,
-                detector_backend="skip",
-                align=align,
-                normalization=normalization,
-            )
-
-            img2_embedding_obj = represent(
-                img_path=img2_content,
-                model_name=model_name,
-                enforce_detection=enforce_detection,
-                detector_backend="skip",
-                align=align,
-                normalization=normalization,
-            )
-
-            img1_representation = img1_embedding_obj[0]["embedding"]
-            img2_representation = img2_embedding_obj[0]["embedding"]
-
-            if distance_metric == "cosine":
-                distance = dst.findCosineDistance(img1_representation, img2_representation)
-            elif distance_metric == "euclidean":
-                distance = dst.findEuclideanDistance(img1_representation, img2_representation)
-            elif distance_metric == "euclidean_l2":
-                distance = dst.findEuclideanDistance(
-                    dst.l2_normalize(img1_representation), dst.l2_normalize(img2_representation)
-                )
-            else:
-                raise ValueError("Invalid distance_metric passed - ", distance_metric)
-
-            distances.append(distance)
-            regions.append((img1_region, img2_region))
+    # every face is represented once, then the face pair with minimum distance is found
+    img1_representations = [
+        represent(
+            img_path=img1_content,
+            model_name=model_name,
+            enforce_detection=enforce_detection,
+            detector_backend="skip",
+            align=align,
+            normalization=normalization,
+        )[0]["embedding"]
+        for img1_content, _, _ in img1_objs
+    ]
+    img2_representations = [
+        represent(
+            img_path=img2_content,
+            model_name=model_name,
+            enforce_detection=enforce_detection,
+            detector_backend="skip",
+            align=align,
+            normalization=normalization,
+        )[0]["embedding"]
+        for img2_content, _, _ in img2_objs
+    ]
+
+    distances = np.array(
+        [
+            dst.find_distances(img1_representation, img2_representations, distance_metric)
+            for img1_representation in img1_representations
+        ]
+    )
+    best = np.unravel_index(np.argmin(distances), distances.shape)
 
     # -------------------------------
     threshold = dst.findThreshold(model_name, distance_metric)
-    distance = min(distances)  # best distance
-    facial_areas = regions[np.argmin(distances)]
+    distance = distances[best]  # best distance
+    facial_areas = (img1_objs[best[0]][1], img2_objs[best[1]][1])
 
     toc = time.time()
 
@@ -235,6 +241,147 @@ def verify(
     return resp_obj
 
 
+def verify_batch(
+    pairs,
+    model_name="VGG-Face",
+    detector_backend="opencv",
+    distance_metric="cosine",
+    enforce_detection=True,
+    align=True,
+    normalization="base",
+    target_size=None,
+    batch_size=64,
+    skip_errors=False,
+    silent=True,
+):
+    """
+    This function verifies many image pairs at once. Images appearing in several pairs are
+    detected once, every unique face is represented once in batched model calls, and distances
+    of all face pairs are computed together.
+
+    Parameters:
+            pairs (list): (img1_path, img2_path) tuples, items are the ones verify takes. Equal
+            paths, base64 strings or numpy arrays are processed once.
+
+            model_name, detector_backend, distance_metric, enforce_detection, align,
+            normalization, target_size: same as verify. detector_backend might be a tuple of
+            the detectors of img1 and img2 as well.
+
+            batch_size (int): faces represented by a single model call.
+
+            skip_errors (boolean): an image failing detection makes its pairs return a dict with
+            its "error" message instead of raising the exception.
+
+            silent (boolean): disable the progress bar of face detection
+
+    Returns:
+            list of dictionaries verify returns, in the order of pairs. Time is the one of the
+            whole batch.
+    """
+
+    tic = time.time()
+
+    if target_size is None:
+        target_size = functions.find_target_size(model_name=model_name)
+    if type(detector_backend) == str:
+        detector_backend = (detector_backend, detector_backend)
+
+    def image_key(img, backend):
+        if isinstance(img, np.ndarray):
+            content = hashlib.sha1(np.ascontiguousarray(img).tobytes()).hexdigest()
+            return backend, img.shape, img.dtype.str, content
+        return backend, img
+
+    # --------------------------------
+    # unique images of the pairs, with the rows of their faces in the embedding matrix
+    pair_keys = [
+        (image_key(img1_path, detector_backend[0]), image_key(img2_path, detector_backend[1]))
+        for img1_path, img2_path in pairs
+    ]
+    images = {}
+    for (img1_path, img2_path), keys in zip(pairs, pair_keys):
+        images.setdefault(keys[0], img1_path)
+        images.setdefault(keys[1], img2_path)
+
+    faces = []
+    image_faces = {}  # key -> (first row, facial areas) or exception
+    for key, img in tqdm(images.items(), desc="Detecting faces", disable=silent):
+        try:
+            img_objs = functions.extract_faces(
+                img=img,
+                target_size=target_size,
+                detector_backend=key[0],
+                grayscale=False,
+                enforce_detection=enforce_detection,
+                align=align,
+            )
+        except ValueError as err:
+            if not skip_errors:
+                raise
+            image_faces[key] = err
+            continue
+        image_faces[key] = (len(faces), [region for _, region, _ in img_objs])
+        faces.extend(img_content[0] for img_content, _, _ in img_objs)
+
+    embeddings = [
+        represent_batch(
+            faces[start : start + batch_size],
+            model_name=model_name,
+            normalization=normalization,
+            target_size=target_size,
+            l2_normalize=False,
+        )
+        for start in range(0, len(faces), batch_size)
+    ]
+    embeddings = np.concatenate(embeddings) if embeddings else np.empty((0, 0))
+
+    # --------------------------------
+    # every face of img1 against every face of img2, for all pairs at once
+    rows1, rows2, segments = [], [], []
+    for keys in pair_keys:
+        if any(isinstance(image_faces[key], ValueError) for key in keys):
+            segments.append(None)
+            continue
+        (first1, areas1), (first2, areas2) = image_faces[keys[0]], image_faces[keys[1]]
+        segments.append((len(rows1), len(areas1), len(areas2)))
+        rows1.extend(np.repeat(np.arange(first1, first1 + len(areas1)), len(areas2)))
+        rows2.extend(np.tile(np.arange(first2, first2 + len(areas2)), len(areas1)))
+
+    rows1, rows2 = np.asarray(rows1, dtype=int), np.asarray(rows2, dtype=int)
+    distances = dst.paired_distances(embeddings[rows1], embeddings[rows2], distance_metric)
+
+    # -------------------------------
+    threshold = dst.findThreshold(model_name, distance_metric)
+    toc = time.time()
+
+    resp_objs = []
+    for keys, segment in zip(pair_keys, segments):
+        if segment is None:
+            err = next(image_faces[key] for key in keys if isinstance(image_faces[key], ValueError))
+            resp_objs.append({"error": str(err)})
+            continue
+        start, count1, count2 = segment
+        best = int(np.argmin(distances[start : start + count1 * count2]))
+        distance = distances[start + best]
+        resp_objs.append(
+            {
+                "verified": distance <= threshold,
+                "distance": distance,
+                "threshold": threshold,
+                "model": model_name,
+                "detector_backend": detector_backend,
+                "similarity_metric": distance_metric,
+                "facial_areas": {
+                    "img1": image_faces[keys[0]][1][best // count2],
+                    "img2": image_faces[keys[1]][1][best % count2],
+                },
+                "time": round(toc - tic, 2),
+            }
+        )
+
+    return resp_objs
+
+
 def analyze(
     img_path,
     actions=("emotion", "age", "gender", "race"),
@@ -242,6 +389,7 @@ def analyze(
     detector_backend="opencv",
     align=True,
     silent=False,
+    emotion_model="hsefer",
 ):
     """
     This function analyzes facial attributes including age, gender, emotion and race.
@@ -265,7 +413,10 @@ def analyze(
 
             align (boolean): alignment according to the eye positions.
 
-            silent (boolean): disable (some) log messages
+            silent (boolean): kept for compatibility, faces are analyzed without progress bar
+
+            emotion_model (string): hsefer (onnx model of HSEmotion, labels of its idx_to_class)
+            or fer (keras model on 48x48 grayscale faces, labels of Emotion.labels)
 
     Returns:
             The function returns a list of dictionaries for each face appearing in the image.
@@ -281,13 +432,14 @@ def analyze(
                             }
                             "dominant_emotion": "neutral",
                             "emotion": {
-                                    'sad': 37.65260875225067,
-                                    'angry': 0.15512987738475204,
-                                    'surprise': 0.0022171278033056296,
-                                    'fear': 1.2489334680140018,
-                                    'happy': 4.609785228967667,
+                                    'anger': 0.15512987738475204,
+                                    'contempt': 0.0017823271,
                                     'disgust': 9.698561953541684e-07,
-                                    'neutral': 56.33133053779602
+                                    'fear': 1.2489334680140018,
+                                    'happiness': 4.609785228967667,
+                                    'neutral': 56.33133053779602,
+                                    'sadness': 37.65260875225067,
+                                    'surprise': 0.0022171278033056296
                             }
                             "dominant_race": "white",
                             "race": {
@@ -301,6 +453,44 @@ def analyze(
                     }
             ]
     """
+    return analyze_batch(
+        [img_path],
+        actions=actions,
+        enforce_detection=enforce_detection,
+        detector_backend=detector_backend,
+        align=align,
+        emotion_model=emotion_model,
+    )[0]
+
+
+def analyze_batch(
+    img_paths,
+    actions=("emotion", "age", "gender", "race"),
+    enforce_detection=True,
+    detector_backend="opencv",
+    align=True,
+    emotion_model="hsefer",
+    batch_size=64,
+    silent=True,
+):
+    """
+    This function analyzes facial attributes of all faces of many images at once. Faces are
+    detected once and shared by the actions, then every attribute model runs a single batch
+    per batch_size faces instead of a call per face.
+
+    Parameters:
+            img_paths (list): images, items are the ones analyze takes.
+
+            actions, enforce_detection, detector_backend, align, emotion_model: same as analyze.
+
+            batch_size (int): faces predicted by a single model call.
+
+            silent (boolean): disable the progress bar of face detection
+
+    Returns:
+            list with the list of dictionaries analyze returns for every image, in the order of
+            img_paths.
+    """
     # ---------------------------------
     # validate actions
     if isinstance(actions, str):
@@ -319,11 +509,14 @@ def analyze(
                 f"Invalid action passed ({repr(action)})). "
                 "Valid actions are `emotion`, `age`, `gender`, `race`."
             )
+
+    if emotion_model not in ("hsefer", "fer"):
+        raise ValueError(f"Invalid emotion_model passed - {emotion_model}")
     # ---------------------------------
     # build models
     models = {}
     if "emotion" in actions:
-        models["emotion"] = build_model("Emotion")
+        models["emotion"] = build_model("Emotion" if emotion_model == "hsefer" else "Emotion-FER")
 
     if "age" in actions:
         models["age"] = build_model("Age")
@@ -334,76 +527,91 @@ def analyze(
     if "race" in actions:
         models["race"] = build_model("Race")
     # ---------------------------------
+    # faces of all images, detected once for all actions
+    faces = []
     resp_objects = []
+    for img_path in tqdm(img_paths, desc="Detecting faces", disable=silent):
+        img_objs = functions.extract_faces(
+            img=img_path,
+            target_size=(224, 224),
+            detector_backend=detector_backend,
+            grayscale=False,
+            enforce_detection=enforce_detection,
+            align=align,
+        )
+        resp_objects.append([{"region": img_region} for _, img_region, _ in img_objs])
+        faces.extend(img_content[0] for img_content, _, _ in img_objs)
 
-    img_objs = functions.extract_faces(
-        img=img_path,
-        target_size=(224, 224),
-        detector_backend=detector_backend,
-        grayscale=False,
-        enforce_detection=enforce_detection,
-        align=align,
-    )
-
-    for img_content, img_region, _ in img_objs:
-        if img_content.shape[0] > 0 and img_content.shape[1] > 0:
-            obj = {}
-            # facial attribute analysis
-            pbar = tqdm(range(0, len(actions)), desc="Finding actions", disable=silent)
-            for index in pbar:
-                action = actions[index]
-                pbar.set_description(f"Action: {action}")
+    objs = [obj for img_objs in resp_objects for obj in img_objs]
+    for start in range(0, len(faces), batch_size):
+        _analyze_faces(
+            faces[start : start + batch_size], objs[start : start + batch_size], actions, models
+        )
 
-                if action == "emotion":
-                    img_gray = cv2.cvtColor(img_content[0], cv2.COLOR_BGR2GRAY)
-                    img_gray = cv2.resize(img_gray, (48, 48))
-                    img_gray = np.expand_dims(img_gray, axis=0)
+    return resp_objects
 
-                    emotion_predictions = models["emotion"].predict(img_gray, verbose=0)[0, :]
 
-                    sum_of_predictions = emotion_predictions.sum()
+def _analyze_faces(faces, objs, actions, models):
+    # facial attributes of a batch of faces are written to their objs
+    batch = np.stack(faces)
 
-                    obj["emotion"] = {}
+    for action in actions:
+        if action == "emotion" and isinstance(models["emotion"], hsefer.HSEmotionRecognizer):
+            model = models["emotion"]
+            # HSEmotion takes pixels in [0, 255]
+            _, scores = model.predict_multi_emotions(
+                face_img_list=[face * 255 for face in faces], logits=False
+            )
+            for obj, emotion_predictions in zip(objs, scores[:, : len(model.idx_to_class)]):
+                obj["emotion"] = {}
+                for i, emotion_label in model.idx_to_class.items():
+                    obj["emotion"][emotion_label] = 100 * emotion_predictions[i]
 
-                    for i, emotion_label in enumerate(Emotion.labels):
-                        emotion_prediction = 100 * emotion_predictions[i] / sum_of_predictions
-                        obj["emotion"][emotion_label] = emotion_prediction
+                obj["dominant_emotion"] = model.idx_to_class[np.argmax(emotion_predictions)]
 
-                    obj["dominant_emotion"] = Emotion.labels[np.argmax(emotion_predictions)]
+        elif action == "emotion":
+            img_gray = np.stack(
+                [cv2.resize(cv2.cvtColor(face, cv2.COLOR_BGR2GRAY), (48, 48)) for face in faces]
+            )
+            predictions = np.asarray(models["emotion"].predict_on_batch(img_gray[..., np.newaxis]))
+            for obj, emotion_predictions in zip(objs, predictions):
+                sum_of_predictions = emotion_predictions.sum()
 
-                elif action == "age":
-                    age_predictions = models["age"].predict(img_content, verbose=0)[0, :]
-                    apparent_age = Age.findApparentAge(age_predictions)
-                    # int cast is for exception - object of type 'float32' is not JSON serializable
-                    obj["age"] = int(apparent_age)
+                obj["emotion"] = {}
+                for i, emotion_label in enumerate(Emotion.labels):
+                    emotion_prediction = 100 * emotion_predictions[i] / sum_of_predictions
+                    obj["emotion"][emotion_label] = emotion_prediction
 
-                elif action == "gender":
-                    gender_predictions = models["gender"].predict(img_content, verbose=0)[0, :]
-                    obj["gender"] = {}
-                    for i, gender_label in enumerate(Gender.labels):
-                        gender_prediction = 100 * gender_predictions[i]
-                        obj["gender"][gender_label] = gender_prediction
+                obj["dominant_emotion"] = Emotion.labels[np.argmax(emotion_predictions)]
 
-                    obj["dominant_gender"] = Gender.labels[np.argmax(gender_predictions)]
+        elif action == "age":
+            predictions = np.asarray(models["age"].predict_on_batch(batch))
+            for obj, age_predictions in zip(objs, predictions):
+                apparent_age = Age.findApparentAge(age_predictions)
+                # int cast is for exception - object of type 'float32' is not JSON serializable
+                obj["age"] = int(apparent_age)
 
-                elif action == "race":
-                    race_predictions = models["race"].predict(img_content, verbose=0)[0, :]
-                    sum_of_predictions = race_predictions.sum()
+        elif action == "gender":
+            predictions = np.asarray(models["gender"].predict_on_batch(batch))
+            for obj, gender_predictions in zip(objs, predictions):
+                obj["gender"] = {}
+                for i, gender_label in enumerate(Gender.labels):
+                    gender_prediction = 100 * gender_predictions[i]
+                    obj["gender"][gender_label] = gender_prediction
 
-                    obj["race"] = {}
-                    for i, race_label in enumerate(Race.labels):
-                        race_prediction = 100 * race_predictions[i] / sum_of_predictions
-                        obj["race"][race_label] = race_prediction
+                obj["dominant_gender"] = Gender.labels[np.argmax(gender_predictions)]
 
-                    obj["dominant_race"] = Race.labels[np.argmax(race_predictions)]
+        elif action == "race":
+            predictions = np.asarray(models["race"].predict_on_batch(batch))
+            for obj, race_predictions in zip(objs, predictions):
+                sum_of_predictions = race_predictions.sum()
 
-                # -----------------------------
-                # mention facial areas
-                obj["region"] = img_region
+                obj["race"] = {}
+                for i, race_label in enumerate(Race.labels):
+                    race_prediction = 100 * race_predictions[i] / sum_of_predictions
+                    obj["race"][race_label] = race_prediction
 
-            resp_objects.append(obj)
-
-    return resp_objects
+                obj["dominant_race"] = Race.labels[np.argmax(race_predictions)]
 
 
 def find(
@@ -416,6 +624,9 @@ def find(
     align=True,
     normalization="base",
     silent=False,
+    search_index="brute_force",
+    refresh_db=True,
+    indexing_workers=1,
 ):
     """
     This function applies verification several times and find the identities in a database
@@ -447,6 +658,22 @@ def find(
 
             silent (boolean): disable some logging and progress bars
 
+            search_index (string): index over the representations of db_path, brute_force (exact),
+            hnsw or ivf (approximate, need hnswlib or faiss). The index is kept in memory until
+            the representations file changes, approximate ones are saved next to it as well.
+
+            refresh_db (boolean): embed images added to or changed in db_path since the last call
+            and drop deleted ones. Set this to False to search the stored representations as they
+            are, without walking db_path. They are stored as a memory mapped matrix, set
+            REPRESENTATIONS_DTYPE environment variable to float16 to halve its size. A
+            representations pkl file of former versions is imported once.
+
+            indexing_workers (int): processes reading images of db_path and detecting their faces
+            while representations are built, faces are embedded in batches by the calling process.
+            An interrupted build continues with the images which were not stored yet. Workers are
+            spawned, so with more than 1 the calling script must start under an
+            if __name__ == "__main__": guard.
+
     Returns:
             This function returns list of pandas data frame. Each item of the list corresponding to
             an identity in the img_path.
@@ -454,106 +681,23 @@ def find(
 
     tic = time.time()
 
-    # -------------------------------
-    if os.path.isdir(db_path) is not True:
-        raise ValueError("Passed db_path does not exist!")
-
     target_size = functions.find_target_size(model_name=model_name)
 
     # ---------------------------------------
 
-    file_name = f"representations_{model_name}.pkl"
-    file_name = file_name.replace("-", "_").lower()
-
-    if path.exists(db_path + "/" + file_name):
-
-        if not silent:
-            print(
-                f"WARNING: Representations for images in {db_path} folder were previously stored"
-                + f" in {file_name}. If you added new instances after the creation, then please "
-                + "delete this file and call find function again. It will create it again."
-            )
-
-        with open(f"{db_path}/{file_name}", "rb") as f:
-            representations = pickle.load(f)
-
-        if not silent:
-            print("There are ", len(representations), " representations found in ", file_name)
-
-    else:  # create representation.pkl from scratch
-        employees = []
-
-        for r, _, f in os.walk(db_path):
-            for file in f:
-                if (
-                    (".jpg" in file.lower())
-                    or (".jpeg" in file.lower())
-                    or (".png" in file.lower())
-                ):
-                    exact_path = r + "/" + file
-                    employees.append(exact_path)
-
-        if len(employees) == 0:
-            raise ValueError(
-                "There is no image in ",
-                db_path,
-                " folder! Validate .jpg or .png files exist in this path.",
-            )
-
-        # ------------------------
-        # find representations for db images
-
-        representations = []
-
-        # for employee in employees:
-        pbar = tqdm(
-            range(0, len(employees)),
-            desc="Finding representations",
-            disable=silent,
-        )
-        for index in pbar:
-            employee = employees[index]
-
-            img_objs = functions.extract_faces(
-                img=employee,
-                target_size=target_size,
-                detector_backend=detector_backend,
-                grayscale=False,
-                enforce_detection=enforce_detection,
-                align=align,
-            )
-
-            for img_content, _, _ in img_objs:
-                embedding_obj = represent(
-                    img_path=img_content,
-                    model_name=model_name,
-                    enforce_detection=enforce_detection,
-                    detector_backend="skip",
-                    align=align,
-                    normalization=normalization,
-                )
-
-                img_representation = embedding_obj[0]["embedding"]
-
-                instance = []
-                instance.append(employee)
-                instance.append(img_representation)
-                representations.append(instance)
-
-        # -------------------------------
-
-        with open(f"{db_path}/{file_name}", "wb") as f:
-            pickle.dump(representations, f)
-
-        if not silent:
-            print(
-                f"Representations stored in {db_path}/{file_name} file."
-                + "Please delete this file when you add new identities in your database."
-            )
-
-    # ----------------------------
-    # now, we got representations for facial database
-    df = pd.DataFrame(representations, columns=["identity", f"{model_name}_representation"])
+    identities, db_index = load_database(
+        db_path,
+        model_name=model_name,
+        distance_metric=distance_metric,
+        enforce_detection=enforce_detection,
+        detector_backend=detector_backend,
+        align=align,
+        normalization=normalization,
+        silent=silent,
+        search_index=search_index,
+        refresh_db=refresh_db,
+        indexing_workers=indexing_workers,
+    )
 
     # img path might have more than once face
     target_objs = functions.extract_faces(
@@ -565,55 +709,29 @@ def find(
         align=align,
     )
 
-    resp_obj = []
-
-    for target_img, target_region, _ in target_objs:
-        target_embedding_obj = represent(
-            img_path=target_img,
+    # faces of img_path are embedded the same way as the ones of db_path, and searched at once
+    threshold = dst.findThreshold(model_name, distance_metric)
+    results = []
+    if len(target_objs) > 0:
+        target_representations = represent_batch(
+            [target_img[0] for target_img, _, _ in target_objs],
             model_name=model_name,
-            enforce_detection=enforce_detection,
-            detector_backend="skip",
-            align=align,
             normalization=normalization,
+            target_size=target_size,
+            l2_normalize=False,
         )
+        results = db_index.search(target_representations, threshold=threshold)
 
-        target_representation = target_embedding_obj[0]["embedding"]
+    resp_obj = []
 
-        result_df = df.copy()  # df will be filtered in each img
+    for (_, target_region, _), (indices, distances) in zip(target_objs, results):
+        result_df = pd.DataFrame({"identity": [identities[i] for i in indices]})
         result_df["source_x"] = target_region["x"]
         result_df["source_y"] = target_region["y"]
         result_df["source_w"] = target_region["w"]
         result_df["source_h"] = target_region["h"]
-
-        distances = []
-        for index, instance in df.iterrows():
-            source_representation = instance[f"{model_name}_representation"]
-
-            if distance_metric == "cosine":
-                distance = dst.findCosineDistance(source_representation, target_representation)
-            elif distance_metric == "euclidean":
-                distance = dst.findEuclideanDistance(source_representation, target_representation)
-            elif distance_metric == "euclidean_l2":
-                distance = dst.findEuclideanDistance(
-                    dst.l2_normalize(source_representation),
-                    dst.l2_normalize(target_representation),
-                )
-            else:
-                raise ValueError(f"invalid distance metric passes - {distance_metric}")
-
-            distances.append(distance)
-
-            # ---------------------------
-
         result_df[f"{model_name}_{distance_metric}"] = distances
 
-        threshold = dst.findThreshold(model_name, distance_metric)
-        result_df = result_df.drop(columns=[f"{model_name}_representation"])
-        result_df = result_df[result_df[f"{model_name}_{distance_metric}"] <= threshold]
-        result_df = result_df.sort_values(
-            by=[f"{model_name}_{distance_metric}"], ascending=True
-        ).reset_index(drop=True)
-
         resp_obj.append(result_df)
 
     # -----------------------------------
@@ -626,6 +744,103 @@ def find(
     return resp_obj
 
 
+def load_database(
+    db_path,
+    model_name="VGG-Face",
+    distance_metric="cosine",
+    enforce_detection=True,
+    detector_backend="opencv",
+    align=True,
+    normalization="base",
+    silent=False,
+    search_index="brute_force",
+    refresh_db=True,
+    indexing_workers=1,
+):
+    """
+    This function brings the representations of a facial database up to date and indexes them,
+    the way find does it. The index is kept in memory by the process until the representations
+    change, so callers searching the database many times (e.g. stream) pay it once.
+
+    Parameters:
+            db_path, model_name, distance_metric, enforce_detection, detector_backend, align,
+            normalization, silent, search_index, refresh_db, indexing_workers: same as find.
+
+    Returns:
+            list of the exact image path of every row of the index, and the index whose search
+            returns rows closest to query embeddings (see deepface.commons.search).
+    """
+    if os.path.isdir(db_path) is not True:
+        raise ValueError("Passed db_path does not exist!")
+
+    target_size = functions.find_target_size(model_name=model_name)
+
+    file_name = f"representations_{model_name}"
+    file_name = file_name.replace("-", "_").lower()
+
+    # new, changed and deleted images of db_path are applied to the stored representations
+    db_store = store.RepresentationStore(
+        db_path, file_name, dtype=os.environ.get("REPRESENTATIONS_DTYPE", "float32")
+    )
+    legacy_path = f"{db_path}/{file_name}.pkl"
+    if not db_store.files and path.exists(legacy_path):
+        # representations pickled by former versions are kept instead of embedding db_path again
+        imported = db_store.import_pickle(legacy_path)
+        if not silent:
+            print(f"{imported} images imported from {legacy_path}")
+
+    if refresh_db or not db_store.files:
+        embedded, removed = indexer.refresh(
+            db_store,
+            lambda faces: represent_batch(
+                faces,
+                model_name=model_name,
+                normalization=normalization,
+                target_size=target_size,
+                l2_normalize=False,
+            ),
+            target_size=target_size,
+            detector_backend=detector_backend,
+            enforce_detection=enforce_detection,
+            align=align,
+            workers=indexing_workers,
+            silent=silent,
+        )
+        if not silent and (embedded or removed):
+            print(f"{embedded} images embedded, {removed} images removed in {file_name}")
+
+    if not db_store.files:
+        raise ValueError(
+            "There is no image in ",
+            db_path,
+            " folder! Validate .jpg or .png files exist in this path.",
+        )
+
+    if not silent:
+        print("There are ", db_store.live_rows, " representations found in ", file_name)
+
+    # ----------------------------
+    # now, we got representations for facial database
+    index_key = (path.abspath(db_store.manifest_path), distance_metric, search_index)
+    cached_index = _find_indexes.get(index_key)
+    manifest_mtime = path.getmtime(db_store.manifest_path)
+    if cached_index is not None and cached_index[0] == manifest_mtime:
+        # representations were already loaded and indexed by this process
+        _, identities, db_index = cached_index
+    else:
+        identities, matrix = db_store.load()
+        db_index = search.build_index(
+            matrix,
+            distance_metric,
+            kind=search_index,
+            cache_path=f"{db_path}/{file_name}.{distance_metric}.{search_index}",
+            source_path=db_store.manifest_path,
+        )
+        _find_indexes[index_key] = (manifest_mtime, identities, db_index)
+
+    return identities, db_index
+
+
 def represent(
     img_path,
     model_name="VGG-Face",
@@ -709,6 +924,106 @@ def represent(
     return resp_objs
 
 
+def represent_batch(
+    faces,
+    model_name="VGG-Face",
+    normalization="base",
+    target_size=None,
+    l2_normalize=True,
+    double_scaled=False,
+):
+    """
+    This function represents already detected and aligned faces as vectors. Faces are stacked
+    into a single tensor, so the model runs one forward pass for the whole list instead of one
+    pass per face.
+
+    Parameters:
+            faces (list): facial images as numpy arrays, e.g. "face" items returned by
+            extract_faces. Each face is pre-processed exactly as represent does it with
+            detector_backend="skip", so embeddings are the same as the ones of per-face calls.
+            uint8 faces (extract_faces with keep_uint8) are written into one preallocated
+            batch and normalized once, without the float round-trip.
+
+            model_name (string): VGG-Face, Facenet, Facenet512, OpenFace, DeepFace, DeepID, Dlib,
+            ArcFace, SFace
+
+            normalization (string): normalize the input image before feeding to model
+
+            target_size (tuple): input shape of the model. Defaults to the model's own one.
+
+            l2_normalize (boolean): return l2 normalized embeddings
+
+            double_scaled (boolean): uint8 faces only. Scale pixels as float faces returned by
+            extract_faces are scaled when they are represented again (divided by 255 twice),
+            so embeddings stay comparable with the ones stored by such pipelines.
+
+    Returns:
+            numpy array with shape (number of faces, dimensions of the model). Rows are in the
+            same order as faces.
+    """
+    if len(faces) == 0:
+        raise ValueError("faces must contain at least one facial image")
+
+    model = build_model(model_name)
+
+    if target_size is None:
+        target_size = functions.find_target_size(model_name=model_name)
+
+    if all(face.dtype == np.uint8 for face in faces):
+        batch = np.empty((len(faces),) + tuple(target_size) + faces[0].shape[2:], dtype=np.uint8)
+        for face, pixels in zip(faces, batch):
+            if face.shape[:2] == tuple(target_size):
+                pixels[...] = face
+            else:
+                functions.letterbox(face, target_size, out=pixels)
+
+        batch = functions.uint8_model_input(
+            batch,
+            normalization=normalization,
+            double_scaled=double_scaled,
+            uint8_model=isinstance(model, SFace.SFaceModel),
+        )
+    else:
+        batch = []
+        for face in faces:
+            img_objs = functions.extract_faces(
+                img=face,
+                target_size=target_size,
+                detector_backend="skip",
+                grayscale=False,
+                enforce_detection=False,
+            )
+            img = functions.normalize_input(img=img_objs[0][0], normalization=normalization)
+            batch.append(img)
+        batch = np.concatenate(batch, axis=0)
+
+    tic = time.time()
+    if hasattr(model, "predict_on_batch"):
+        # keras models: skip predict's per-call data adapter and progress bar
+        embeddings = np.asarray(model.predict_on_batch(batch))
+    elif isinstance(model, SFace.SFaceModel) and batch.dtype == np.uint8:
+        embeddings = model.predict_uint8(batch)
+    elif isinstance(model, SFace.SFaceModel):
+        embeddings = model.predict(batch)
+    else:
+        # Dlib works on a single image only
+        embeddings = np.concatenate([model.predict(img[np.newaxis, ...]) for img in batch])
+    toc = time.time()
+
+    if represent_metric is not None:
+        for _ in range(len(batch)):
+            represent_metric.labels(model=model_name).observe((toc - tic) / len(batch))
+
+    # same precision as l2_normalize applied to the lists returned by represent
+    embeddings = np.asarray(embeddings, dtype=np.float64).reshape(len(batch), -1)
+    if l2_normalize:
+        embeddings = embeddings / np.sqrt(np.sum(np.multiply(embeddings, embeddings), axis=1))[
+            :, np.newaxis
+        ]
+
+    return embeddings
+
+
 def stream(
     db_path="",
     model_name="VGG-Face",
@@ -718,6 +1033,10 @@ def stream(
     source=0,
     time_threshold=5,
     frame_threshold=5,
+    pipelined=True,
+    detect_every=5,
+    recognition_workers=2,
+    display=True,
 ):
     """
     This function applies real time face recognition and facial attribute analysis
@@ -740,6 +1059,23 @@ def stream(
 
             frame_threshold (int): how many frames required to focus on face
 
+            pipelined (boolean): capture, detection and recognition run on their own threads
+            connected by bounded queues, so frames keep flowing while faces are recognized.
+            Recognized faces are followed by trackers instead of freezing the screen, and
+            time_threshold is how many seconds a recognition is kept before it is run again.
+            Set this to False for the former single loop freezing on recognized faces.
+
+            detect_every (int): pipelined only. Faces are detected in every that many frames
+            and tracked in the others.
+
+            recognition_workers (int): pipelined only. Threads recognizing faces.
+
+            display (boolean): pipelined only. Show the frames in a window, set this to False to
+            process a video file headless.
+
+    Returns:
+            pipelined stream returns frames, fps and latency_ms of its capture, detection,
+            recognition and display stages.
     """
 
     if time_threshold < 1:
@@ -753,6 +1089,25 @@ def stream(
             + str(frame_threshold)
         )
 
+    if pipelined:
+        stats = pipeline.Pipeline(
+            db_path,
+            model_name=model_name,
+            detector_backend=detector_backend,
+            distance_metric=distance_metric,
+            enable_face_analysis=enable_face_analysis,
+            detect_every=detect_every,
+            frame_threshold=frame_threshold,
+            time_threshold=time_threshold,
+            recognition_workers=recognition_workers,
+        ).run(source=source, display=display)
+        for name, stage in stats.items():
+            print(
+                f"{name}: {stage['frames']} frames, {stage['fps']:.1f} fps, "
+                + f"{stage['latency_ms']:.1f} ms"
+            )
+        return stats
+
     realtime.analysis(
         db_path,
         model_name,
@@ -771,11 +1126,13 @@ def extract_faces_custom(
     enforce_detection=True,
     align=True,
     grayscale=False,
-    landmarks_verification = False
+    landmarks_verification = False,
+    keep_uint8=False,
 ):
     """
     This function is similar to extract_faces function, but returns image objects
     to optimize extract faces usages: to do it only 1 time.
+    With keep_uint8, faces stay letterboxed uint8 arrays and the channel flip is a view.
     """
     resp_objs = []
 
@@ -786,7 +1143,8 @@ def extract_faces_custom(
         grayscale=grayscale,
         enforce_detection=enforce_detection,
         align=align,
-        landmarks_verification=landmarks_verification
+        landmarks_verification=landmarks_verification,
+        keep_uint8=keep_uint8,
     )
 
     for img, region, confidence in img_objs:
@@ -811,7 +1169,8 @@ def extract_faces(
     enforce_detection=True,
     align=True,
     grayscale=False,
-    landmarks_verification = False
+    landmarks_verification = False,
+    keep_uint8=False,
 ):
     """
     This function applies pre-processing stages of a face recognition pipeline
@@ -836,6 +1195,9 @@ def extract_faces(
 
             grayscale (boolean): extracting faces in rgb or gray scale
 
+            keep_uint8 (boolean): faces are returned as letterboxed uint8 arrays of
+            target_size instead of scaled to [0, 1]. Defaults to False.
+
     Returns:
             list of dictionaries. Each dictionary will have facial image itself,
             extracted area from the original image and confidence score.
@@ -850,7 +1212,8 @@ def extract_faces(
         grayscale=grayscale,
         enforce_detection=enforce_detection,
         align=align,
-        landmarks_verification=landmarks_verification
+        landmarks_verification=landmarks_verification,
+        keep_uint8=keep_uint8,
     )
 
     for img, region, confidence in img_objs:
@@ -0,0 +1,63 @@
+import os
+import numpy as np
+from deepface.commons import functions, ort_session
+
+# ArcFace served by onnx runtime. The graph is exported once from the keras model
+# (arcface_weights.h5) and reused afterwards, so tensorflow is not needed for inference.
+
+# pylint: disable=too-few-public-methods
+
+
+class _Layer:
+    input_shape = (None, 112, 112, 3)
+    output_shape = (None, 512)
+
+
+class ArcFaceOnnxModel:
+    def __init__(self, model_path):
+        self.ort_session = ort_session.create_session(model_path)
+        self.input_name = self.ort_session.get_inputs()[0].name
+
+        self.layers = [_Layer()]
+
+    def predict(self, img, verbose=0):
+        # same contract as the keras model: (n, 112, 112, 3) in, (n, 512) out
+        return self.ort_session.run(None, {self.input_name: img.astype(np.float32, copy=False)})[0]
+
+    def predict_on_batch(self, img):
+        return self.predict(img)
+
+
+def loadModel():
+    home = functions.get_deepface_home()
+
+    file_name = "arcface_weights.onnx"
+    output = home + "/.deepface/weights/" + file_name
+
+    if os.path.isfile(output) is not True:
+        print(file_name, " will be exported to ", output)
+        export_onnx(output)
+
+    return ArcFaceOnnxModel(model_path=output)
+
+
+def export_onnx(output, opset=13):
+    """Export the keras ArcFace model with its pre-trained weights to onnx.
+
+    Args:
+        output (str): path of the onnx file to write.
+        opset (int, optional): onnx opset version. Defaults to 13.
+    """
+    # tensorflow and tf2onnx are needed to export the graph only
+    import tensorflow as tf
+    import tf2onnx
+    from deepface.basemodels import ArcFace
+
+    model = ArcFace.loadModel()
+    input_signature = (tf.TensorSpec((None, 112, 112, 3), tf.float32, name="input"),)
+    tmp_output = output + ".tmp"
+    tf2onnx.convert.from_keras(
+        model, input_signature=input_signature, opset=opset, output_path=tmp_output
+    )
+    # other workers might be waiting for the very same file
+    os.replace(tmp_output, output)
@@ -3,7 +3,7 @@ import numpy as np
 import cv2 as cv
 import gdown
 
-from deepface.commons import functions
+from deepface.commons import functions, registry, ort_session, quantization
 
 # pylint: disable=line-too-long, too-few-public-methods
 
@@ -14,34 +14,92 @@ class _Layer:
 
 
 class SFaceModel:
-    def __init__(self, model_path):
-
-        self.model = cv.FaceRecognizerSF.create(
-            model=model_path, config="", backend_id=0, target_id=0
-        )
+    def __init__(self, model_path, runtime="opencv"):
+
+        # cv.FaceRecognizerSF.feature is a thin wrapper around this network. Using the network
+        # directly lets us feed a stack of faces in a single forward pass.
+        # A cv2 dnn network can not run in several threads at the same time, so the model
+        # keeps a pool of them.
+        # Quantized models are run by onnx runtime, its sessions are thread safe.
+        self.model = None
+        self.session = None
+        if runtime == "onnxruntime":
+            self.session = ort_session.create_session(model_path)
+            self.input_name = self.session.get_inputs()[0].name
+            self.batch_size = self.session.get_inputs()[0].shape[0]
+        else:
+            self.model = registry.ModelPool(lambda: _load_network(model_path), name="SFace")
 
         self.layers = [_Layer()]
 
     def predict(self, image):
         # Preprocess
-        input_blob = (image[0] * 255).astype(
+        input_blob = (image * 255).astype(
             np.uint8
-        )  # revert the image to original format and preprocess using the model
+        )  # revert the images to original format and preprocess using the model
+
+        return self.predict_uint8(input_blob)
+
+    def predict_uint8(self, faces):
+        # faces are uint8 arrays already, as returned by extract_faces with keep_uint8
 
         # Forward
-        embeddings = self.model.feature(input_blob)
+        if len(faces) == 1:
+            return self._feature(list(faces))
+
+        try:
+            embeddings = self._feature(list(faces))
+        except cv.error:
+            embeddings = None
+
+        if embeddings is None or embeddings.shape[0] != len(faces):
+            # the graph could not be run with a batch, fall back to one face per pass
+            embeddings = np.concatenate([self._feature([face]) for face in faces])
 
         return embeddings
 
+    def blob(self, faces):
+        # same pre-processing as cv.FaceRecognizerSF.feature
+        return cv.dnn.blobFromImages(faces, 1, (112, 112), (0, 0, 0), True, False)
+
+    def _feature(self, faces):
+        blob = self.blob(faces)
+        if self.session is not None:
+            if self.batch_size == 1:
+                return np.concatenate(
+                    [self.session.run(None, {self.input_name: item[np.newaxis]})[0] for item in blob]
+                )
+            return self.session.run(None, {self.input_name: blob})[0]
+
+        with self.model.acquire() as network:
+            network.setInput(blob)
+            return network.forward()
+
+
+def _load_network(model_path):
+    network = cv.dnn.readNet(model_path)
+    network.setPreferableBackend(0)
+    network.setPreferableTarget(0)
+    return network
+
 
 def load_model(
     url="https://github.com/opencv/opencv_zoo/raw/master/models/face_recognition_sface/face_recognition_sface_2021dec.onnx",
+    quantized=False,
 ):
 
     home = functions.get_deepface_home()
 
     file_name = home + "/.deepface/weights/face_recognition_sface_2021dec.onnx"
 
+    if quantized:
+        # produced by scripts/quantize.py from the fp32 weights
+        file_name = quantization.int8_path(file_name)
+        if not os.path.isfile(file_name):
+            raise ValueError(f"{file_name} does not exist, run scripts/quantize.py sface first")
+
+        return SFaceModel(model_path=file_name, runtime="onnxruntime")
+
     if not os.path.isfile(file_name):
 
         print("sface weights will be downloaded...")
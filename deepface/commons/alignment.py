@@ -0,0 +1,90 @@
+import numpy as np
+import cv2
+
+# --------------------------------------------------
+# alignment of faces with a single affine warp. Crop, rotation and resize to the model
+# input are done in one pass over the pixels, instead of cropping the detected area,
+# rotating it with PIL and resizing it afterwards.
+
+# positions of 5 facial landmarks on the 112x112 faces ArcFace and SFace were trained on:
+# eyes, nose tip and mouth corners, from the left to the right side of the image
+reference_landmarks = np.array(
+    [
+        [38.2946, 51.6963],
+        [73.5318, 51.5014],
+        [56.0252, 71.7366],
+        [41.5493, 92.3655],
+        [70.7299, 92.2041],
+    ],
+    dtype=np.float32,
+)
+reference_size = (112, 112)
+
+# --------------------------------------------------
+
+
+def similarity_transform(landmarks, target_size=reference_size):
+    """Find rotation, uniform scale and translation moving landmarks to the reference ones.
+
+    Args:
+        landmarks (numpy array): (x, y) of the eyes, or of the eyes, nose tip and mouth
+        corners, in the order of reference_landmarks.
+        target_size (tuple, optional): (height, width) of the aligned face.
+        Defaults to (112, 112).
+
+    Returns:
+        numpy array: 2x3 affine matrix for cv2.warpAffine.
+    """
+    landmarks = np.asarray(landmarks, dtype=np.float32).reshape(-1, 2)
+    if len(landmarks) not in [2, 5]:
+        raise ValueError(f"2 or 5 landmarks are expected, but {len(landmarks)} passed")
+
+    scale = min(target_size[0] / reference_size[0], target_size[1] / reference_size[1])
+    offset = (
+        (target_size[1] - reference_size[1] * scale) / 2,
+        (target_size[0] - reference_size[0] * scale) / 2,
+    )
+    reference = reference_landmarks[: len(landmarks)] * scale + np.float32(offset)
+
+    if len(landmarks) == 2:
+        # two points define a similarity transform exactly
+        src = landmarks[1] - landmarks[0]
+        dst = reference[1] - reference[0]
+        src_length = np.hypot(*src)
+        if src_length == 0:
+            raise ValueError("eyes are at the same position")
+        ratio = np.hypot(*dst) / src_length
+        angle = np.arctan2(dst[1], dst[0]) - np.arctan2(src[1], src[0])
+        a, b = ratio * np.cos(angle), ratio * np.sin(angle)
+        matrix = np.array([[a, -b, 0], [b, a, 0]], dtype=np.float64)
+        matrix[:, 2] = reference[0] - matrix[:, :2] @ landmarks[0]
+        return matrix
+
+    matrix, _ = cv2.estimateAffinePartial2D(landmarks, reference, method=cv2.LMEDS)
+    if matrix is None:
+        raise ValueError("similarity transform could not be estimated for the landmarks")
+
+    return matrix
+
+
+def warp_face(img, landmarks, target_size=reference_size):
+    """Crop, rotate and resize a face in a single pass.
+
+    Args:
+        img (numpy array): the whole image the landmarks were detected on.
+        landmarks (numpy array): see similarity_transform.
+        target_size (tuple, optional): (height, width) of the aligned face.
+        Defaults to (112, 112).
+
+    Returns:
+        numpy array: the aligned face, areas outside of the image are black.
+    """
+    matrix = similarity_transform(landmarks, target_size)
+    return cv2.warpAffine(
+        img,
+        matrix,
+        (target_size[1], target_size[0]),
+        flags=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=0,
+    )
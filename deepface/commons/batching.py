@@ -0,0 +1,92 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+# --------------------------------------------------
+# micro-batching of model calls. Inputs submitted by concurrent threads are collected for
+# a short time and run by the model as a single batch, so every call does not pay the
+# session run overhead on its own.
+
+
+class MicroBatcher:
+    """Run a batched function over inputs of concurrent callers at once.
+
+    Args:
+        run (callable): takes a numpy array with a batch of inputs, returns an array with
+        one output row per input row.
+        max_batch_size (int): max count of rows run at once. Inputs of a single call are
+        never split, so a call bigger than that runs alone.
+        max_wait (float): seconds the first call of a batch waits for others.
+    """
+
+    def __init__(self, run, max_batch_size, max_wait):
+        self._run = run
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def submit(self, inputs):
+        """Run inputs as a part of a batch and wait for the result.
+
+        Args:
+            inputs (numpy array): batch of inputs of the calling thread.
+
+        Returns:
+            numpy array: outputs for the inputs.
+        """
+        self._start()
+        future = Future()
+        self._queue.put((inputs, future))
+        return future.result()
+
+    def _start(self):
+        # the worker is started lazily, so it is running in the process which uses it
+        # (e.g. after gunicorn forked its workers)
+        if self._worker is not None and self._worker.is_alive():
+            return
+
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._serve, daemon=True)
+                self._worker.start()
+
+    def _serve(self):
+        pending = None
+        while True:
+            items = [pending if pending is not None else self._queue.get()]
+            pending = None
+            size = len(items[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        item = self._queue.get(timeout=timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if size + len(item[0]) > self.max_batch_size:
+                    pending = item  # first one of the next batch
+                    break
+                items.append(item)
+                size += len(item[0])
+
+            self._run_batch(items)
+
+    def _run_batch(self, items):
+        try:
+            outputs = self._run(np.concatenate([inputs for inputs, _ in items], axis=0))
+        except Exception as err:  # pylint: disable=broad-except
+            for _, future in items:
+                future.set_exception(err)
+            return
+
+        offset = 0
+        for inputs, future in items:
+            future.set_result(outputs[offset : offset + len(inputs)])
+            offset += len(inputs)
@@ -31,6 +31,170 @@ def l2_normalize(x):
     return x / np.sqrt(np.sum(np.multiply(x, x)))
 
 
+# --------------------------------------------------
+# vectorized distances of many embeddings at once. Euclidean distances of a single query are
+# computed exactly as findEuclideanDistance does it, in chunks bounding the temporary memory.
+
+_chunk_elements = 1 << 22
+
+_metrics = ("cosine", "euclidean", "euclidean_l2")
+
+
+def _as_vectors(x):
+    x = np.asarray(x)
+    if x.dtype.kind != "f":
+        x = x.astype(np.float64)
+    return x
+
+
+def _check_metric(distance_metric):
+    if distance_metric not in _metrics:
+        raise ValueError(f"invalid distance_metric passed - {distance_metric}")
+
+
+def l2_normalize_rows(matrix):
+    """L2 normalize every row of a matrix.
+
+    Args:
+        matrix: (N, D) array-like of embeddings.
+
+    Returns:
+        numpy array: (N, D) matrix with unit rows.
+    """
+    matrix = _as_vectors(matrix)
+    return matrix / np.sqrt(np.sum(np.multiply(matrix, matrix), axis=-1, keepdims=True))
+
+
+def find_distances(query, matrix, distance_metric="euclidean"):
+    """Distances of a single embedding to every row of a matrix.
+
+    Args:
+        query: (D,) array-like embedding.
+        matrix: (N, D) array-like of embeddings, float32 matrices are not copied.
+        distance_metric (str): cosine, euclidean or euclidean_l2.
+
+    Returns:
+        numpy array: (N,) distances.
+    """
+    _check_metric(distance_metric)
+    query = _as_vectors(query)
+    matrix = _as_vectors(matrix)
+    if distance_metric == "euclidean_l2":
+        query = l2_normalize(query)
+        matrix = l2_normalize_rows(matrix)
+    if distance_metric == "cosine":
+        a = np.matmul(matrix, query)
+        b = np.sum(np.multiply(matrix, matrix), axis=1)
+        c = np.sum(np.multiply(query, query))
+        return 1 - (a / (np.sqrt(b) * np.sqrt(c)))
+
+    distances = np.empty(len(matrix), dtype=np.result_type(query, matrix))
+    step = max(1, _chunk_elements // max(matrix.shape[-1], 1))
+    for start in range(0, len(matrix), step):
+        diff = matrix[start : start + step] - query
+        distances[start : start + step] = np.sqrt(np.sum(np.multiply(diff, diff), axis=1))
+    return distances
+
+
+def pairwise_distances(queries, matrix, distance_metric="euclidean"):
+    """Distances of every query to every row of a matrix.
+
+    Euclidean distances are expanded to |q|^2 + |m|^2 - 2 q.m, so they are computed with a
+    single matrix product and might differ from findEuclideanDistance in the last digits.
+
+    Args:
+        queries: (M, D) array-like of embeddings.
+        matrix: (N, D) array-like of embeddings.
+        distance_metric (str): cosine, euclidean or euclidean_l2.
+
+    Returns:
+        numpy array: (M, N) distances.
+    """
+    _check_metric(distance_metric)
+    queries = _as_vectors(queries)
+    matrix = _as_vectors(matrix)
+    if distance_metric == "euclidean_l2":
+        queries = l2_normalize_rows(queries)
+        matrix = l2_normalize_rows(matrix)
+    products = np.matmul(queries, matrix.T)
+    queries_norms = np.sum(np.multiply(queries, queries), axis=1)
+    matrix_norms = np.sum(np.multiply(matrix, matrix), axis=1)
+    if distance_metric == "cosine":
+        return 1 - products / np.outer(np.sqrt(queries_norms), np.sqrt(matrix_norms))
+
+    squared = queries_norms[:, None] + matrix_norms[None, :] - 2 * products
+    return np.sqrt(np.maximum(squared, 0))
+
+
+def paired_distances(a, b, distance_metric="euclidean"):
+    """Distances of every row of a matrix to the same row of another one.
+
+    Args:
+        a: (N, D) array-like of embeddings.
+        b: (N, D) array-like of embeddings.
+        distance_metric (str): cosine, euclidean or euclidean_l2.
+
+    Returns:
+        numpy array: (N,) distances.
+    """
+    _check_metric(distance_metric)
+    a = _as_vectors(a)
+    b = _as_vectors(b)
+    if distance_metric == "euclidean_l2":
+        a = l2_normalize_rows(a)
+        b = l2_normalize_rows(b)
+    if distance_metric == "cosine":
+        products = np.sum(np.multiply(a, b), axis=1)
+        a_norms = np.sum(np.multiply(a, a), axis=1)
+        b_norms = np.sum(np.multiply(b, b), axis=1)
+        return 1 - (products / (np.sqrt(a_norms) * np.sqrt(b_norms)))
+
+    diff = a - b
+    return np.sqrt(np.sum(np.multiply(diff, diff), axis=1))
+
+
+def top_k(query, matrix, k, distance_metric="euclidean", threshold=None):
+    """Closest rows of a matrix to a single embedding.
+
+    Args:
+        query: (D,) array-like embedding.
+        matrix: (N, D) array-like of embeddings.
+        k (int): max count of returned rows.
+        distance_metric (str): cosine, euclidean or euclidean_l2.
+        threshold (float, optional): rows more distant than that are not returned.
+
+    Returns:
+        tuple: indices of the rows argsorted by distance, and their distances.
+    """
+    return closest(find_distances(query, matrix, distance_metric), k, threshold)
+
+
+def closest(distances, k=None, threshold=None):
+    """Select the smallest of already computed distances.
+
+    Args:
+        distances: (N,) numpy array of distances.
+        k (int, optional): max count of returned distances. Defaults to all of them.
+        threshold (float, optional): distances bigger than that are not returned.
+
+    Returns:
+        tuple: indices argsorted by distance, and their distances.
+    """
+    if threshold is None:
+        candidates = np.arange(len(distances))
+    else:
+        candidates = np.flatnonzero(distances <= threshold)
+    k = len(candidates) if k is None else min(k, len(candidates))
+    if k <= 0:
+        return candidates[:0], distances[:0]
+    if k < len(candidates):
+        candidates = candidates[np.argpartition(distances[candidates], k - 1)[:k]]
+        # among equal distances, lower indices come first
+        candidates = np.sort(candidates)
+    candidates = candidates[np.argsort(distances[candidates], kind="stable")]
+    return candidates, distances[candidates]
+
+
 def findThreshold(model_name, distance_metric):
 
     base_threshold = {"cosine": 0.40, "euclidean": 0.55, "euclidean_l2": 0.75}
@@ -125,7 +125,8 @@ def extract_faces(
     grayscale=False,
     enforce_detection=True,
     align=True,
-    landmarks_verification = False
+    landmarks_verification = False,
+    keep_uint8=False,
 ):
     """Extract faces from an image.
 
@@ -138,6 +139,9 @@ def extract_faces(
         Defaults to False.
         enforce_detection (bool, optional): whether to enforce face detection. Defaults to True.
         align (bool, optional): whether to align the extracted faces. Defaults to True.
+        keep_uint8 (bool, optional): return faces as letterboxed uint8 arrays of
+        target_size, without the batch dimension and scaling to [0, 1]. Models apply their
+        own normalization to them, see normalize_uint8. Defaults to False.
 
     Raises:
         ValueError: if face could not be detected and enforce_detection is True.
@@ -156,7 +160,8 @@ def extract_faces(
     if detector_backend == "skip":
         face_objs = [(img, img_region, 0)]
     else:
-        face_detector = FaceDetector.build_model(detector_backend)
+        input_size = FaceDetector.input_size_class(detector_backend, img)
+        face_detector = FaceDetector.build_model(detector_backend, input_size)
         face_objs = FaceDetector.detect_faces(face_detector, detector_backend, img, align, landmarks_verification)
 
     # in case of no face found
@@ -174,6 +179,18 @@ def extract_faces(
             if grayscale is True:
                 current_img = cv2.cvtColor(current_img, cv2.COLOR_BGR2GRAY)
 
+            # int cast is for the exception - object of type 'float32' is not JSON serializable
+            region_obj = {
+                "x": int(current_region[0]),
+                "y": int(current_region[1]),
+                "w": int(current_region[2]),
+                "h": int(current_region[3]),
+            }
+
+            if keep_uint8:
+                extracted_faces.append([letterbox(current_img, target_size), region_obj, confidence])
+                continue
+
             # resize and padding
             if current_img.shape[0] > 0 and current_img.shape[1] > 0:
                 factor_0 = target_size[0] / current_img.shape[0]
@@ -219,14 +236,6 @@ def extract_faces(
             img_pixels = np.expand_dims(img_pixels, axis=0)
             img_pixels /= 255  # normalize input in [0, 1]
 
-            # int cast is for the exception - object of type 'float32' is not JSON serializable
-            region_obj = {
-                "x": int(current_region[0]),
-                "y": int(current_region[1]),
-                "w": int(current_region[2]),
-                "h": int(current_region[3]),
-            }
-
             extracted_face = [img_pixels, region_obj, confidence]
             extracted_faces.append(extracted_face)
 
@@ -238,6 +247,125 @@ def extract_faces(
     return extracted_faces
 
 
+def letterbox(img, target_size, out=None):
+    """Resize an image keeping its aspect ratio and pad it with black pixels.
+
+    This is the resize and padding step of extract_faces, but pixels keep their type
+    and the result can be written straight into a preallocated batch.
+
+    Args:
+        img (numpy array): the image.
+        target_size (tuple): (height, width) of the result.
+        out (numpy array, optional): array of target_size to write the result into.
+        Defaults to None.
+
+    Returns:
+        numpy array: the letterboxed image.
+    """
+    target_size = tuple(target_size)
+    if out is None:
+        out = np.empty(target_size + img.shape[2:], dtype=img.dtype)
+
+    factor = min(target_size[0] / img.shape[0], target_size[1] / img.shape[1])
+    height, width = int(img.shape[0] * factor), int(img.shape[1] * factor)
+    top = (target_size[0] - height) // 2
+    left = (target_size[1] - width) // 2
+
+    out[:top] = 0
+    out[top + height :] = 0
+    out[top : top + height, :left] = 0
+    out[top : top + height, left + width :] = 0
+    region = out[top : top + height, left : left + width]
+    resized = cv2.resize(img, (width, height), dst=region)
+    if resized is not region:
+        region[...] = resized.reshape(region.shape)
+
+    return out
+
+
+# normalizations which map every pixel value on its own, they are applied to uint8 pixels
+# with a lookup table
+pointwise_normalizations = ["base", "raw", "Facenet2018", "ArcFace"]
+
+
+def uint8_lookup_table(normalization="base", double_scaled=False):
+    """Model input for each of the 256 values of a uint8 pixel.
+
+    Args:
+        normalization (str, optional): the normalization technique. Defaults to "base".
+        double_scaled (bool, optional): divide pixels by 255 twice, as it happens when a
+        face returned by extract_faces is represented with detector_backend "skip".
+        Defaults to False.
+
+    Returns:
+        numpy array: float32 table, None if the normalization is not pointwise.
+    """
+    if normalization not in pointwise_normalizations:
+        return None
+
+    # the very same float32 operations as extract_faces and normalize_input do
+    table = np.arange(256, dtype=np.float32)
+    table /= 255
+    if double_scaled:
+        table /= 255
+
+    return normalize_input(img=table, normalization=normalization)
+
+
+def normalize_uint8(pixels, normalization="base", double_scaled=False):
+    """Turn uint8 faces into the float input of a model.
+
+    Values are exactly the ones extract_faces and normalize_input produce, but pointwise
+    normalizations are done in a single pass over the batch.
+
+    Args:
+        pixels (numpy array): uint8 faces with shape (n, height, width, channels).
+        normalization (str, optional): the normalization technique. Defaults to "base".
+        double_scaled (bool, optional): see uint8_lookup_table. Defaults to False.
+
+    Returns:
+        numpy array: float32 model input.
+    """
+    table = uint8_lookup_table(normalization=normalization, double_scaled=double_scaled)
+    if table is not None:
+        return table[pixels]
+
+    img = pixels.astype(np.float32)
+    img /= 255
+    if double_scaled:
+        img /= 255
+    # Facenet normalization depends on the statistics of each image
+    for i in range(len(img)):
+        img[i] = normalize_input(img=img[i], normalization=normalization)
+
+    return img
+
+
+def uint8_model_input(pixels, normalization="base", double_scaled=False, uint8_model=False):
+    """Model input for a batch of uint8 faces.
+
+    Args:
+        pixels (numpy array): uint8 faces with shape (n, height, width, channels).
+        normalization (str, optional): the normalization technique. Defaults to "base".
+        double_scaled (bool, optional): see uint8_lookup_table. Defaults to False.
+        uint8_model (bool, optional): the model takes uint8 pixels and converts float
+        input back to them itself (SFace). Defaults to False.
+
+    Returns:
+        numpy array: uint8 pixels for uint8 models if the normalization is pointwise,
+        float32 input otherwise.
+    """
+    table = uint8_lookup_table(normalization=normalization, double_scaled=double_scaled)
+    if uint8_model and table is not None:
+        # the table repeats the float to uint8 conversion of the model
+        table = (table * 255).astype(np.uint8)
+        if np.array_equal(table, np.arange(256)):
+            return pixels
+        return table[pixels]
+
+    return normalize_uint8(pixels, normalization=normalization, double_scaled=double_scaled)
+
+
 def normalize_input(img, normalization="base"):
     """Normalize input image.
 
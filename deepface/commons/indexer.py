@@ -0,0 +1,137 @@
+import itertools
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from tqdm import tqdm
+from deepface.commons import functions, store
+
+# --------------------------------------------------
+# parallel (re)building of a representation store. Images are read, hashed and their faces
+# detected on a pool of processes, faces are embedded by the calling process with batched model
+# calls, and embeddings are streamed to the vectors file as they come. Progress is
+# checkpointed, so an interrupted run continues with images which were not stored yet.
+
+# --------------------------------------------------
+
+
+def detect(exact_path, known_digest, target_size, detector_backend, enforce_detection, align):
+    """Read an image and extract its faces, in a worker process.
+
+    Args:
+        exact_path (str): path of the image.
+        known_digest (str): sha256 of the image when it was embedded before, or None.
+        others: same as in functions.extract_faces.
+
+    Returns:
+        tuple: sha256 of the image, and list of its faces or None if the image content did not
+        change since known_digest.
+    """
+    digest = store.file_digest(exact_path)
+    if digest == known_digest:
+        return digest, None
+
+    img_objs = functions.extract_faces(
+        img=exact_path,
+        target_size=target_size,
+        detector_backend=detector_backend,
+        grayscale=False,
+        enforce_detection=enforce_detection,
+        align=align,
+    )
+    return digest, [img_content[0] for img_content, _, _ in img_objs]
+
+
+def refresh(
+    db_store,
+    represent_faces,
+    target_size,
+    detector_backend,
+    enforce_detection=True,
+    align=True,
+    workers=1,
+    batch_size=32,
+    checkpoint_every=1000,
+    silent=False,
+):
+    """Embed new and changed images of a representation store, drop deleted ones.
+
+    Args:
+        db_store (store.RepresentationStore): store to refresh.
+        represent_faces (callable): takes a list of faces, returns their embeddings.
+        target_size (tuple): input shape of the model.
+        detector_backend (str): face detector.
+        enforce_detection (bool): fail on images without faces.
+        align (bool): align faces.
+        workers (int): processes detecting faces, 1 detects them in the calling process.
+            Workers are spawned, so the main module must be guarded by
+            if __name__ == "__main__": when there are more of them.
+        batch_size (int): faces embedded by a single represent_faces call.
+        checkpoint_every (int): persist progress after that many embedded images.
+        silent (bool): disable the progress bar.
+
+    Returns:
+        tuple: count of images embedded and count of images dropped.
+    """
+    pending, removed = db_store.changes()
+    stats = dict(pending)
+    embedded = 0
+    checkpointed = 0
+    batch = []  # (exact path, digest, faces) of images waiting for embedding
+
+    def embed_batch(vectors):
+        nonlocal embedded
+        faces = [face for _, _, image_faces in batch for face in image_faces]
+        embeddings = iter(represent_faces(faces) if faces else [])
+        for exact_path, digest, image_faces in batch:
+            image_embeddings = list(itertools.islice(embeddings, len(image_faces)))
+            db_store.append(vectors, exact_path, stats[exact_path], digest, image_embeddings)
+            embedded += 1
+        batch.clear()
+
+    def collect(exact_path, digest, faces, vectors):
+        nonlocal checkpointed
+        if faces is None:
+            # touched but not modified
+            db_store.touch(exact_path, stats[exact_path])
+            return
+        batch.append((exact_path, digest, faces))
+        if sum(len(image_faces) for _, _, image_faces in batch) >= batch_size:
+            embed_batch(vectors)
+            if embedded - checkpointed >= checkpoint_every:
+                db_store.checkpoint(vectors)
+                checkpointed = embedded
+
+    args = (target_size, detector_backend, enforce_detection, align)
+    pbar = tqdm(total=len(pending), desc="Finding representations", disable=silent)
+    try:
+        with db_store.open() as vectors:
+            if workers <= 1:
+                for exact_path, _ in pending:
+                    digest, faces = detect(exact_path, db_store.digest(exact_path), *args)
+                    collect(exact_path, digest, faces, vectors)
+                    pbar.update()
+            else:
+                # tensorflow is not fork safe once it is initialized
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                    queued = iter(pending)
+                    in_flight = {}
+                    while True:
+                        # a bounded count of images is read ahead of the embedding
+                        for exact_path, _ in itertools.islice(queued, 2 * workers - len(in_flight)):
+                            future = executor.submit(
+                                detect, exact_path, db_store.digest(exact_path), *args
+                            )
+                            in_flight[future] = exact_path
+                        if not in_flight:
+                            break
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            digest, faces = future.result()
+                            collect(in_flight.pop(future), digest, faces, vectors)
+                            pbar.update()
+            embed_batch(vectors)
+    finally:
+        pbar.close()
+        db_store.close()
+
+    return embedded, removed
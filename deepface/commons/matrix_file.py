@@ -0,0 +1,148 @@
+import os
+import struct
+import numpy as np
+
+# --------------------------------------------------
+# on-disk format of embedding matrices, loaded with np.memmap. Startup does not create Python
+# objects per value, and processes mapping the same file share its pages in the page cache.
+#   <path>: 64 bytes header (magic, dtype, count of dimensions, count of rows) followed by
+#       the rows of the matrix in float32 or float16, C order
+#   <path>.ids: identity of every row, one utf-8 line per row
+
+_magic = b"DFMATRIX"
+_header = struct.Struct("<8s8sIQ")
+header_size = 64
+dtypes = {"float32": np.dtype("<f4"), "float16": np.dtype("<f2")}
+
+# --------------------------------------------------
+
+
+def ids_path(path):
+    return f"{path}.ids"
+
+
+def _pack_header(dtype, dimensions, rows):
+    return _header.pack(_magic, dtype.str.encode(), dimensions, rows).ljust(header_size, b"\0")
+
+
+def read_header(path):
+    """Read the header of a matrix file.
+
+    Returns:
+        tuple: numpy dtype, count of dimensions and count of rows.
+    """
+    with open(path, "rb") as f:
+        raw = f.read(_header.size)
+    if len(raw) < _header.size or raw[: len(_magic)] != _magic:
+        raise ValueError(f"{path} is not an embedding matrix file")
+    _, dtype, dimensions, rows = _header.unpack(raw)
+    return np.dtype(dtype.rstrip(b"\0").decode()), dimensions, rows
+
+
+def truncate(path, rows, ids_size):
+    """Keep the first rows of a matrix file, and the first ids_size bytes of its ids."""
+    dtype, dimensions, _ = read_header(path)
+    with open(path, "r+b") as f:
+        f.write(_pack_header(dtype, dimensions, rows))
+        f.truncate(header_size + rows * dimensions * dtype.itemsize)
+    if os.path.getsize(ids_path(path)) > ids_size:
+        os.truncate(ids_path(path), ids_size)
+
+
+class Appender:
+    """Append rows to a matrix file, creating it on the first rows.
+
+    Args:
+        path (str): path of the matrix file.
+        dtype (str): float32 or float16, for a new file. Existing files keep their dtype.
+    """
+
+    def __init__(self, path, dtype="float32"):
+        if dtype not in dtypes:
+            raise ValueError(f"invalid dtype passed - {dtype}")
+        self.path = path
+        self.dtype = dtypes[dtype]
+        self.dimensions = None
+        self.rows = 0
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            self.dtype, self.dimensions, self.rows = read_header(path)
+        self._matrix = open(path, "ab")
+        self._ids = open(ids_path(path), "ab")
+
+    @property
+    def ids_size(self):
+        return self._ids.tell()
+
+    def write(self, matrix, identities):
+        """Append (N, D) rows and the N identities of them, without line breaks."""
+        matrix = np.ascontiguousarray(np.atleast_2d(matrix), dtype=self.dtype)
+        if len(matrix) != len(identities):
+            raise ValueError(f"{len(matrix)} rows but {len(identities)} identities passed")
+        if self.dimensions is None:
+            self.dimensions = matrix.shape[1]
+            self._matrix.write(_pack_header(self.dtype, self.dimensions, 0))
+        if matrix.shape[1] != self.dimensions:
+            raise ValueError(
+                f"{matrix.shape[1]} dimensional rows passed, {self.dimensions} expected"
+            )
+        self._matrix.write(matrix.tobytes())
+        self._ids.write("".join(f"{identity}\n" for identity in identities).encode("utf-8"))
+        self.rows += len(matrix)
+
+    def flush(self):
+        """Write buffered rows and the count of rows to the file."""
+        self._matrix.flush()
+        self._ids.flush()
+        if self.dimensions is not None:
+            with open(self.path, "r+b") as f:
+                f.write(_pack_header(self.dtype, self.dimensions, self.rows))
+
+    def close(self):
+        self.flush()
+        self._matrix.close()
+        self._ids.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load(path, mmap=True):
+    """Load a matrix file.
+
+    Args:
+        path (str): path of the matrix file.
+        mmap (bool): memory map the matrix instead of reading it.
+
+    Returns:
+        tuple: list of row identities, and (N, D) matrix with the dtype of the file.
+    """
+    dtype, dimensions, rows = read_header(path)
+    if rows == 0:
+        matrix = np.empty((0, dimensions), dtype=dtype)
+    elif mmap:
+        matrix = np.memmap(
+            path, dtype=dtype, mode="r", offset=header_size, shape=(rows, dimensions)
+        )
+    else:
+        with open(path, "rb") as f:
+            f.seek(header_size)
+            matrix = np.fromfile(f, dtype=dtype, count=rows * dimensions)
+        matrix = matrix.reshape(rows, dimensions)
+
+    with open(ids_path(path), "rb") as f:
+        identities = f.read().decode("utf-8").split("\n")[:rows]
+    if len(identities) != rows:
+        raise ValueError(f"{ids_path(path)} has {len(identities)} identities, {rows} expected")
+    return identities, matrix
+
+
+def save(path, identities, matrix, dtype="float32"):
+    """Write a whole matrix file and its ids at once."""
+    for stale_path in (path, ids_path(path)):
+        if os.path.isfile(stale_path):
+            os.remove(stale_path)
+    with Appender(path, dtype) as appender:
+        appender.write(matrix, identities)
@@ -0,0 +1,107 @@
+import os
+import onnxruntime as ort
+
+# --------------------------------------------------
+# onnx runtime sessions configured with environment variables:
+#   ORT_GRAPH_OPTIMIZATION_LEVEL: disable, basic, extended or all (default)
+#   ORT_INTRA_OP_THREADS: threads of a single operator, 0 (default) = count of the cores the
+#       process is pinned to, or the onnx runtime default if it is not pinned
+#   ORT_INTER_OP_THREADS: threads running independent operators in parallel execution mode
+#   ORT_EXECUTION_MODE: sequential (default) or parallel
+#   ORT_CPU_MEM_ARENA: true (default) or false to allocate tensors without the arena
+#   ORT_OPTIMIZED_MODEL_CACHE: true to save the optimized graph next to the model and load
+#       it on the next start instead of optimizing the graph again
+
+_optimization_levels = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+_execution_modes = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+# --------------------------------------------------
+
+
+def _flag(name, default):
+    return os.environ.get(name, default).lower() in ("true", "1")
+
+
+def pinned_cores():
+    """Get count of cores the process is pinned to.
+
+    Returns:
+        int: count of cores, 0 if the process may run on all cores of the machine.
+    """
+    if not hasattr(os, "sched_getaffinity"):
+        return 0
+
+    cores = len(os.sched_getaffinity(0))
+    return cores if cores < (os.cpu_count() or cores) else 0
+
+
+def session_options(level=None):
+    """Build onnx runtime session options from environment variables.
+
+    Args:
+        level (str, optional): graph optimization level overriding
+        ORT_GRAPH_OPTIMIZATION_LEVEL. Defaults to None.
+
+    Returns:
+        onnxruntime.SessionOptions
+    """
+    level = level or os.environ.get("ORT_GRAPH_OPTIMIZATION_LEVEL", "all")
+    if level not in _optimization_levels:
+        raise ValueError(f"invalid ORT_GRAPH_OPTIMIZATION_LEVEL passed - {level}")
+    execution_mode = os.environ.get("ORT_EXECUTION_MODE", "sequential")
+    if execution_mode not in _execution_modes:
+        raise ValueError(f"invalid ORT_EXECUTION_MODE passed - {execution_mode}")
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = _optimization_levels[level]
+    options.execution_mode = _execution_modes[execution_mode]
+    options.intra_op_num_threads = int(os.environ.get("ORT_INTRA_OP_THREADS", 0)) or pinned_cores()
+    options.inter_op_num_threads = int(os.environ.get("ORT_INTER_OP_THREADS", 0))
+    options.enable_cpu_mem_arena = _flag("ORT_CPU_MEM_ARENA", "true")
+
+    return options
+
+
+def create_session(model_path):
+    """Create an onnx runtime session for a model.
+
+    Args:
+        model_path (str): path of the onnx model.
+
+    Returns:
+        onnxruntime.InferenceSession on gpu if it is available, cpu otherwise.
+    """
+    if ort.get_device() == "GPU":
+        providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    else:
+        providers = ["CPUExecutionProvider"]
+
+    if not _flag("ORT_OPTIMIZED_MODEL_CACHE", "false"):
+        return ort.InferenceSession(model_path, session_options(), providers=providers)
+
+    # optimized graphs depend on the level and on the hardware they were optimized for
+    level = os.environ.get("ORT_GRAPH_OPTIMIZATION_LEVEL", "all")
+    optimized_path = f"{os.path.splitext(model_path)[0]}.{level}.{ort.get_device().lower()}.ort.onnx"
+    if os.path.isfile(optimized_path):
+        return ort.InferenceSession(
+            optimized_path, session_options(level="disable"), providers=providers
+        )
+
+    options = session_options()
+    # other workers might be optimizing the very same model
+    tmp_path = f"{optimized_path}.{os.getpid()}.tmp"
+    options.optimized_model_filepath = tmp_path
+    session = ort.InferenceSession(model_path, options, providers=providers)
+    if os.path.isfile(tmp_path):
+        os.replace(tmp_path, optimized_path)
+
+    return session
@@ -0,0 +1,401 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from deepface import DeepFace
+from deepface.commons import functions, distance as dst
+from deepface.detectors import FaceDetector
+
+# --------------------------------------------------
+# realtime face recognition as threads connected by bounded queues, so a slow stage does not
+# stall the frames of the others:
+#   capture: reads frames of a camera or a video file. Camera frames are dropped when the
+#       detection is behind, frames of files are all processed.
+#   detection: detects faces every detect_every frames and follows them with opencv trackers
+#       in the frames between
+#   recognition: a pool of workers embedding faces of new tracks, searching them in the index
+#       of the facial database built once by DeepFace.load_database, and analyzing them
+#   display: the calling thread, draws the tracks with their identity and shows the frame
+# Every stage records its count of frames per second and its latency.
+
+_queue_size = 4
+
+# --------------------------------------------------
+
+
+class StageStats:
+    """Throughput and latency of a pipeline stage.
+
+    Args:
+        name (str): name of the stage.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.busy = 0.0
+        self._first = None
+        self._last = None
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        """Count an item processed by the stage in latency seconds."""
+        now = time.perf_counter()
+        with self._lock:
+            if self._first is None:
+                self._first = now - latency
+            self._last = now
+            self.count += 1
+            self.busy += latency
+
+    @property
+    def fps(self):
+        if self.count == 0 or self._last <= self._first:
+            return 0.0
+        return self.count / (self._last - self._first)
+
+    @property
+    def latency_ms(self):
+        return 1000 * self.busy / self.count if self.count else 0.0
+
+    def summary(self):
+        return {"frames": self.count, "fps": self.fps, "latency_ms": self.latency_ms}
+
+
+class Track:
+    """A face followed over frames, with the result of its last recognition."""
+
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+        self.tracker = None
+        self.frames = 0
+        self.identity = None
+        self.distance = None
+        self.demography = None
+        self.recognized_at = None
+        self.pending = False
+
+
+def create_tracker(name):
+    """Create an opencv tracker, MIL is in the main opencv package, KCF and CSRT need contrib.
+
+    Returns:
+        tracker or None if opencv does not have it.
+    """
+    factory = getattr(cv2, f"Tracker{name}_create", None)
+    if factory is None and hasattr(cv2, "legacy"):
+        factory = getattr(cv2.legacy, f"Tracker{name}_create", None)
+    return factory() if factory is not None else None
+
+
+def _iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    intersection = max(0, x2 - x1) * max(0, y2 - y1)
+    union = a[2] * a[3] + b[2] * b[3] - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def _put(q, item, stop):
+    # blocks while the queue is full, unless the pipeline is stopped
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+
+class Pipeline:
+    """Realtime face recognition and facial attribute analysis of a video source.
+
+    Args:
+        db_path (str): facial database folder, same as in DeepFace.find.
+        model_name (str): face recognition model.
+        detector_backend (str): face detector.
+        distance_metric (str): cosine, euclidean or euclidean_l2.
+        enable_face_analysis (bool): analyze age, gender and emotion of recognized faces.
+        detect_every (int): detect faces in every that many frames, track them in the others.
+        frame_threshold (int): frames a face is tracked before it is recognized.
+        time_threshold (float): seconds a recognition is kept before the face is recognized
+        again.
+        recognition_workers (int): threads recognizing faces.
+        min_face_size (int): faces narrower than that many pixels are ignored.
+        tracker (str): opencv tracker, MIL, KCF or CSRT. Without it, boxes stay where they
+        were detected until the next detection.
+    """
+
+    def __init__(
+        self,
+        db_path,
+        model_name="VGG-Face",
+        detector_backend="opencv",
+        distance_metric="cosine",
+        enable_face_analysis=True,
+        detect_every=5,
+        frame_threshold=5,
+        time_threshold=5,
+        recognition_workers=2,
+        min_face_size=130,
+        tracker="MIL",
+    ):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.enable_face_analysis = enable_face_analysis
+        self.detect_every = max(1, detect_every)
+        self.frame_threshold = frame_threshold
+        self.time_threshold = time_threshold
+        self.recognition_workers = recognition_workers
+        self.min_face_size = min_face_size
+        self.tracker = tracker
+        self.target_size = functions.find_target_size(model_name=model_name)
+        self.threshold = dst.findThreshold(model_name, distance_metric)
+
+        # models and the index of db_path are built before the first frame
+        DeepFace.build_model(model_name)
+        if enable_face_analysis:
+            for attribute_model in ["Age", "Gender", "Emotion"]:
+                DeepFace.build_model(attribute_model)
+        self.identities, self.db_index = DeepFace.load_database(
+            db_path,
+            model_name=model_name,
+            distance_metric=distance_metric,
+            detector_backend=detector_backend,
+            enforce_detection=False,
+            silent=True,
+        )
+
+        self.stats = {
+            name: StageStats(name) for name in ["capture", "detection", "recognition", "display"]
+        }
+        self._stop = threading.Event()
+        self._next_track_id = 0
+
+    # --------------------------------------------------
+    # stages
+
+    def _capture(self, source, frames):
+        live = not (isinstance(source, str) and os.path.isfile(source))
+        cap = cv2.VideoCapture(source)
+        try:
+            frame_index = 0
+            while not self._stop.is_set():
+                tic = time.perf_counter()
+                has_frame, frame = cap.read()
+                if not has_frame:
+                    break
+                self.stats["capture"].record(time.perf_counter() - tic)
+                item = (frame_index, tic, frame)
+                frame_index += 1
+                if not live:
+                    _put(frames, item, self._stop)
+                    continue
+                # a camera does not wait, the oldest frame is dropped instead
+                while True:
+                    try:
+                        frames.put_nowait(item)
+                        break
+                    except queue.Full:
+                        try:
+                            frames.get_nowait()
+                        except queue.Empty:
+                            pass
+        finally:
+            cap.release()
+            _put(frames, None, self._stop)
+
+    def _detect(self, frame):
+        input_size = FaceDetector.input_size_class(self.detector_backend, frame)
+        face_detector = FaceDetector.build_model(self.detector_backend, input_size)
+        face_objs = FaceDetector.detect_faces(face_detector, self.detector_backend, frame, False)
+        return [
+            tuple(int(v) for v in region)
+            for _, region, _ in face_objs
+            if region[2] >= self.min_face_size
+        ]
+
+    def _update_tracks(self, frame_index, frame, tracks):
+        if frame_index % self.detect_every != 0:
+            followed = []
+            for track in tracks:
+                if track.tracker is not None:
+                    found, box = track.tracker.update(frame)
+                    if not found:
+                        continue
+                    track.box = tuple(int(v) for v in box)
+                followed.append(track)
+            return followed
+
+        # detected faces continue the tracks they overlap
+        updated = []
+        unmatched = list(tracks)
+        for box in self._detect(frame):
+            track = max(unmatched, key=lambda t: _iou(t.box, box), default=None)
+            if track is not None and _iou(track.box, box) > 0.3:
+                unmatched.remove(track)
+                track.box = box
+            else:
+                track = Track(self._next_track_id, box)
+                self._next_track_id += 1
+            track.tracker = create_tracker(self.tracker)
+            if track.tracker is not None:
+                track.tracker.init(frame, box)
+            updated.append(track)
+        return updated
+
+    def _detection(self, frames, annotated, executor):
+        tracks = []
+        in_flight = []
+        while True:
+            item = _get(frames, self._stop)
+            if item is None:
+                break
+            frame_index, captured_at, frame = item
+            tic = time.perf_counter()
+            tracks = self._update_tracks(frame_index, frame, tracks)
+
+            in_flight = [future for future in in_flight if not future.done()]
+            now = time.perf_counter()
+            for track in tracks:
+                track.frames += 1
+                due = track.recognized_at is None or now - track.recognized_at > self.time_threshold
+                if (
+                    due
+                    and not track.pending
+                    and track.frames >= self.frame_threshold
+                    and len(in_flight) < 2 * self.recognition_workers
+                ):
+                    x, y, w, h = track.box
+                    crop = frame[max(0, y) : y + h, max(0, x) : x + w].copy()
+                    if crop.size == 0:
+                        continue
+                    track.pending = True
+                    in_flight.append(executor.submit(self._recognize, track, crop))
+
+            self.stats["detection"].record(time.perf_counter() - tic)
+            snapshot = [
+                (t.track_id, t.box, t.identity, t.distance, t.demography) for t in tracks
+            ]
+            _put(annotated, (frame_index, captured_at, frame, snapshot), self._stop)
+        _put(annotated, None, self._stop)
+
+    def _recognize(self, track, crop):
+        tic = time.perf_counter()
+        try:
+            face = functions.extract_faces(
+                img=crop,
+                target_size=self.target_size,
+                detector_backend="skip",
+                enforce_detection=False,
+            )[0][0][0]
+            embedding = DeepFace.represent_batch(
+                [face], model_name=self.model_name, target_size=self.target_size, l2_normalize=False
+            )
+            indices, distances = self.db_index.search(embedding, k=1, threshold=self.threshold)[0]
+            if len(indices) > 0:
+                track.identity = self.identities[indices[0]]
+                track.distance = float(distances[0])
+            else:
+                track.identity, track.distance = None, None
+            if self.enable_face_analysis:
+                track.demography = DeepFace.analyze_batch(
+                    [crop],
+                    actions=("emotion", "age", "gender"),
+                    detector_backend="skip",
+                    enforce_detection=False,
+                )[0][0]
+            track.recognized_at = time.perf_counter()
+        finally:
+            track.pending = False
+            self.stats["recognition"].record(time.perf_counter() - tic)
+
+    # --------------------------------------------------
+
+    def run(self, source=0, display=True, on_frame=None):
+        """Process a video source until it ends or q is pressed in the window.
+
+        Args:
+            source: camera index or video file path, as cv2.VideoCapture takes it.
+            display (bool): show annotated frames in a window.
+            on_frame (callable, optional): called with frame index, frame and the list of
+            (track id, (x, y, w, h), identity, distance, demography) of its faces.
+
+        Returns:
+            dict: frames, fps and latency_ms of every stage. Latency of display is the one of
+            the whole pipeline, from capture to display.
+        """
+        self._stop.clear()
+        frames = queue.Queue(maxsize=_queue_size)
+        annotated = queue.Queue(maxsize=_queue_size)
+        executor = ThreadPoolExecutor(
+            max_workers=self.recognition_workers, thread_name_prefix="recognition"
+        )
+        threads = [
+            threading.Thread(target=self._capture, args=(source, frames), daemon=True),
+            threading.Thread(
+                target=self._detection, args=(frames, annotated, executor), daemon=True
+            ),
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = _get(annotated, self._stop)
+                if item is None:
+                    break
+                frame_index, captured_at, frame, snapshot = item
+                if on_frame is not None:
+                    on_frame(frame_index, frame, snapshot)
+                if display:
+                    self._draw(frame, snapshot)
+                    cv2.imshow("img", frame)
+                    if cv2.waitKey(1) & 0xFF == ord("q"):
+                        break
+                self.stats["display"].record(time.perf_counter() - captured_at)
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            executor.shutdown(wait=True)
+            if display:
+                cv2.destroyAllWindows()
+
+        return {name: stage.summary() for name, stage in self.stats.items()}
+
+    def _draw(self, frame, snapshot):
+        for _, (x, y, w, h), identity, distance, demography in snapshot:
+            cv2.rectangle(frame, (x, y), (x + w, y + h), (67, 67, 67), 1)
+            labels = []
+            if identity is not None:
+                labels.append(f"{os.path.basename(identity)} ({distance:.2f})")
+            if demography is not None:
+                labels.append(
+                    f"{demography['age']} {demography['dominant_gender']} "
+                    + f"{demography['dominant_emotion']}"
+                )
+            for i, label in enumerate(labels):
+                cv2.putText(
+                    frame,
+                    label,
+                    (x, max(15, y - 10 - 20 * i)),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.5,
+                    (255, 255, 255),
+                    1,
+                )
+
+        fps = " ".join(f"{name} {stage.fps:.0f}" for name, stage in self.stats.items())
+        cv2.putText(frame, fps, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
@@ -0,0 +1,74 @@
+import os
+import numpy as np
+
+# --------------------------------------------------
+# INT8 static quantization of onnx models. Activation ranges are calibrated on inputs the
+# model really gets in production, weights are quantized per channel.
+
+# --------------------------------------------------
+
+
+def int8_path(model_path):
+    """Get path of the quantized variant of a model.
+
+    Args:
+        model_path (str): path of the fp32 onnx model.
+
+    Returns:
+        str: path of the INT8 onnx model.
+    """
+    return os.path.splitext(model_path)[0] + ".int8.onnx"
+
+
+def quantize(model_path, calibration_inputs, output_path=None):
+    """Quantize weights and activations of an onnx model to INT8.
+
+    Args:
+        model_path (str): path of the fp32 onnx model.
+        calibration_inputs (list): numpy arrays fed to the single input of the model to
+        calibrate activation ranges, with the batch size the model accepts.
+        output_path (str, optional): path of the INT8 model. Defaults to int8_path.
+
+    Returns:
+        str: path of the INT8 model.
+    """
+    # onnx runtime quantization tooling is needed offline only
+    import onnxruntime as ort
+    from onnxruntime import quantization
+
+    if len(calibration_inputs) == 0:
+        raise ValueError("calibration_inputs must contain at least one input")
+
+    output_path = output_path or int8_path(model_path)
+    input_name = (
+        ort.InferenceSession(model_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    )
+
+    class _Reader(quantization.CalibrationDataReader):
+        def __init__(self):
+            self._inputs = iter(calibration_inputs)
+
+        def get_next(self):
+            item = next(self._inputs, None)
+            if item is None:
+                return None
+            return {input_name: item.astype(np.float32)}
+
+    preprocessed_path = output_path + ".pre.onnx"
+    try:
+        quantization.quant_pre_process(model_path, preprocessed_path)
+        quantization.quantize_static(
+            preprocessed_path,
+            output_path,
+            _Reader(),
+            quant_format=quantization.QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=quantization.QuantType.QUInt8,
+            weight_type=quantization.QuantType.QInt8,
+            calibrate_method=quantization.CalibrationMethod.MinMax,
+        )
+    finally:
+        if os.path.isfile(preprocessed_path):
+            os.remove(preprocessed_path)
+
+    return output_path
@@ -0,0 +1,124 @@
+import os
+import queue
+import threading
+import weakref
+from contextlib import contextmanager
+
+# --------------------------------------------------
+# process wide storage of built models. Every model is loaded once per process and
+# shared between threads. Models which can not be used by several threads at the same
+# time (cv2 dnn based ones) are wrapped into a ModelPool.
+
+_models = {}
+_memory = {}
+_pools = weakref.WeakSet()
+_lock = threading.RLock()
+
+# --------------------------------------------------
+
+
+def get_model(name, loader):
+    """Get a model from the registry, load it on the first call.
+
+    Args:
+        name (str): unique name of the model.
+        loader (callable): builds the model, called once per process.
+
+    Returns:
+        the shared model object.
+    """
+    model = _models.get(name)
+    if model is not None:
+        return model
+
+    with _lock:
+        if name not in _models:
+            before = resident_memory()
+            _models[name] = loader()
+            _memory[name] = max(resident_memory() - before, 0)
+
+    return _models[name]
+
+
+def memory_usage():
+    """Resident memory taken by the models of the registry.
+
+    Sizes are measured as the growth of the process resident set size while a model
+    (or an instance of a pooled model) was being loaded, so they are approximations.
+
+    Returns:
+        dict: model name to bytes.
+    """
+    with _lock:
+        usage = dict(_memory)
+        for pool in _pools:
+            usage[pool.name] = usage.get(pool.name, 0) + pool.memory
+
+    return usage
+
+
+def resident_memory():
+    """Get resident set size of the current process.
+
+    Returns:
+        int: bytes, 0 if it is not available on the platform.
+    """
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def pool_size():
+    """Get max count of instances of a pooled model.
+
+    Returns:
+        int: MODEL_POOL_SIZE environment variable, count of cpu cores by default.
+    """
+    return int(os.environ.get("MODEL_POOL_SIZE", os.cpu_count() or 1))
+
+
+class ModelPool:
+    """Instances of a model which is not thread safe.
+
+    Instances are created lazily, so only as many as threads running the model at the
+    same time are loaded, but never more than max_size. Memory of the instances is
+    reported by memory_usage under the pool name.
+    """
+
+    def __init__(self, loader, name, max_size=None):
+        self._loader = loader
+        self.name = name
+        self.max_size = max_size or pool_size()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.memory = 0
+        with _lock:
+            _pools.add(self)
+
+    @contextmanager
+    def acquire(self):
+        """Borrow an instance for exclusive use of the calling thread."""
+        instance = self._take()
+        try:
+            yield instance
+        finally:
+            self._idle.put(instance)
+
+    def _take(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self.size < self.max_size:
+                before = resident_memory()
+                instance = self._loader()
+                self.memory += max(resident_memory() - before, 0)
+                self.size += 1
+                return instance
+
+        return self._idle.get()
@@ -0,0 +1,246 @@
+import os
+import numpy as np
+from deepface.commons import distance as dst
+
+# --------------------------------------------------
+# nearest neighbour search over a float32 or float16 matrix of embeddings. Indexes answer
+# many queries at once and return, for every query, the indices of the closest rows argsorted
+# by distance together with their distances (in the metric find reports).
+#   brute_force: exact distances computed with numpy / BLAS, directly on memory mapped matrices
+#   hnsw: approximate graph search of hnswlib, tuned with HNSW_M, HNSW_EF_CONSTRUCTION and
+#       HNSW_EF_SEARCH environment variables
+#   ivf: approximate inverted file search of faiss, tuned with IVF_NLIST and IVF_NPROBE
+# hnswlib and faiss are not must dependencies, they are needed for their own index only.
+
+_chunk_elements = 1 << 24
+
+# --------------------------------------------------
+
+
+def _prepare(vectors, distance_metric):
+    vectors = np.ascontiguousarray(np.atleast_2d(vectors), dtype=np.float32)
+    if distance_metric in ("cosine", "euclidean_l2"):
+        vectors = np.ascontiguousarray(dst.l2_normalize_rows(vectors), dtype=np.float32)
+    return vectors
+
+
+class BruteForceIndex:
+    """Exact search computing distances of every query to every row.
+
+    The matrix is not copied, memory mapped float32 or float16 matrices stay shared with other
+    processes. Rows are converted to float32 (and normalized for euclidean_l2) chunk by chunk.
+
+    Args:
+        matrix: (N, D) array-like of embeddings.
+        distance_metric (str): cosine, euclidean or euclidean_l2.
+    """
+
+    kind = "brute_force"
+
+    def __init__(self, matrix, distance_metric):
+        dst._check_metric(distance_metric)
+        self.distance_metric = distance_metric
+        if not (isinstance(matrix, np.ndarray) and matrix.dtype in (np.float32, np.float16)):
+            matrix = np.asarray(matrix, dtype=np.float32)
+        self.matrix = np.atleast_2d(matrix)
+        # cosine distances normalize on their own
+        self._metric = "euclidean" if distance_metric == "euclidean_l2" else distance_metric
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def _chunks(self):
+        step = max(1, _chunk_elements // max(self.matrix.shape[1], 1))
+        for start in range(0, len(self.matrix), step):
+            chunk = np.asarray(self.matrix[start : start + step], dtype=np.float32)
+            if self.distance_metric == "euclidean_l2":
+                chunk = dst.l2_normalize_rows(chunk)
+            yield start, chunk
+
+    def search(self, queries, k=None, threshold=None):
+        """Find the closest rows of every query.
+
+        Args:
+            queries: (M, D) or (D,) array-like of embeddings.
+            k (int, optional): max count of rows per query. Defaults to all of them.
+            threshold (float, optional): rows more distant than that are not returned.
+
+        Returns:
+            list: M tuples of row indices argsorted by distance and their distances.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.distance_metric == "euclidean_l2":
+            queries = dst.l2_normalize_rows(queries)
+
+        # bounds memory of the distance matrix of many queries
+        step = max(1, _chunk_elements // max(len(self.matrix), 1))
+        results = []
+        for first in range(0, len(queries), step):
+            batch = queries[first : first + step]
+            distances = np.empty((len(batch), len(self.matrix)), dtype=np.float32)
+            for start, chunk in self._chunks():
+                end = start + len(chunk)
+                if len(batch) == 1:
+                    distances[0, start:end] = dst.find_distances(batch[0], chunk, self._metric)
+                else:
+                    distances[:, start:end] = dst.pairwise_distances(batch, chunk, self._metric)
+            results.extend(dst.closest(d, k, threshold) for d in distances)
+        return results
+
+
+class HnswIndex:
+    """Approximate search in a hierarchical navigable small world graph of hnswlib.
+
+    Args:
+        matrix: (N, D) array-like of embeddings.
+        distance_metric (str): cosine, euclidean or euclidean_l2.
+        path (str, optional): load the graph saved there instead of building it.
+    """
+
+    kind = "hnsw"
+
+    def __init__(self, matrix, distance_metric, path=None):
+        import hnswlib  # this is not a must dependency. do not import it in the global level.
+
+        dst._check_metric(distance_metric)
+        self.distance_metric = distance_metric
+        matrix = _prepare(matrix, distance_metric)
+        self._size = len(matrix)
+        self.ef_search = int(os.environ.get("HNSW_EF_SEARCH", 64))
+        self._index = hnswlib.Index(
+            space="ip" if distance_metric == "cosine" else "l2", dim=matrix.shape[1]
+        )
+        if path is not None:
+            self._index.load_index(path, max_elements=self._size)
+        else:
+            self._index.init_index(
+                max_elements=self._size,
+                ef_construction=int(os.environ.get("HNSW_EF_CONSTRUCTION", 200)),
+                M=int(os.environ.get("HNSW_M", 16)),
+            )
+            self._index.add_items(matrix, np.arange(self._size))
+
+    def __len__(self):
+        return self._size
+
+    def save(self, path):
+        self._index.save_index(path)
+
+    def search(self, queries, k=None, threshold=None):
+        """Same as BruteForceIndex.search, k defaults to HNSW_EF_SEARCH rows per query."""
+        queries = _prepare(queries, self.distance_metric)
+        k = min(k or self.ef_search, self._size)
+        self._index.set_ef(max(self.ef_search, k))
+        labels, distances = self._index.knn_query(queries, k=k)
+        # "ip" space already returns 1 - cosine similarity, "l2" returns squared distances
+        if self.distance_metric != "cosine":
+            distances = np.sqrt(np.maximum(distances, 0))
+        return [_within(l, d, threshold) for l, d in zip(labels.astype(np.int64), distances)]
+
+
+class IvfIndex:
+    """Approximate search in an inverted file index of faiss.
+
+    Args:
+        matrix: (N, D) array-like of embeddings.
+        distance_metric (str): cosine, euclidean or euclidean_l2.
+        path (str, optional): load the index saved there instead of training it.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, matrix, distance_metric, path=None):
+        import faiss  # this is not a must dependency. do not import it in the global level.
+
+        dst._check_metric(distance_metric)
+        self.distance_metric = distance_metric
+        matrix = _prepare(matrix, distance_metric)
+        self._size = len(matrix)
+        if path is not None:
+            self._index = faiss.read_index(path)
+        else:
+            # faiss wants ~40 training points per list
+            nlist = int(os.environ.get("IVF_NLIST", 4 * int(np.sqrt(self._size))))
+            nlist = max(1, min(nlist, self._size // 39))
+            if distance_metric == "cosine":
+                quantizer = faiss.IndexFlatIP(matrix.shape[1])
+                metric = faiss.METRIC_INNER_PRODUCT
+            else:
+                quantizer = faiss.IndexFlatL2(matrix.shape[1])
+                metric = faiss.METRIC_L2
+            self._quantizer = quantizer  # must outlive the index
+            self._index = faiss.IndexIVFFlat(quantizer, matrix.shape[1], nlist, metric)
+            self._index.train(matrix)
+            self._index.add(matrix)
+        self._index.nprobe = int(os.environ.get("IVF_NPROBE", 8))
+
+    def __len__(self):
+        return self._size
+
+    def save(self, path):
+        import faiss
+
+        faiss.write_index(self._index, path)
+
+    def search(self, queries, k=None, threshold=None):
+        """Same as BruteForceIndex.search, k defaults to 64 rows per query."""
+        queries = _prepare(queries, self.distance_metric)
+        k = min(k or 64, self._size)
+        distances, labels = self._index.search(queries, k)
+        if self.distance_metric == "cosine":
+            distances = 1 - distances
+        else:
+            distances = np.sqrt(np.maximum(distances, 0))
+        results = []
+        for l, d in zip(labels, distances):
+            found = l >= 0  # lists probed might hold less than k rows
+            results.append(_within(l[found], d[found], threshold))
+        return results
+
+
+def _within(labels, distances, threshold):
+    if threshold is not None:
+        found = distances <= threshold
+        labels, distances = labels[found], distances[found]
+    return labels, distances
+
+
+_indexes = {
+    BruteForceIndex.kind: BruteForceIndex,
+    HnswIndex.kind: HnswIndex,
+    IvfIndex.kind: IvfIndex,
+}
+
+# --------------------------------------------------
+
+
+def build_index(matrix, distance_metric, kind="brute_force", cache_path=None, source_path=None):
+    """Build a search index over embeddings.
+
+    Args:
+        matrix: (N, D) array-like of embeddings.
+        distance_metric (str): cosine, euclidean or euclidean_l2.
+        kind (str): brute_force, hnsw or ivf.
+        cache_path (str, optional): approximate indexes are saved there after they were built,
+        and loaded from there next time.
+        source_path (str, optional): file the matrix was read from, the saved index is not
+        loaded if that file was modified after it.
+
+    Returns:
+        index with a search method.
+    """
+    if kind not in _indexes:
+        raise ValueError(f"invalid index passed - {kind}")
+    index_class = _indexes[kind]
+    if kind == BruteForceIndex.kind or cache_path is None:
+        return index_class(matrix, distance_metric)
+
+    if os.path.isfile(cache_path) and (
+        source_path is None or os.path.getmtime(cache_path) >= os.path.getmtime(source_path)
+    ):
+        return index_class(matrix, distance_metric, path=cache_path)
+    index = index_class(matrix, distance_metric)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    index.save(tmp_path)
+    os.replace(tmp_path, cache_path)
+    return index
@@ -0,0 +1,281 @@
+import os
+import hashlib
+import pickle
+import numpy as np
+from deepface.commons import matrix_file
+
+# --------------------------------------------------
+# embeddings of the images of a folder, kept up to date incrementally. Files stored in the folder:
+#   <name>.vectors.<generation>: matrix_file of float32 or float16 rows appended in the order
+#       images were embedded, with the exact path of the image of every row in its ids table
+#   <name>.manifest: pickled dict of the images the rows belong to, with their mtime, size and
+#       sha256, so only new, changed or deleted images are processed by the next refresh
+# Rows of replaced or deleted images stay in the vectors file until they are the half of it,
+# then live rows are copied to the next generation of the file. The manifest is replaced
+# atomically after the vectors it points to were written, so rows appended by an interrupted
+# refresh are just dropped.
+
+_image_extensions = (".jpg", ".jpeg", ".png")
+_version = 2
+
+# --------------------------------------------------
+
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RepresentationStore:
+    """Incremental store of the embeddings of the images in a folder.
+
+    Args:
+        db_path (str): folder with jpg or png images, subfolders included.
+        name (str): base name of the store files in db_path.
+        dtype (str): float32 or float16 rows of a new store. Existing stores keep their dtype.
+    """
+
+    def __init__(self, db_path, name, dtype="float32"):
+        if dtype not in matrix_file.dtypes:
+            raise ValueError(f"invalid dtype passed - {dtype}")
+        self.db_path = db_path
+        self.name = name
+        self.dtype = dtype
+        self.manifest_path = os.path.join(db_path, f"{name}.manifest")
+        self._changed = False
+        self._load()
+
+    @property
+    def vectors_path(self):
+        return os.path.join(self.db_path, f"{self.name}.vectors.{self.generation}")
+
+    def _load(self):
+        manifest = {"generation": 0, "dimensions": None, "rows": 0, "ids_size": 0, "files": {}}
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path, "rb") as f:
+                stored = pickle.load(f)
+            if stored.get("version") == _version:
+                manifest = stored
+            else:
+                # vectors without header, images are embedded again into the next generation
+                self.generation = stored["generation"]
+                self._remove_vectors()
+                manifest["generation"] = stored["generation"] + 1
+        self.generation = manifest["generation"]
+        self.dimensions = manifest["dimensions"]
+        self.rows = manifest["rows"]
+        self.ids_size = manifest["ids_size"]
+        self.dtype = manifest.get("dtype", self.dtype)
+        # path -> {"mtime", "size", "sha256", "rows": (first row, count of rows)}
+        self.files = manifest["files"]
+
+        self._truncate()
+
+    def _truncate(self):
+        # drops rows which are not in the manifest
+        if self.dimensions is None:
+            self._remove_vectors()
+        elif os.path.isfile(self.vectors_path):
+            matrix_file.truncate(self.vectors_path, self.rows, self.ids_size)
+
+    def _remove_vectors(self, vectors_path=None):
+        vectors_path = vectors_path or self.vectors_path
+        for stale_path in (vectors_path, matrix_file.ids_path(vectors_path)):
+            if os.path.isfile(stale_path):
+                os.remove(stale_path)
+
+    def _save(self):
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(
+                {
+                    "version": _version,
+                    "generation": self.generation,
+                    "dtype": self.dtype,
+                    "dimensions": self.dimensions,
+                    "rows": self.rows,
+                    "ids_size": self.ids_size,
+                    "files": self.files,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.manifest_path)
+
+    @property
+    def live_rows(self):
+        return sum(entry["rows"][1] for entry in self.files.values())
+
+    def scan(self):
+        """Stat the images of the folder.
+
+        Returns:
+            dict: exact path of every image to its os.stat_result.
+        """
+        images = {}
+        for r, _, f in os.walk(self.db_path):
+            for file in f:
+                if file.lower().endswith(_image_extensions):
+                    exact_path = r + "/" + file
+                    images[exact_path] = os.stat(exact_path)
+        return images
+
+    def changes(self):
+        """Scan the folder and drop images which were deleted from it.
+
+        Returns:
+            tuple: list of (exact path, os.stat_result) of new images and of images with
+            changed mtime or size, and count of dropped images.
+        """
+        images = self.scan()
+        removed = [exact_path for exact_path in self.files if exact_path not in images]
+        for exact_path in removed:
+            del self.files[exact_path]
+
+        pending = [
+            (exact_path, stat)
+            for exact_path, stat in images.items()
+            if exact_path not in self.files
+            or self.files[exact_path]["mtime"] != stat.st_mtime_ns
+            or self.files[exact_path]["size"] != stat.st_size
+        ]
+        self._changed = self._changed or bool(pending or removed)
+        return pending, len(removed)
+
+    def digest(self, exact_path):
+        """Get sha256 of an image when it was embedded, None for new images."""
+        entry = self.files.get(exact_path)
+        return entry["sha256"] if entry is not None else None
+
+    def touch(self, exact_path, stat):
+        """Keep embeddings of an image whose content did not change."""
+        entry = self.files[exact_path]
+        entry["mtime"], entry["size"] = stat.st_mtime_ns, stat.st_size
+
+    def open(self):
+        """Open the vectors file for appending, pass it to append and checkpoint."""
+        return matrix_file.Appender(self.vectors_path, self.dtype)
+
+    def append(self, vectors, exact_path, stat, digest, embeddings):
+        """Store embeddings of an image, replacing the previous ones.
+
+        Args:
+            vectors (matrix_file.Appender): vectors file opened with open.
+            exact_path (str): path of the image.
+            stat (os.stat_result): stat of the image when it was read.
+            digest (str): sha256 of the image.
+            embeddings (list): embeddings of the faces in the image.
+        """
+        if len(embeddings) > 0:
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+            if self.dimensions is not None and embeddings.shape[1] != self.dimensions:
+                raise ValueError(
+                    f"{exact_path} has {embeddings.shape[1]} dimensional embedding, "
+                    + f"{self.dimensions} expected"
+                )
+            vectors.write(embeddings, [exact_path] * len(embeddings))
+            self.dimensions = vectors.dimensions
+            self.ids_size = vectors.ids_size
+        self.files[exact_path] = {
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": digest,
+            "rows": (self.rows, len(embeddings)),
+        }
+        self.rows += len(embeddings)
+
+    def checkpoint(self, vectors):
+        """Persist images appended so far, they are not embedded again after an interruption."""
+        vectors.flush()
+        self._save()
+
+    def close(self):
+        """Persist changes after the vectors file was closed, compact it if needed."""
+        # images appended before a failure are kept
+        self._truncate()
+        if self._changed:
+            self._save()
+            if self.rows > 2 * self.live_rows:
+                self.compact()
+        self._changed = False
+
+    def compact(self):
+        """Copy rows of the current images to the next generation of the vectors file."""
+        matrix = self._matrix()
+        stale_path = self.vectors_path
+        self.generation += 1
+        self._remove_vectors()
+        rows = 0
+        with self.open() as vectors:
+            for exact_path, entry in self.files.items():
+                first, count = entry["rows"]
+                if count > 0:
+                    vectors.write(matrix[first : first + count], [exact_path] * count)
+                entry["rows"] = (rows, count)
+                rows += count
+            self.ids_size = vectors.ids_size
+        del matrix
+        self.rows = rows
+        self._save()
+        self._remove_vectors(stale_path)
+
+    def _matrix(self):
+        if self.rows == 0:
+            return np.empty((0, self.dimensions or 0), dtype=matrix_file.dtypes[self.dtype])
+        return matrix_file.load(self.vectors_path)[1][: self.rows]
+
+    def load(self):
+        """Get embeddings of the current images.
+
+        Returns:
+            tuple: list of exact image paths per row, and (N, D) float32 or float16 matrix of
+            the embeddings, memory mapped if the vectors file has no stale rows.
+        """
+        if self.rows == 0:
+            return [], self._matrix()
+
+        identities, matrix = matrix_file.load(self.vectors_path)
+        # rows appended by a running refresh are not in the manifest yet
+        identities, matrix = identities[: self.rows], matrix[: self.rows]
+        if self.rows == self.live_rows:
+            return identities, matrix
+
+        live = np.zeros(self.rows, dtype=bool)
+        for entry in self.files.values():
+            first, count = entry["rows"]
+            live[first : first + count] = True
+        return [identity for identity, keep in zip(identities, live) if keep], matrix[live]
+
+    def import_pickle(self, pkl_path):
+        """Fill an empty store with the representations pickled by former versions of find.
+
+        Images are expected to be unchanged since the pickle was written, the ones which do not
+        exist anymore are skipped. Their sha256 is not known, so a later change of their mtime
+        or size embeds them again.
+
+        Args:
+            pkl_path (str): representations_<model>.pkl file, a list of [exact path, embedding].
+
+        Returns:
+            int: count of imported images.
+        """
+        if self.files:
+            raise ValueError(f"{self.manifest_path} is not empty, a new store is needed")
+
+        with open(pkl_path, "rb") as f:
+            representations = pickle.load(f)
+
+        # faces of the same image are grouped, they were pickled one after another
+        images = {}
+        for identity, embedding in representations:
+            images.setdefault(identity, []).append(embedding)
+
+        with self.open() as vectors:
+            for exact_path, embeddings in images.items():
+                if os.path.isfile(exact_path):
+                    self.append(vectors, exact_path, os.stat(exact_path), None, embeddings)
+        self._changed = True
+        self.close()
+        return len(self.files)
@@ -1,7 +1,11 @@
 import math
+import os
+import functools
+import threading
+from collections import OrderedDict
 from PIL import Image
 import numpy as np
-from deepface.commons import distance
+from deepface.commons import distance, registry
 from deepface.detectors import (
     OpenCvWrapper,
     SsdWrapper,
@@ -12,9 +16,70 @@ from deepface.detectors import (
     YoloWrapper,
     YunetWrapper,
 )
-import threading
 
-def build_model(detector_backend):
+# cv2 dnn and mediapipe detectors keep state of the last input, so they can not serve
+# several threads at the same time. Such detectors are pooled.
+pooled_backends = ["ssd", "mediapipe", "yunet"]
+
+# detectors which allocate their network for a fixed input size. They are cached per
+# input size class, so the network is not re-allocated for every image.
+sized_backends = {
+    "yunet": YunetWrapper.input_size,
+}
+
+# --------------------------------------------------
+# bounded cache of built detectors, keyed by backend and input size class
+
+_detectors = OrderedDict()
+_detectors_lock = threading.Lock()
+cache_hits = None
+cache_misses = None
+
+
+def set_cache_metrics(hits, misses):
+    global cache_hits, cache_misses
+    cache_hits = hits
+    cache_misses = misses
+
+
+def cache_size():
+    """Get max count of detectors kept in the cache.
+
+    Returns:
+        int: DETECTOR_CACHE_SIZE environment variable, 32 by default.
+    """
+    return int(os.environ.get("DETECTOR_CACHE_SIZE", 32))
+
+
+def input_size_class(detector_backend, img):
+    """Get the input size class of an image for a detector backend.
+
+    Args:
+        detector_backend (str): the face detector backend.
+        img (numpy array): the image to detect faces on.
+
+    Returns:
+        tuple: (width, height) the detector is built for, None if the detector
+        does not depend on the input size.
+    """
+    input_size = sized_backends.get(detector_backend)
+    if input_size is None:
+        return None
+
+    return input_size(img)
+
+
+def build_model(detector_backend, input_size=None):
+    """Build a face detector or get it from the cache.
+
+    Args:
+        detector_backend (str): the face detector backend.
+        input_size (tuple, optional): input size class of the images, see
+        input_size_class. Defaults to None.
+
+    Returns:
+        the detector, shared between all threads of the process.
+    """
     backends = {
         "opencv": OpenCvWrapper.build_model,
         "ssd": SsdWrapper.build_model,
@@ -25,20 +90,55 @@ def build_model(detector_backend):
         "yolov8": YoloWrapper.build_model,
         "yunet": YunetWrapper.build_model,
     }
-    if not "face_detector_obj" in globals():
-        face_detector_obj = {}
-    thrName = threading.currentThread().getName()
-    built_models = list(face_detector_obj.keys())
-    if detector_backend+thrName not in built_models:
-        face_detector = backends.get(detector_backend)
-
-        if face_detector:
-            face_detector = face_detector()
-            face_detector_obj[detector_backend+thrName] = face_detector
+
+    face_detector = backends.get(detector_backend)
+    if not face_detector:
+        raise ValueError("invalid detector_backend passed - " + detector_backend)
+
+    if detector_backend not in sized_backends:
+        input_size = None
+    key = (detector_backend, input_size)
+
+    with _detectors_lock:
+        detector = _detectors.get(key)
+        if detector is not None:
+            _detectors.move_to_end(key)
+            if cache_hits is not None:
+                cache_hits.labels(backend=detector_backend).inc()
+            return detector
+
+        if cache_misses is not None:
+            cache_misses.labels(backend=detector_backend).inc()
+
+        if input_size is not None:
+            face_detector = functools.partial(face_detector, input_size)
+
+        name = "detector:" + detector_backend
+        if detector_backend in pooled_backends:
+            detector = registry.ModelPool(face_detector, name)
         else:
-            raise ValueError("invalid detector_backend passed - " + detector_backend)
+            detector = face_detector()
+
+        _detectors[key] = detector
+        if len(_detectors) > cache_size():
+            # threads still using an evicted detector keep their reference
+            _detectors.popitem(last=False)
+
+    return detector
 
-    return face_detector_obj[detector_backend+thrName]
+
+def warmup(detector_backend, input_sizes=None):
+    """Build detectors and run them once, so the first requests do not pay for it.
+
+    Args:
+        detector_backend (str): the face detector backend.
+        input_sizes (list, optional): (width, height) of the images expected for sized
+        detectors. Defaults to None.
+    """
+    for width, height in input_sizes or [(640, 480)]:
+        img = np.zeros((height, width, 3), dtype=np.uint8)
+        face_detector = build_model(detector_backend, input_size_class(detector_backend, img))
+        detect_faces(face_detector, detector_backend, img)
 
 
 def detect_face(face_detector, detector_backend, img, align=True):
@@ -72,7 +172,11 @@ def detect_faces(face_detector, detector_backend, img, align=True, landmarks_ver
     detect_face_fn = backends.get(detector_backend)
 
     if detect_face_fn:  # pylint: disable=no-else-return
-        obj = detect_face_fn(face_detector, img, align, landmarks_verification)
+        if isinstance(face_detector, registry.ModelPool):
+            with face_detector.acquire() as detector:
+                obj = detect_face_fn(detector, img, align, landmarks_verification)
+        else:
+            obj = detect_face_fn(face_detector, img, align, landmarks_verification)
         # obj stores list of (detected_face, region, confidence)
         return obj
     else:
@@ -2,10 +2,10 @@ import os
 import cv2
 import gdown
 from deepface.detectors import FaceDetector
-from deepface.commons import functions
+from deepface.commons import functions, alignment
 
 
-def build_model():
+def build_model(input_size=(0, 0)):
     # pylint: disable=C0301
     url = "https://github.com/opencv/opencv_zoo/raw/main/models/face_detection_yunet/face_detection_yunet_2023mar.onnx"
     file_name = "face_detection_yunet_2023mar.onnx"
@@ -14,14 +14,34 @@ def build_model():
         print(f"{file_name} will be downloaded...")
         output = home + f"/.deepface/weights/{file_name}"
         gdown.download(url, output, quiet=False)
-    face_detector = cv2.FaceDetectorYN_create(home + f"/.deepface/weights/{file_name}", "", (0, 0))
+    face_detector = cv2.FaceDetectorYN_create(
+        home + f"/.deepface/weights/{file_name}", "", input_size
+    )
     return face_detector
 
 
+def input_size(image):
+    # Yunet pads its input to a multiple of 32 anyway, so all images resized below
+    # share the network of the same padded size
+    height, width = _resized_shape(image)
+    return ((width - 1) // 32 + 1) * 32, ((height - 1) // 32 + 1) * 32
+
+
+def _resized_shape(image):
+    height, width = image.shape[0], image.shape[1]
+    if height > 640 or width > 640:
+        r = 640.0 / max(height, width)
+        return int(height * r), int(width * r)
+    return height, width
+
+
 def detect_face(detector, image, align=True,landmarks_verification = False,  score_threshold=0.9):
     # FaceDetector.detect_faces does not support score_threshold parameter.
     # We can set it via environment variable.
     score_threshold = os.environ.get("yunet_score_threshold", score_threshold)
+    # "rotate" aligns the detected area by the eyes, "warp" maps all 5 landmarks onto the
+    # 112x112 ArcFace / SFace template with a single affine warp of the whole image
+    alignment_mode = os.environ.get("yunet_alignment", "rotate")
     resp = []
     detected_face = None
     img_region = [0, 0, image.shape[1], image.shape[0]]
@@ -32,13 +52,21 @@ def detect_face(detector, image, align=True,landmarks_verification = False,  sco
     resized = False
     if height > 640 or width > 640:
         r = 640.0 / max(height, width)
-        original_image = image.copy()
+        original_image = image
         image = cv2.resize(image, (int(width * r), int(height * r)))
         height, width = image.shape[0], image.shape[1]
         resized = True
-    detector.setInputSize((width, height))
     detector.setScoreThreshold(score_threshold)
-    _, faces = detector.detect(image)
+    input_width, input_height = detector.getInputSize()
+    if (input_width, input_height) == input_size(image):
+        # the same zero padding as Yunet does internally, but the network keeps its size
+        detection_image = cv2.copyMakeBorder(
+            image, 0, input_height - height, 0, input_width - width, cv2.BORDER_CONSTANT, value=0
+        )
+    else:
+        detector.setInputSize((width, height))
+        detection_image = image
+    _, faces = detector.detect(detection_image)
     if faces is None:
         return resp
     for face in faces:
@@ -82,8 +110,14 @@ def detect_face(detector, image, align=True,landmarks_verification = False,  sco
             )
         confidence = face[-1]
         confidence = f"{confidence:.2f}"
-        detected_face = image[int(y) : int(y + h), int(x) : int(x + w)]
         img_region = [x, y, w, h]
+        if align and alignment_mode == "warp":
+            landmarks = face[4:14].reshape(5, 2)
+            if resized:
+                landmarks = landmarks / r
+            resp.append((alignment.warp_face(image, landmarks), img_region, confidence))
+            continue
+        detected_face = image[int(y) : int(y + h), int(x) : int(x + w)]
         if align:
             detected_face = yunet_align_face(detected_face, x_re, y_re, x_le, y_le)
         resp.append((detected_face, img_region, confidence))
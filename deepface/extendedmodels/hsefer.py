@@ -5,7 +5,7 @@ import time
 import gdown
 import numpy
 
-from deepface.commons import functions
+from deepface.commons import functions, batching, ort_session, quantization
 import cv2
 import onnx
 import onnxruntime as ort
@@ -13,14 +13,19 @@ import numpy as np
 import pandas as pd
 # -------------------------------------------
 
-def loadModel():
-    return HSEmotionRecognizer()
+def loadModel(quantized = False):
+    return HSEmotionRecognizer(quantized=quantized)
 class HSEmotionRecognizer:
     #supported values of model_name: enet_b0_8_best_vgaf, enet_b0_8_best_afew, enet_b2_8, enet_b0_8_va_mtl, enet_b2_7
-    def __init__(self, model_name='enet_b0_8_best_vgaf'):
+    def __init__(self, model_name='enet_b0_8_best_vgaf', quantized = False):
         home = functions.get_deepface_home()
         path = home + f"/.deepface/weights/{model_name}.onnx"
-        if os.path.isfile(path) != True:
+        if quantized:
+            # produced by scripts/quantize.py from the fp32 weights
+            path = quantization.int8_path(path)
+            if os.path.isfile(path) != True:
+                raise ValueError(f"{path} does not exist, run scripts/quantize.py emotion first")
+        elif os.path.isfile(path) != True:
             print(f"{model_name}.onnx will be downloaded...")
             url='https://github.com/HSE-asavchenko/face-emotion-recognition/blob/main/models/affectnet_emotions/onnx/'+model_name+'.onnx?raw=true'
             output = path
@@ -33,12 +38,18 @@ class HSEmotionRecognizer:
         self.class_to_idx = {v: k for k, v in self.idx_to_class.items()}
         self.img_size=224 if '_b0_' in model_name else 260
         logging.warning(f"ORT device: {ort.get_device()}, OpenCV: {cv2.cuda.getCudaEnabledDeviceCount()}")
-        if ort.get_device() == "GPU":
-            # sessOptions = ort.SessionOptions()
-            # sessOptions.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
-            self.ort_session = ort.InferenceSession(path,providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
-        else:
-            self.ort_session = ort.InferenceSession(path,providers=['CPUExecutionProvider'])
+        # session options are tuned with ORT_* environment variables, see ort_session
+        self.ort_session = ort_session.create_session(path)
+        # every predict_multi_emotions call runs on its own by default, EMOTION_MAX_BATCH_SIZE
+        # above 1 runs frames of concurrent calls as one batch
+        max_batch_size = int(os.environ.get("EMOTION_MAX_BATCH_SIZE", 0))
+        max_wait = float(os.environ.get("EMOTION_MAX_BATCH_WAIT_MS", 2)) / 1000
+        self.batcher = None
+        if max_batch_size > 1:
+            self.batcher = batching.MicroBatcher(self._run, max_batch_size, max_wait)
+
+    def _run(self, imgs):
+        return self.ort_session.run(None, {"input": imgs})[0]
 
     def preprocess(self, img):
         x=cv2.resize(img,(self.img_size,self.img_size))/255
@@ -76,7 +87,10 @@ class HSEmotionRecognizer:
     def predict_multi_emotions(self, face_img_list, logits=True):
         imgs = [self.preprocess(face_img) for face_img in face_img_list]
         imgs = np.concatenate(imgs, axis=0)
-        scores=self.ort_session.run(None, {"input": imgs})[0]
+        if self.batcher is not None:
+            scores = self.batcher.submit(imgs)
+        else:
+            scores = self._run(imgs)
         if self.is_mtl:
             preds=np.argmax(scores[:,:-2], axis=1)
         else:
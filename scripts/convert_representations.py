@@ -0,0 +1,26 @@
+import argparse
+import os
+from deepface.commons import store
+
+# ----------------------------------------------
+# converts a representations_<model>.pkl file pickled by former versions of DeepFace.find to the
+# memory mapped store it uses now, so the images of the folder are not embedded again. Pass
+# db_path the way it was passed to find, pickled image paths start with it.
+#
+#   python scripts/convert_representations.py /path/to/faces --model ArcFace --dtype float16
+
+parser = argparse.ArgumentParser(description="convert pickled representations of find")
+parser.add_argument("db_path", help="face database folder with the pkl file")
+parser.add_argument("--model", default="VGG-Face")
+parser.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+parser.add_argument("--remove", action="store_true", help="remove the pkl file once converted")
+args = parser.parse_args()
+
+file_name = f"representations_{args.model}".replace("-", "_").lower()
+pkl_path = f"{args.db_path}/{file_name}.pkl"
+db_store = store.RepresentationStore(args.db_path, file_name, dtype=args.dtype)
+imported = db_store.import_pickle(pkl_path)
+print(f"{imported} images, {db_store.live_rows} faces converted to {db_store.vectors_path}")
+
+if args.remove:
+    os.remove(pkl_path)
@@ -0,0 +1,63 @@
+import argparse
+import json
+import logging
+import os
+import sys
+from deepface.commons.distance import findThreshold
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+import faces  # pylint: disable=wrong-import-position
+import duplicate_scan  # pylint: disable=wrong-import-position
+
+# ----------------------------------------------
+# searches duplicates among all primary photos and queues the newer user of every candidate pair for
+# duplicate review, see api/duplicate_scan.py. An interrupted scan is continued when started again with
+# the same params. Milvus and redis connections are configured by the same env variables as the service,
+# set PROMETHEUS_MULTIPROC_DIR of the service to expose the throughput metrics on its /metrics.
+#
+#   python scripts/duplicate_scan.py --ef 64                         # batched milvus searches
+#   python scripts/duplicate_scan.py --export /data/primaries.matrix # exact search over an export
+#   python scripts/duplicate_scan.py --exact /data/primaries.matrix  # exact search over an existing export
+#   python scripts/duplicate_scan.py --restart --no-queue --top 50   # only list the closest pairs
+
+parser = argparse.ArgumentParser(description="duplicate scan of all primary photos")
+parser.add_argument(
+    "--threshold",
+    type=float,
+    default=float(os.environ.get("PRIMARY_PHOTO_ARCFACE_DISTANCE", findThreshold("ArcFace", "euclidean_l2"))),
+    help="max squared L2 distance of duplicates",
+)
+parser.add_argument("--batch-size", type=int, default=256, help="primary photos searched at once")
+parser.add_argument("--limit", type=int, default=faces._faces_count_to_search_for, help="max duplicates of a user")
+parser.add_argument("--ef", type=int, help="ef of the HNSW index for the scan")
+parser.add_argument("--search-params", help="json overriding search params of the index")
+parser.add_argument("--export", help="export primary vectors to that matrix file and search it exactly")
+parser.add_argument("--exact", help="search exactly an already exported matrix file")
+parser.add_argument("--restart", action="store_true", help="do not continue an interrupted scan")
+parser.add_argument("--no-queue", action="store_true", help="do not queue users for review")
+parser.add_argument("--top", type=int, default=20, help="count of the closest pairs printed")
+args = parser.parse_args()
+
+logging.basicConfig(level=os.environ.get("LOGGING_LEVEL", "INFO"))
+faces.connect_milvus()
+search_params = json.loads(args.search_params or "{}")
+if args.ef:
+    search_params["ef"] = args.ef
+snapshot = args.exact
+if args.export:
+    print(f"{duplicate_scan.export_primaries(args.export)} primary vectors exported to {args.export}")
+    snapshot = args.export
+
+pairs = duplicate_scan.scan(
+    args.threshold,
+    batch_size=args.batch_size,
+    limit=args.limit,
+    search_params=search_params,
+    snapshot=snapshot,
+    restart=args.restart or bool(args.export),
+)
+print(f"{pairs} candidate pairs within {args.threshold}")
+for user_id, similar_user_id, distance in duplicate_scan.ranked_pairs(args.top):
+    print(f"{user_id} {similar_user_id} {round(distance, 4)}")
+if not args.no_queue:
+    print(f"{duplicate_scan.queue_for_review(args.limit)} users queued for duplicate review")
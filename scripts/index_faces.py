@@ -0,0 +1,41 @@
+import argparse
+import os
+from deepface import DeepFace
+from deepface.commons import functions, indexer, store
+
+# ----------------------------------------------
+# builds or refreshes representations of a face database the way DeepFace.find stores them,
+# with faces detected on a pool of processes. The run can be interrupted and started again,
+# it continues with the images which were not stored yet.
+#
+#   python scripts/index_faces.py /path/to/faces --model ArcFace --detector yunet --workers 8
+
+# workers are spawned processes which import this module again
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="parallel indexing of a face database for find")
+    parser.add_argument("db_path", help="folder with jpg or png pictures")
+    parser.add_argument("--model", default="VGG-Face")
+    parser.add_argument("--detector", default="opencv")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", type=int, default=32, help="faces per model call")
+    parser.add_argument("--checkpoint-every", type=int, default=1000, help="images")
+    parser.add_argument("--skip-faceless", action="store_true", help="do not fail on pictures without face")
+    args = parser.parse_args()
+
+    target_size = functions.find_target_size(model_name=args.model)
+    db_store = store.RepresentationStore(
+        args.db_path, f"representations_{args.model}".replace("-", "_").lower()
+    )
+    embedded, removed = indexer.refresh(
+        db_store,
+        lambda faces: DeepFace.represent_batch(
+            faces, model_name=args.model, target_size=target_size, l2_normalize=False
+        ),
+        target_size=target_size,
+        detector_backend=args.detector,
+        enforce_detection=not args.skip_faceless,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        checkpoint_every=args.checkpoint_every,
+    )
+    print(f"{embedded} images embedded, {removed} images removed, {db_store.live_rows} faces stored")
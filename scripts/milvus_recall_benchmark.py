@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from deepface.commons import distance as dst
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+import faces  # pylint: disable=wrong-import-position
+
+# ----------------------------------------------
+# recall and latency of the primary photos duplicate search (faces.find_similar_users) against exact
+# search over a snapshot of the stored embeddings. Duplicates are the exact neighbours within the
+# threshold (squared L2, as milvus returns it), the ones the index does not return are false negatives.
+# The tunable search param of the index (ef of HNSW, nprobe of IVF, search_list of DISKANN) is swept.
+# Without --index-type the live collection is searched, with it a temporary collection is built from
+# the snapshot. Milvus connection is configured by the same env variables as the service.
+#
+#   python scripts/milvus_recall_benchmark.py export arcface.npz --model arcface
+#   python scripts/milvus_recall_benchmark.py run arcface.npz --values 5,10,20,40,80,160
+#   python scripts/milvus_recall_benchmark.py run arcface.npz --index-type IVF_SQ8 --index-params '{"nlist": 4096}' --values 8,16,32,64
+
+
+def export(path, model):
+    collection = faces.get_faces_collection(model)
+    iterator = collection.query_iterator(
+        batch_size=1000,
+        expr=f"picture_id == {faces._picture_primary}",
+        output_fields=["user_id", "face_metadata"],
+    )
+    user_ids, vectors = [], []
+    while True:
+        rows = iterator.next()
+        if not rows:
+            iterator.close()
+            break
+        user_ids.extend(row["user_id"] for row in rows)
+        vectors.extend(row["face_metadata"] for row in rows)
+    np.savez(path, user_ids=np.array(user_ids), vectors=np.asarray(vectors, dtype=np.float32))
+    print(f"{len(user_ids)} primary embeddings of {collection.name} exported to {path}")
+
+
+def snapshot_collection(model, user_ids, vectors, index_type, build_params):
+    name = f"faces_{model}_benchmark"
+    if faces.utility.has_collection(name, using=faces._conn_prefix):
+        faces.utility.drop_collection(name, using=faces._conn_prefix)
+    tic = time.perf_counter()
+    collection = faces.create_faces_collection(name, model, index_type, build_params)
+    step = 5000
+    for start in range(0, len(user_ids), step):
+        ids = user_ids[start : start + step].tolist()
+        collection.insert(
+            [
+                [f"{user_id}~{faces._picture_primary}" for user_id in ids],
+                ids,
+                [np.int32(faces._picture_primary)] * len(ids),
+                vectors[start : start + step].tolist(),
+                [""] * len(ids),
+                [0] * len(ids),
+            ],
+            partition_name=faces._partitions[faces._picture_primary],
+        )
+    collection.flush()
+    collection.load()
+    print(f"{name} with {index_type} {build_params} built in {round(time.perf_counter() - tic, 1)} s")
+    return collection
+
+
+def exact_neighbours(queries, vectors, rows, limit, exclude_self):
+    """Indices and squared L2 distances of the closest snapshot rows of every query."""
+    neighbours = []
+    step = 256
+    for start in range(0, len(queries), step):
+        distances = dst.pairwise_distances(queries[start : start + step], vectors) ** 2
+        for i, query_distances in enumerate(distances):
+            if exclude_self:
+                query_distances[rows[start + i]] = np.inf
+            neighbours.append(dst.closest(query_distances, limit))
+    return neighbours
+
+
+def run(args):
+    snapshot = np.load(args.snapshot)
+    user_ids, vectors = snapshot["user_ids"], snapshot["vectors"]
+    if args.index_type:
+        index_type = args.index_type.upper()
+        _, build_params, _ = faces.index_profile(index_type)
+        build_params = {**build_params, **json.loads(args.index_params or "{}")}
+        collection = snapshot_collection(args.model, user_ids, vectors, index_type, build_params)
+    else:
+        collection = faces.get_faces_collection(args.model)
+        index = [idx for idx in collection.indexes if idx.field_name == "face_metadata"]
+        index_type = index[0].params.get("index_type", "HNSW").upper()
+        print(f"{collection.name} with {index_type} {index[0].params.get('params')}")
+    param = args.param or faces.tunable_search_param(index_type)
+    values = [int(v) for v in args.values.split(",")] if args.values else [faces.get_search_params(collection)[param]]
+
+    rng = np.random.default_rng(args.seed)
+    rows = rng.choice(len(user_ids), min(args.queries, len(user_ids)), replace=False)
+    queries = vectors[rows]
+    # noise makes near duplicates of the stored faces, without it the query itself is skipped
+    exclude_self = args.noise == 0
+    if not exclude_self:
+        queries = queries + args.noise * rng.standard_normal(queries.shape).astype(np.float32)
+    exact = exact_neighbours(queries, vectors, rows, args.limit, exclude_self)
+    duplicates = [set(user_ids[indices[distances <= args.threshold]].tolist()) for indices, distances in exact]
+    expected = [set(user_ids[indices].tolist()) for indices, _ in exact]
+    duplicates_count = sum(len(d) for d in duplicates)
+
+    print(
+        f"{len(queries)} queries, limit {args.limit}, {duplicates_count} duplicates within {args.threshold}"
+        + f" (squared L2) among {len(user_ids)} faces"
+    )
+    for value in values:
+        latencies, found = [], []
+        for row, query in zip(rows, queries):
+            tic = time.perf_counter()
+            results = faces.search_primary(
+                collection, [query.tolist()], limit=args.limit + int(exclude_self), search_params={param: value}
+            )
+            latencies.append(time.perf_counter() - tic)
+            ids = [pk.split("~")[0] for pk in results[0].ids]
+            if exclude_self:
+                ids = [user_id for user_id in ids if user_id != user_ids[row]]
+            found.append(set(ids[: args.limit]))
+        recall = np.mean([len(f & e) / max(len(e), 1) for f, e in zip(found, expected)])
+        missed = sum(len(d - f) for d, f in zip(duplicates, found))
+        latencies = np.array(latencies) * 1000
+        print(
+            f"{param}={value}: p50 {round(np.percentile(latencies, 50), 2)} ms, p99 {round(np.percentile(latencies, 99), 2)} ms, "
+            + f"recall@{args.limit} {round(recall, 4)}, missed duplicates {missed}/{duplicates_count}"
+            + (f" (false negative rate {round(missed / duplicates_count, 4)})" if duplicates_count else "")
+        )
+
+    if args.index_type and not args.keep:
+        collection.drop()
+
+
+parser = argparse.ArgumentParser(description="recall vs latency of the milvus duplicate search")
+subparsers = parser.add_subparsers(dest="command", required=True)
+export_parser = subparsers.add_parser("export", help="save primary embeddings of a collection to npz")
+export_parser.add_argument("snapshot")
+export_parser.add_argument("--model", default=faces._models[0], choices=faces._models)
+run_parser = subparsers.add_parser("run", help="compare the index with exact search over the snapshot")
+run_parser.add_argument("snapshot")
+run_parser.add_argument("--model", default=faces._models[0], choices=faces._models)
+run_parser.add_argument("--index-type", choices=list(faces._index_profiles), help="build a temporary collection with that index")
+run_parser.add_argument("--index-params", help="json overriding build params of the index type")
+run_parser.add_argument("--param", help="search param to sweep, defaults to the tunable one of the index")
+run_parser.add_argument("--values", help="comma separated values of the param, defaults to the configured one")
+run_parser.add_argument("--limit", type=int, default=faces._faces_count_to_search_for)
+run_parser.add_argument(
+    "--threshold",
+    type=float,
+    default=float(os.environ.get("PRIMARY_PHOTO_ARCFACE_DISTANCE", dst.findThreshold("ArcFace", "euclidean_l2"))),
+)
+run_parser.add_argument("--queries", type=int, default=1000)
+run_parser.add_argument("--noise", type=float, default=0.0, help="std of the noise added to the queried embeddings")
+run_parser.add_argument("--seed", type=int, default=0)
+run_parser.add_argument("--keep", action="store_true", help="do not drop the temporary collection")
+args = parser.parse_args()
+
+faces.connect_milvus()
+if args.command == "export":
+    export(args.snapshot, args.model)
+else:
+    run(args)
@@ -0,0 +1,80 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+import faces  # pylint: disable=wrong-import-position
+
+# ----------------------------------------------
+# moves rows of the faces collections from the default partition to the partition of their picture
+# type. Rows are copied, then deleted from the default partition, batch by batch, so the run can be
+# interrupted and started again. Rows already rewritten into their partition by the service are not
+# copied. Workers re-check the partitions every MILVUS_PARTITIONING_TTL seconds: they write to the
+# partitions once they see them, and search primaries without the picture_id filter once the default
+# partition stayed empty over a whole re-check period, no restart is needed. Milvus connection is
+# configured by the same env variables as the service.
+#
+#   python scripts/partition_faces.py --create-only   # optional, wait MILVUS_PARTITIONING_TTL before the move
+#   python scripts/partition_faces.py                 # moves the rows, run again if some were added meanwhile
+
+parser = argparse.ArgumentParser(description="split faces collections into partitions by picture type")
+parser.add_argument("--model", action="append", choices=faces._models, help="defaults to all of them")
+parser.add_argument("--batch-size", type=int, default=1000)
+parser.add_argument("--create-only", action="store_true", help="only create the partitions")
+args = parser.parse_args()
+
+output_fields = ["user_picture_id", "user_id", "picture_id", "face_metadata", "url", "uploaded_at"]
+
+
+def move(collection, rows):
+    pks = [row["user_picture_id"] for row in rows]
+    rewritten = {
+        row["user_picture_id"]
+        for row in collection.query(
+            expr=f"user_picture_id in {pks}",
+            partition_names=list(faces._partitions.values()),
+            limit=len(pks),
+            output_fields=["user_picture_id"],
+        )
+    }
+    for picture_id, partition in faces._partitions.items():
+        batch = [row for row in rows if int(row["picture_id"]) == picture_id and row["user_picture_id"] not in rewritten]
+        if batch:
+            collection.insert([[row[f] for row in batch] for f in output_fields], partition_name=partition)
+    collection.delete(f"user_picture_id in {pks}", partition_name=faces._default_partition)
+    return len(pks) - len(rewritten)
+
+
+faces.connect_milvus()
+for model in args.model or faces._models:
+    collection = faces.get_faces_collection(model)
+    faces.create_partitions(collection)
+    collection.load()
+    if args.create_only:
+        print(f"{collection.name}: partitions {list(faces._partitions.values())} created")
+        continue
+
+    tic = time.perf_counter()
+    moved = 0
+    iterator = collection.query_iterator(
+        batch_size=args.batch_size,
+        expr="user_picture_id != \"\"",
+        partition_names=[faces._default_partition],
+        output_fields=output_fields,
+    )
+    while True:
+        rows = iterator.next()
+        if not rows:
+            iterator.close()
+            break
+        moved += move(collection, rows)
+        print(f"{collection.name}: {moved} rows moved", end="\r")
+    collection.flush()
+    left = collection.query(
+        expr="user_picture_id != \"\"", partition_names=[faces._default_partition], limit=1, output_fields=["user_id"]
+    )
+    print(
+        f"{collection.name}: {moved} rows moved in {round(time.perf_counter() - tic, 1)} s, "
+        + ("default partition is empty" if len(left) == 0 else "rows were added to the default partition meanwhile, run again")
+    )
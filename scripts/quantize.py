@@ -0,0 +1,59 @@
+import argparse
+import glob
+import os
+import numpy as np
+import cv2
+from deepface import DeepFace
+from deepface.basemodels import SFace
+from deepface.commons import functions, quantization
+from deepface.extendedmodels import hsefer
+
+# ----------------------------------------------
+# produces INT8 variants of the emotion and SFace onnx models next to the fp32 weights.
+# Activation ranges are calibrated on the pictures of a local folder, pre-processed exactly
+# as the service does it. Check the result with tests/quantization-eval.py, then set
+# EMOTION_PRECISION / SFACE_PRECISION to int8.
+#
+#   python scripts/quantize.py emotion /path/to/liveness/frames
+#   python scripts/quantize.py sface /path/to/selfies
+
+parser = argparse.ArgumentParser(description="INT8 quantization of emotion and SFace models")
+parser.add_argument("model", choices=["emotion", "sface"])
+parser.add_argument("images", help="folder with calibration pictures")
+parser.add_argument("--limit", type=int, default=300, help="max count of calibration pictures")
+args = parser.parse_args()
+
+img_paths = sorted(glob.glob(os.path.join(args.images, "*.jpg")) + glob.glob(os.path.join(args.images, "*.png")))
+img_paths = img_paths[: args.limit]
+if len(img_paths) == 0:
+    raise ValueError(f"no jpg or png pictures found in {args.images}")
+
+home = functions.get_deepface_home()
+
+if args.model == "emotion":
+    model = hsefer.HSEmotionRecognizer()
+    model_path = home + "/.deepface/weights/enet_b0_8_best_vgaf.onnx"
+    # liveness frames are fed to the model as they are decoded
+    calibration_inputs = [model.preprocess(cv2.imread(img_path)) for img_path in img_paths]
+else:
+    model = SFace.load_model()
+    model_path = home + "/.deepface/weights/face_recognition_sface_2021dec.onnx"
+    calibration_inputs = []
+    for img_path in img_paths:
+        try:
+            _, face_objs = DeepFace.extract_faces_custom(
+                img_path=img_path,
+                target_size=(112, 112),
+                detector_backend="yunet",
+                keep_uint8=True,
+            )
+        except ValueError:
+            continue
+        # same scale as the service represents faces with
+        pixels = functions.uint8_model_input(
+            np.stack([face_objs[0]["face"]]), double_scaled=True, uint8_model=True
+        )
+        calibration_inputs.append(model.blob(list(pixels)))
+
+print(f"calibrating {model_path} on {len(calibration_inputs)} inputs")
+print(f"INT8 model is stored to {quantization.quantize(model_path, calibration_inputs)}")
@@ -0,0 +1,46 @@
+import time
+import numpy as np
+from deepface import DeepFace
+from deepface.basemodels import ArcFace, ArcFaceOnnx
+
+# ----------------------------------------------
+# compares tensorflow and onnx runtime ArcFace backends on tests/dataset images
+
+img_paths = [f"dataset/img{i}.jpg" for i in range(1, 8)]
+batch_sizes = [1, 7]
+rounds = 20
+
+faces = [
+    DeepFace.extract_faces(img_path=img_path, target_size=(112, 112))[0]["face"]
+    for img_path in img_paths
+]
+
+backends = {
+    "keras": ArcFace.loadModel(),
+    "onnx": ArcFaceOnnx.loadModel(),
+}
+
+# ----------------------------------------------
+# parity
+
+batch = np.stack(faces)
+keras_embeddings = backends["keras"].predict(batch, verbose=0)
+onnx_embeddings = backends["onnx"].predict(batch)
+print(f"max absolute difference: {np.abs(keras_embeddings - onnx_embeddings).max()}")
+
+# ----------------------------------------------
+# latency
+
+for batch_size in batch_sizes:
+    batch = np.stack(faces[:batch_size])
+    for backend, model in backends.items():
+        model.predict_on_batch(batch)  # warm up
+        tic = time.time()
+        for _ in range(rounds):
+            model.predict_on_batch(batch)
+        toc = time.time()
+        latency = (toc - tic) / rounds
+        print(
+            f"{backend} batch of {batch_size}: {round(latency * 1000, 2)} ms per call,"
+            f" {round(latency * 1000 / batch_size, 2)} ms per face"
+        )
@@ -0,0 +1,56 @@
+import time
+import numpy as np
+from deepface.commons import distance as dst
+
+# ----------------------------------------------
+# compares distances computed one pair at a time with the vectorized ones of
+# deepface.commons.distance for 7 (pictures of a similarity check), 1k and 1M embeddings
+
+sizes = [7, 1000, 1000000]
+dimensions = 128  # SFace
+rng = np.random.default_rng(0)
+
+
+def timeit(fn, rounds):
+    fn()  # warm up
+    tic = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - tic) / rounds
+
+
+for size in sizes:
+    matrix = rng.standard_normal((size, dimensions)).astype(np.float32)
+    matrix = dst.l2_normalize_rows(matrix)
+    embeddings = list(matrix)  # how embeddings are kept without the vectorized api
+    query = matrix[0] + 0.01
+    rounds = max(1, 100000 // size)
+
+    # ----------------------------------------------
+    # parity
+
+    pairs = np.array([dst.findEuclideanDistance(query, e) for e in embeddings])
+    print(f"N={size}: max difference {np.abs(pairs - dst.find_distances(query, matrix)).max()}")
+
+    # ----------------------------------------------
+    # latency
+
+    results = {
+        "per pair euclidean": timeit(
+            lambda: [dst.findEuclideanDistance(query, e) for e in embeddings], rounds
+        ),
+        "find_distances euclidean": timeit(lambda: dst.find_distances(query, matrix), rounds),
+        "per pair cosine": timeit(
+            lambda: [dst.findCosineDistance(query, e) for e in embeddings], rounds
+        ),
+        "find_distances cosine": timeit(
+            lambda: dst.find_distances(query, matrix, "cosine"), rounds
+        ),
+        "top_k 10": timeit(lambda: dst.top_k(query, matrix, 10, threshold=1.055), rounds),
+    }
+    if size <= 1000:
+        results["pairwise 7 x N"] = timeit(
+            lambda: dst.pairwise_distances(matrix[:7], matrix), rounds
+        )
+    for name, seconds in results.items():
+        print(f"N={size}: {name}: {round(seconds * 1000, 4)} ms")
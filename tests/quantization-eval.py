@@ -0,0 +1,76 @@
+import argparse
+import glob
+import itertools
+import os
+import sys
+import numpy as np
+import cv2
+from deepface import DeepFace
+from deepface.basemodels import SFace
+from deepface.commons import functions, distance as dst
+from deepface.extendedmodels import hsefer
+
+# ----------------------------------------------
+# compares INT8 models made by scripts/quantize.py with the fp32 ones on a local folder:
+# argmax agreement of the emotion model, and embedding drift of SFace together with the
+# verification decisions at the threshold of distance.findThreshold.
+
+parser = argparse.ArgumentParser(description="accuracy of INT8 emotion and SFace models")
+parser.add_argument("images", help="folder with jpg or png pictures")
+parser.add_argument("--min-emotion-agreement", type=float, default=0.98)
+parser.add_argument("--max-flipped-pairs", type=float, default=0.0, help="share of pairs")
+args = parser.parse_args()
+
+img_paths = sorted(glob.glob(os.path.join(args.images, "*.jpg")) + glob.glob(os.path.join(args.images, "*.png")))
+imgs = [cv2.imread(img_path) for img_path in img_paths]
+passed = True
+
+# ----------------------------------------------
+# emotion
+
+fp32_emotion = hsefer.HSEmotionRecognizer()
+int8_emotion = hsefer.HSEmotionRecognizer(quantized=True)
+fp32_preds, fp32_scores = fp32_emotion.predict_multi_emotions(imgs, logits=False)
+int8_preds, int8_scores = int8_emotion.predict_multi_emotions(imgs, logits=False)
+agreement = np.mean([a == b for a, b in zip(fp32_preds, int8_preds)])
+print(f"emotion argmax agreement: {round(agreement * 100, 2)}% of {len(imgs)} pictures")
+print(f"emotion max score difference: {np.abs(fp32_scores - int8_scores).max()}")
+passed = passed and agreement >= args.min_emotion_agreement
+
+# ----------------------------------------------
+# SFace
+
+faces = []
+for img in imgs:
+    try:
+        _, face_objs = DeepFace.extract_faces_custom(
+            img_path=img, target_size=(112, 112), detector_backend="yunet", keep_uint8=True
+        )
+        faces.append(face_objs[0]["face"])
+    except ValueError:
+        continue
+# same scale as the service represents faces with
+pixels = functions.uint8_model_input(np.stack(faces), double_scaled=True, uint8_model=True)
+embeddings = {}
+for name, model in [("fp32", SFace.load_model()), ("int8", SFace.load_model(quantized=True))]:
+    embeddings[name] = np.array([dst.l2_normalize(e) for e in model.predict_uint8(pixels)])
+
+drift = np.linalg.norm(embeddings["fp32"] - embeddings["int8"], axis=1)
+print(f"sface embedding drift (l2) over {len(faces)} faces: mean {drift.mean()}, max {drift.max()}")
+
+threshold = dst.findThreshold("SFace", "euclidean_l2")
+pairs = list(itertools.combinations(range(len(faces)), 2))
+flipped = 0
+distance_diff = 0
+for i, j in pairs:
+    fp32_distance = dst.findEuclideanDistance(embeddings["fp32"][i], embeddings["fp32"][j])
+    int8_distance = dst.findEuclideanDistance(embeddings["int8"][i], embeddings["int8"][j])
+    distance_diff = max(distance_diff, abs(fp32_distance - int8_distance))
+    flipped += (fp32_distance <= threshold) != (int8_distance <= threshold)
+flipped_share = flipped / max(len(pairs), 1)
+print(f"sface max pair distance difference: {distance_diff}")
+print(f"sface decisions flipped at threshold {threshold}: {flipped} of {len(pairs)} pairs")
+passed = passed and flipped_share <= args.max_flipped_pairs
+
+print("PASSED" if passed else "FAILED")
+sys.exit(0 if passed else 1)
@@ -0,0 +1,50 @@
+import sys
+import time
+import numpy as np
+from deepface.commons import search
+
+# ----------------------------------------------
+# latency of the find search indexes on random embeddings, and recall@10 of the approximate
+# ones against brute force. hnsw and ivf are skipped if hnswlib or faiss is not installed.
+#
+#   python search-benchmark.py [count of db embeddings, default 300000]
+
+size = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+dimensions = 128  # SFace
+queries_count = 100
+k = 10
+metric = "euclidean_l2"
+
+rng = np.random.default_rng(0)
+matrix = rng.standard_normal((size, dimensions)).astype(np.float32)
+queries = matrix[rng.choice(size, queries_count, replace=False)] + 0.05 * rng.standard_normal(
+    (queries_count, dimensions)
+).astype(np.float32)
+
+exact = None
+for kind in ["brute_force", "hnsw", "ivf"]:
+    try:
+        tic = time.perf_counter()
+        index = search.build_index(matrix, metric, kind=kind)
+        built = time.perf_counter() - tic
+    except ImportError as err:
+        print(f"{kind}: skipped, {err}")
+        continue
+
+    tic = time.perf_counter()
+    for query in queries:
+        index.search(query, k=k)
+    one_to_many = (time.perf_counter() - tic) / queries_count
+
+    tic = time.perf_counter()
+    results = index.search(queries, k=k)
+    many_to_many = time.perf_counter() - tic
+
+    found = [set(indices.tolist()) for indices, _ in results]
+    if exact is None:
+        exact = found
+    recall = np.mean([len(f & e) / k for f, e in zip(found, exact)])
+    print(
+        f"{kind}: built in {round(built, 2)} s, 1 query {round(one_to_many * 1000, 3)} ms, "
+        + f"{queries_count} queries {round(many_to_many * 1000, 3)} ms, recall@{k} {recall}"
+    )
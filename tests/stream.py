@@ -6,3 +6,5 @@ DeepFace.stream("dataset") #opencv
 #DeepFace.stream("dataset", detector_backend = 'mtcnn')
 #DeepFace.stream("dataset", detector_backend = 'dlib')
 #DeepFace.stream("dataset", detector_backend = 'retinaface')
+#DeepFace.stream("dataset", source = "video.mp4", display = False) # headless, prints fps and latency of every stage
+#DeepFace.stream("dataset", pipelined = False) # former single loop
@@ -1,10 +1,28 @@
 import warnings
 import os
+import pickle
+import shutil
+import tempfile
+import threading
 import tensorflow as tf
 import numpy as np
 import pandas as pd
 import cv2
+from concurrent.futures import ThreadPoolExecutor
 from deepface import DeepFace
+from deepface.basemodels import ArcFace, ArcFaceOnnx
+from deepface.extendedmodels import Age, Emotion, Gender, hsefer
+from deepface.commons import (
+    distance as dst,
+    functions,
+    alignment,
+    search,
+    store,
+    indexer,
+    matrix_file,
+    pipeline,
+)
+from deepface.detectors import FaceDetector, YunetWrapper
 
 # pylint: disable=consider-iterating-dictionary
 
@@ -155,6 +173,242 @@ def test_cases():
 
     print("-----------------------------------------")
 
+    print("Batch represent test")
+
+    face_objs = DeepFace.extract_faces(img_path="dataset/couple.jpg", target_size=(112, 112))
+    faces = [face_obj["face"] for face_obj in face_objs]
+    for model_name in ["ArcFace", "SFace"]:
+        embeddings = DeepFace.represent_batch(faces, model_name=model_name)
+        assert embeddings.shape[0] == len(faces)
+        for face, embedding in zip(faces, embeddings):
+            expected = DeepFace.represent(face, model_name=model_name, detector_backend="skip")
+            expected = dst.l2_normalize(expected[0]["embedding"])
+            evaluate(np.allclose(embedding, expected, atol=1e-4))
+
+    print("-----------------------------------------")
+
+    print("Batch verify test")
+
+    pairs = [(img1, img2) for img1, img2, _ in dataset] + [("dataset/couple.jpg", "dataset/img1.jpg")]
+    results = DeepFace.verify_batch(pairs, model_name="SFace", batch_size=4)
+    evaluate([result["verified"] for result in results[:-1]] == [label for _, _, label in dataset])
+    # the closest faces of couple.jpg and img1.jpg
+    face = DeepFace.extract_faces(img_path="dataset/img1.jpg", target_size=(112, 112))[0]["face"]
+    couple_embeddings = DeepFace.represent_batch(faces, model_name="SFace", l2_normalize=False)
+    embedding = DeepFace.represent_batch([face], model_name="SFace", l2_normalize=False)[0]
+    for metric in metrics:
+        result = DeepFace.verify_batch([pairs[-1]], model_name="SFace", distance_metric=metric)[0]
+        expected = dst.find_distances(embedding, couple_embeddings, metric).min()
+        evaluate(np.isclose(result["distance"], expected))
+    black_img = np.zeros([224, 224, 3])
+    results = DeepFace.verify_batch([(black_img, "dataset/img1.jpg"), pairs[0]], skip_errors=True)
+    evaluate("error" in results[0] and "verified" in results[1])
+
+    print("-----------------------------------------")
+
+    print("uint8 preprocessing test")
+
+    _, float_objs = DeepFace.extract_faces_custom(img_path="dataset/couple.jpg", target_size=(112, 112))
+    _, uint8_objs = DeepFace.extract_faces_custom(
+        img_path="dataset/couple.jpg", target_size=(112, 112), keep_uint8=True
+    )
+    for model_name in ["ArcFace", "SFace"]:
+        expected = DeepFace.represent_batch([obj["face"] for obj in float_objs], model_name=model_name)
+        embeddings = DeepFace.represent_batch(
+            [obj["face"] for obj in uint8_objs], model_name=model_name, double_scaled=True
+        )
+        evaluate(np.array_equal(embeddings, expected))
+    black_img = np.zeros((100, 100, 3), np.uint8)
+    face = DeepFace.extract_faces(black_img, target_size=(112, 112), detector_backend="skip", enforce_detection=False)
+    evaluate(face[0]["face"].shape == (112, 112, 3) and face[0]["face"].dtype != np.uint8)
+    face = DeepFace.extract_faces(
+        black_img, target_size=(112, 112), detector_backend="skip", enforce_detection=False, keep_uint8=True
+    )
+    evaluate(face[0]["face"].shape == (112, 112, 3) and face[0]["face"].dtype == np.uint8)
+
+    print("-----------------------------------------")
+
+    print("Affine alignment test")
+
+    # a rotated, scaled and shifted template must be warped back onto the template
+    angle = np.deg2rad(17)
+    rotation = 2.3 * np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    landmarks = alignment.reference_landmarks @ rotation.T + [200, 130]
+    for points in [landmarks, landmarks[:2]]:
+        matrix = alignment.similarity_transform(points)
+        warped = points @ matrix[:, :2].T + matrix[:, 2]
+        evaluate(np.allclose(warped, alignment.reference_landmarks[: len(points)], atol=1e-3))
+    img = cv2.imread("dataset/img1.jpg")
+    evaluate(alignment.warp_face(img, landmarks).shape == (112, 112, 3))
+
+    print("-----------------------------------------")
+
+    print("Vectorized distances test")
+
+    embeddings = np.random.default_rng(0).standard_normal((50, 128))
+    query = embeddings[7] + 0.01
+    pairs = [dst.findEuclideanDistance(query, e) for e in embeddings]
+    evaluate(np.array_equal(dst.find_distances(query, embeddings), pairs))
+    for metric in ["cosine", "euclidean", "euclidean_l2"]:
+        evaluate(
+            np.allclose(
+                dst.pairwise_distances(embeddings[:3], embeddings, metric)[2],
+                dst.find_distances(embeddings[2], embeddings, metric),
+            )
+        )
+        evaluate(
+            np.allclose(
+                dst.paired_distances(embeddings[:3], embeddings[3:6], metric),
+                dst.pairwise_distances(embeddings[:3], embeddings[3:6], metric).diagonal(),
+            )
+        )
+    indices, distances = dst.top_k(query, embeddings, 3, threshold=min(pairs) + 1e-9)
+    evaluate(indices.tolist() == [7] and distances[0] == min(pairs))
+
+    print("-----------------------------------------")
+
+    print("Search index test")
+
+    index = search.build_index(embeddings, "euclidean_l2")
+    results = index.search(embeddings[[3, 11]] + 0.01, k=5, threshold=1.0)
+    evaluate([indices[0] for indices, _ in results] == [3, 11])
+    evaluate(all(np.all(np.diff(distances) >= 0) for _, distances in results))
+
+    print("-----------------------------------------")
+
+    print("Representation store test")
+
+    with tempfile.TemporaryDirectory() as db_path:
+        for img_name in ["img1.jpg", "img2.jpg", "img3.jpg"]:
+            shutil.copy(f"dataset/{img_name}", db_path)
+        embedded = []
+        embed = lambda faces: [embedded.append(face) or np.full(4, len(embedded)) for face in faces]
+        refresh = lambda db_store, embed: indexer.refresh(
+            db_store, embed, target_size=(8, 8), detector_backend="skip", silent=True
+        )
+        db_store = store.RepresentationStore(db_path, "representations_test")
+        evaluate(refresh(db_store, embed) == (3, 0))
+        # only the delta is embedded by the next refresh
+        os.remove(f"{db_path}/img1.jpg")
+        shutil.copy("dataset/img4.jpg", f"{db_path}/img2.jpg")
+        db_store = store.RepresentationStore(db_path, "representations_test")
+        evaluate(refresh(db_store, embed) == (1, 1) and len(embedded) == 4)
+        identities, matrix = db_store.load()
+        evaluate(sorted(identities) == [f"{db_path}/img2.jpg", f"{db_path}/img3.jpg"])
+        evaluate(matrix[identities.index(f"{db_path}/img2.jpg")][0] == 4)
+
+    print("-----------------------------------------")
+
+    print("Memory mapped matrix file test")
+
+    with tempfile.TemporaryDirectory() as db_path:
+        matrix_file.save(f"{db_path}/matrix", ["a", "b"], embeddings[:2], dtype="float16")
+        identities, matrix = matrix_file.load(f"{db_path}/matrix")
+        evaluate(identities == ["a", "b"] and isinstance(matrix, np.memmap))
+        evaluate(np.allclose(matrix, embeddings[:2], atol=1e-2))
+        # pickled representations of former versions are imported instead of embedded again
+        shutil.copy("dataset/img1.jpg", db_path)
+        with open(f"{db_path}/representations_test.pkl", "wb") as f:
+            pickle.dump([[f"{db_path}/img1.jpg", embeddings[0].tolist()]], f)
+        db_store = store.RepresentationStore(db_path, "representations_test")
+        evaluate(db_store.import_pickle(f"{db_path}/representations_test.pkl") == 1)
+        evaluate(refresh(db_store, lambda faces: []) == (0, 0))
+        identities, matrix = db_store.load()
+        evaluate(identities == [f"{db_path}/img1.jpg"] and np.allclose(matrix[0], embeddings[0]))
+
+    print("-----------------------------------------")
+
+    print("Parallel indexer test")
+
+    represent_faces = lambda faces: DeepFace.represent_batch(faces, model_name="SFace")
+    matrices = []
+    with tempfile.TemporaryDirectory() as db_path:
+        for img_name in ["img1.jpg", "img2.jpg", "img3.jpg", "couple.jpg"]:
+            shutil.copy(f"dataset/{img_name}", db_path)
+        for workers in [1, 2]:
+            db_store = store.RepresentationStore(db_path, f"representations_{workers}")
+            result = indexer.refresh(
+                db_store, represent_faces, (112, 112), "opencv", workers=workers, silent=True
+            )
+            evaluate(result == (4, 0))
+            identities, matrix = db_store.load()
+            matrices.append(matrix[np.argsort(identities, kind="stable")])
+    evaluate(np.array_equal(matrices[0], matrices[1]))
+
+    print("-----------------------------------------")
+
+    print("ArcFace onnx runtime parity test")
+
+    keras_model = ArcFace.loadModel()
+    onnx_model = ArcFaceOnnx.loadModel()
+    for img_path in ["dataset/img1.jpg", "dataset/img2.jpg", "dataset/img3.jpg"]:
+        face = DeepFace.extract_faces(img_path=img_path, target_size=(112, 112))[0]["face"]
+        face = np.expand_dims(face, axis=0)
+        keras_embedding = keras_model.predict(face, verbose=0)[0]
+        onnx_embedding = onnx_model.predict(face)[0]
+        evaluate(np.allclose(keras_embedding, onnx_embedding, atol=1e-3))
+
+    print("-----------------------------------------")
+
+    print("Shared model registry test")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        built_models = list(executor.map(DeepFace.build_model, ["SFace"] * 4))
+    evaluate(all(built_model is built_models[0] for built_model in built_models))
+
+    print("-----------------------------------------")
+
+    print("Face detector cache test")
+
+    img = cv2.imread("dataset/img1.jpg")
+    input_size = FaceDetector.input_size_class("yunet", img)
+    evaluate(FaceDetector.build_model("yunet", input_size) is FaceDetector.build_model("yunet", input_size))
+    # detections on the cached detector of the size class are the same as on a fresh one
+    cached = FaceDetector.detect_faces(FaceDetector.build_model("yunet", input_size), "yunet", img)
+    fresh = YunetWrapper.detect_face(YunetWrapper.build_model(), img)
+    evaluate([region for _, region, _ in cached] == [region for _, region, _ in fresh])
+
+    print("-----------------------------------------")
+
+    print("Batched emotion inference test")
+
+    # micro-batching is off by default, a recognizer with it enabled is compared with the unbatched one
+    frames = [cv2.imread(f"dataset/img{i}.jpg") for i in range(1, 8)]
+    # every caller sends different frames, so it has to get back its own rows of the batch
+    caller_frames = [frames[i : i + 4] for i in range(4)]
+    unbatched_model = DeepFace.build_model("Emotion")
+    evaluate(unbatched_model.batcher is None)
+    expected = [
+        unbatched_model.predict_multi_emotions(face_img_list=f, logits=False)[1]
+        for f in caller_frames
+    ]
+
+    os.environ["EMOTION_MAX_BATCH_SIZE"] = "60"
+    os.environ["EMOTION_MAX_BATCH_WAIT_MS"] = "200"
+    try:
+        emotion_model = hsefer.loadModel()
+    finally:
+        del os.environ["EMOTION_MAX_BATCH_SIZE"]
+        del os.environ["EMOTION_MAX_BATCH_WAIT_MS"]
+    evaluate(emotion_model.batcher is not None)
+    batch_sizes = []
+    run_batch = emotion_model.batcher._run
+    emotion_model.batcher._run = lambda imgs: batch_sizes.append(len(imgs)) or run_batch(imgs)
+    barrier = threading.Barrier(len(caller_frames))
+
+    def predict_together(f):
+        barrier.wait()
+        return emotion_model.predict_multi_emotions(face_img_list=f, logits=False)
+
+    with ThreadPoolExecutor(max_workers=len(caller_frames)) as executor:
+        results = list(executor.map(predict_together, caller_frames))
+    # concurrent calls were coalesced into fewer model runs
+    evaluate(len(batch_sizes) < len(caller_frames) and sum(batch_sizes) == 16)
+    for (_, scores), expected_scores in zip(results, expected):
+        evaluate(np.allclose(scores, expected_scores, atol=1e-5))
+
+    print("-----------------------------------------")
+
     print("Different face detectors on verification test")
 
     for detector in detectors:
@@ -241,6 +495,32 @@ def test_cases():
 
     print("-----------------------------------------")
 
+    print("Batched facial analysis test")
+
+    img_paths = ["dataset/couple.jpg", img]
+    results = DeepFace.analyze_batch(img_paths, ["age", "gender", "emotion"], batch_size=2)
+    for img_path, demography_objs in zip(img_paths, results):
+        expected_objs = DeepFace.analyze(img_path, ["age", "gender", "emotion"])
+        evaluate(len(demography_objs) == len(expected_objs))
+        for demography, expected in zip(demography_objs, expected_objs):
+            evaluate(demography["region"] == expected["region"])
+            evaluate(abs(demography["age"] - expected["age"]) <= 1)
+            evaluate(demography["dominant_emotion"] == expected["dominant_emotion"])
+    # batched predictions match the former per face model calls on the same crop
+    img_content, img_region, _ = functions.extract_faces(
+        img=img, target_size=(224, 224), detector_backend="opencv", grayscale=False
+    )[0]
+    demography = results[1][0]
+    evaluate(demography["region"] == img_region)
+    age_predictions = DeepFace.build_model("Age").predict(img_content, verbose=0)[0, :]
+    evaluate(abs(demography["age"] - int(Age.findApparentAge(age_predictions))) <= 1)
+    gender_predictions = DeepFace.build_model("Gender").predict(img_content, verbose=0)[0, :]
+    evaluate(demography["dominant_gender"] == Gender.labels[np.argmax(gender_predictions)])
+    demography = DeepFace.analyze(img, ["emotion"], emotion_model="fer")[0]
+    evaluate(set(demography["emotion"].keys()) == set(Emotion.labels))
+
+    print("-----------------------------------------")
+
     print("Facial recognition tests")
 
     for model in models:
@@ -327,6 +607,33 @@ def test_cases():
 
     print("--------------------------")
 
+    print("Pipelined stream test")
+
+    # a video file of a moving face is processed headless, every frame reaches the display stage
+    img = cv2.imread("dataset/img1.jpg")
+    img = cv2.resize(img, (640, 640 * img.shape[0] // img.shape[1]))
+    with tempfile.TemporaryDirectory() as tmp_path:
+        video_path = f"{tmp_path}/stream.avi"
+        writer = cv2.VideoWriter(
+            video_path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (img.shape[1], img.shape[0])
+        )
+        for i in range(30):
+            writer.write(np.roll(img, 2 * i, axis=1))
+        writer.release()
+        identities = []
+        stats = pipeline.Pipeline(
+            "dataset", enable_face_analysis=False, frame_threshold=2, min_face_size=50
+        ).run(
+            video_path,
+            display=False,
+            on_frame=lambda _, __, tracks: identities.extend(track[2] for track in tracks),
+        )
+    evaluate(stats["capture"]["frames"] == 30 and stats["display"]["frames"] == 30)
+    evaluate(stats["recognition"]["frames"] > 0 and stats["display"]["latency_ms"] > 0)
+    evaluate(any(identity is not None for identity in identities))
+
+    print("-----------------------------------------")
+
     print("non-binary gender tests")
 
     # interface validation - no need to call evaluate here